@@ -0,0 +1,358 @@
+import logging
+import socket
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from network.mqtt.mqttresponsecode import MqttResponseCode
+
+# Tipos de paquete de MQTT 3.1.1
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+# Códigos de retorno que admite un CONNACK
+CONNACK_CODES = [MqttResponseCode.NO_ERROR, MqttResponseCode.CONN_REFUSED, MqttResponseCode.CONN_REFUSED_ID_REJECTED,
+                 MqttResponseCode.CONN_REFUSED_SERVER_UNAVAILABLE, MqttResponseCode.CONN_REFUSED_BAD_USER_PASS,
+                 MqttResponseCode.CONN_REFUSED_AUTH_ERROR]
+
+
+@dataclass
+class ReceivedMessage:
+    client_id: str
+    topic: str
+    payload: bytes
+    qos: int
+    received_at: float  # time.monotonic() al terminar de leer el PUBLISH
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    filter_levels = topic_filter.split('/')
+    topic_levels = topic.split('/')
+    for indx, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if indx >= len(topic_levels) or (level != '+' and level != topic_levels[indx]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+class BrokerSession:
+    def __init__(self, connection: socket.socket, address):
+        self.connection = connection
+        self.address = address
+        self.client_id = None
+        # filtro -> qos concedida
+        self.subscriptions: Dict[str, int] = {}
+        self.send_lock = threading.Lock()
+        self.next_mid = 0
+
+    def send(self, packet_type: int, flags: int, body: bytes):
+        with self.send_lock:
+            self.connection.sendall(bytes([(packet_type << 4) | flags]) + encode_length(len(body)) + body)
+
+    def get_mid(self) -> int:
+        with self.send_lock:
+            self.next_mid = self.next_mid % 65535 + 1
+            return self.next_mid
+
+
+def encode_length(length: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        encoded.append(byte | 0x80 if length > 0 else byte)
+        if length == 0:
+            return bytes(encoded)
+
+
+def encode_string(value: str) -> bytes:
+    encoded = value.encode()
+    return struct.pack('>H', len(encoded)) + encoded
+
+
+class LocalMqttBroker:
+    # Broker MQTT 3.1.1 mínimo para pruebas y benchmarks. Acepta conexiones, publicaciones con qos 0, 1 y 2 y
+    # suscripciones con comodines, y permite inyectar fallos: cortar las conexiones, retrasar CONNACK o PUBACK y
+    # rechazar las conexiones con un MqttResponseCode. De las sesiones persistentes (clean_session = 0) solo guarda las
+    # suscripciones, no los mensajes pendientes; tampoco guarda mensajes retenidos
+    DEFAULT_HOST = '127.0.0.1'
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = 0, on_message: Callable[[ReceivedMessage], None] = None,
+                 record_messages: bool = True):
+        self.host = host
+        self.port = port
+        self.on_message = on_message
+        self.record_messages = record_messages
+        self.received: List[ReceivedMessage] = []
+        self.sessions: List[BrokerSession] = []
+        # client id -> suscripciones de las sesiones persistentes
+        self.persistent_sessions: Dict[str, Dict[str, int]] = {}
+        self.lock = threading.Lock()
+        self.server_socket = None
+        self.accept_thread = None
+        self.running = False
+        # Fallos inyectados
+        self.connack_delay = 0.0
+        self.puback_delay = 0.0
+        self.connack_code = MqttResponseCode.NO_ERROR
+        self.stats = {'connections': 0, 'refused': 0, 'dropped': 0, 'published': 0, 'delivered': 0,
+                      'sessions_resumed': 0, 'subscriptions': 0}
+
+    def __enter__(self):
+        self.init_context()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close_context()
+
+    def init_context(self):
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((self.host, self.port))
+        # Con port = 0 el sistema elige un puerto libre
+        self.port = self.server_socket.getsockname()[1]
+        self.server_socket.listen()
+        self.running = True
+        self.accept_thread = threading.Thread(name="LocalMqttBroker", target=self.__accept__, daemon=True)
+        self.accept_thread.start()
+        logging.info(f"Local MQTT broker listening on {self.host}:{self.port}.")
+
+    def close_context(self):
+        self.running = False
+        try:
+            # shutdown despierta al hilo bloqueado en accept
+            self.server_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.server_socket.close()
+        self.accept_thread.join()
+        self.drop_connections()
+
+    def refuse_connections(self, response_code: MqttResponseCode = MqttResponseCode.CONN_REFUSED_SERVER_UNAVAILABLE):
+        # Las conexiones nuevas reciben un CONNACK con este código. NO_ERROR las vuelve a aceptar
+        if response_code not in CONNACK_CODES:
+            raise ValueError(f"{response_code!r} can't be sent in a CONNACK")
+        self.connack_code = response_code
+
+    def drop_connections(self) -> int:
+        # Corta todas las conexiones sin enviar nada, como una caída de red o del broker
+        with self.lock:
+            sessions = list(self.sessions)
+            self.sessions = []
+            self.stats['dropped'] += len(sessions)
+        for session in sessions:
+            self.__close_session__(session)
+        return len(sessions)
+
+    def get_connected_clients(self) -> List[str]:
+        with self.lock:
+            return [session.client_id for session in self.sessions if session.client_id is not None]
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def clear(self):
+        with self.lock:
+            self.received = []
+
+    def wait_for_messages(self, count: int, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if self.stats['published'] >= count:
+                    return True
+            time.sleep(0.001)
+        return False
+
+    def __accept__(self):
+        while self.running:
+            try:
+                connection, address = self.server_socket.accept()
+            except OSError:
+                return
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            session = BrokerSession(connection, address)
+            threading.Thread(name=f"LocalMqttBroker-{address[1]}", target=self.__serve__, args=(session,),
+                             daemon=True).start()
+
+    def __serve__(self, session: BrokerSession):
+        try:
+            while self.running:
+                header = self.__read__(session, 1)
+                if header is None:
+                    return
+                body = self.__read__(session, self.__read_length__(session))
+                if body is None:
+                    return
+                if not self.__handle__(session, header[0] >> 4, header[0] & 0x0F, body):
+                    return
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self.lock:
+                if session in self.sessions:
+                    self.sessions.remove(session)
+            self.__close_session__(session)
+
+    def __handle__(self, session: BrokerSession, packet_type: int, flags: int, body: bytes) -> bool:
+        if packet_type == CONNECT:
+            return self.__handle_connect__(session, body)
+        if session.client_id is None:
+            # El primer paquete tiene que ser CONNECT
+            return False
+        if packet_type == PUBLISH:
+            self.__handle_publish__(session, flags, body)
+        elif packet_type == PUBREL:
+            session.send(PUBCOMP, 0, body[:2])
+        elif packet_type == SUBSCRIBE:
+            self.__handle_subscribe__(session, body)
+        elif packet_type == UNSUBSCRIBE:
+            indx = 2
+            while indx < len(body):
+                length = struct.unpack('>H', body[indx:indx + 2])[0]
+                session.subscriptions.pop(body[indx + 2:indx + 2 + length].decode(), None)
+                indx += 2 + length
+            session.send(UNSUBACK, 0, body[:2])
+        elif packet_type == PINGREQ:
+            session.send(PINGRESP, 0, b'')
+        elif packet_type == DISCONNECT:
+            return False
+        # PUBACK, PUBREC y PUBCOMP de las entregas a los suscriptores no necesitan respuesta
+        return True
+
+    def __handle_connect__(self, session: BrokerSession, body: bytes) -> bool:
+        indx = 2 + struct.unpack('>H', body[:2])[0]  # Nombre del protocolo
+        clean_session = body[indx + 1] & 0x02
+        indx += 4  # Nivel del protocolo, flags y keepalive
+        length = struct.unpack('>H', body[indx:indx + 2])[0]
+        session.client_id = body[indx + 2:indx + 2 + length].decode()
+        if self.connack_delay > 0:
+            time.sleep(self.connack_delay)
+        response_code = self.connack_code
+        with self.lock:
+            session_present = 0
+            if response_code == MqttResponseCode.NO_ERROR:
+                if clean_session:
+                    self.persistent_sessions.pop(session.client_id, None)
+                elif session.client_id in self.persistent_sessions:
+                    session.subscriptions = self.persistent_sessions[session.client_id]
+                    session_present = 1
+                    self.stats['sessions_resumed'] += 1
+                else:
+                    self.persistent_sessions[session.client_id] = session.subscriptions
+        session.send(CONNACK, 0, bytes([session_present, response_code.value]))
+        with self.lock:
+            if response_code != MqttResponseCode.NO_ERROR:
+                self.stats['refused'] += 1
+                return False
+            self.stats['connections'] += 1
+            self.sessions.append(session)
+        return True
+
+    def __handle_publish__(self, session: BrokerSession, flags: int, body: bytes):
+        qos = (flags >> 1) & 0x03
+        length = struct.unpack('>H', body[:2])[0]
+        topic = body[2:2 + length].decode()
+        indx = 2 + length
+        mid = None
+        if qos > 0:
+            mid = body[indx:indx + 2]
+            indx += 2
+        payload = body[indx:]
+        message = ReceivedMessage(client_id=session.client_id, topic=topic, payload=payload, qos=qos,
+                                  received_at=time.monotonic())
+        with self.lock:
+            self.stats['published'] += 1
+            if self.record_messages:
+                self.received.append(message)
+        if self.on_message is not None:
+            self.on_message(message)
+        self.__forward__(topic, payload, qos)
+        if qos == 1:
+            if self.puback_delay > 0:
+                # El hilo de la conexión se bloquea, igual que un broker lento que no lee los siguientes paquetes
+                time.sleep(self.puback_delay)
+            session.send(PUBACK, 0, mid)
+        elif qos == 2:
+            session.send(PUBREC, 0, mid)
+
+    def __handle_subscribe__(self, session: BrokerSession, body: bytes):
+        granted = bytearray()
+        indx = 2
+        while indx < len(body):
+            length = struct.unpack('>H', body[indx:indx + 2])[0]
+            topic_filter = body[indx + 2:indx + 2 + length].decode()
+            # Las entregas a los suscriptores solo se hacen con qos 0 o 1
+            qos = min(body[indx + 2 + length], 1)
+            session.subscriptions[topic_filter] = qos
+            granted.append(qos)
+            with self.lock:
+                self.stats['subscriptions'] += 1
+            indx += 3 + length
+        session.send(SUBACK, 0, body[:2] + bytes(granted))
+
+    def __forward__(self, topic: str, payload: bytes, qos: int):
+        with self.lock:
+            sessions = list(self.sessions)
+        for session in sessions:
+            granted = [sub_qos for topic_filter, sub_qos in list(session.subscriptions.items())
+                       if topic_matches(topic_filter, topic)]
+            if not granted:
+                continue
+            delivery_qos = min(qos, max(granted))
+            body = encode_string(topic)
+            if delivery_qos > 0:
+                body += struct.pack('>H', session.get_mid())
+            try:
+                session.send(PUBLISH, delivery_qos << 1, body + payload)
+                with self.lock:
+                    self.stats['delivered'] += 1
+            except OSError:
+                pass
+
+    def __read_length__(self, session: BrokerSession) -> int:
+        multiplier = 1
+        length = 0
+        for _ in range(4):
+            byte = self.__read__(session, 1)
+            if byte is None:
+                raise ValueError("Connection closed while reading remaining length")
+            length += (byte[0] & 0x7F) * multiplier
+            if not byte[0] & 0x80:
+                return length
+            multiplier *= 128
+        raise ValueError("Malformed remaining length")
+
+    @staticmethod
+    def __read__(session: BrokerSession, size: int) -> Optional[bytes]:
+        data = bytearray()
+        while len(data) < size:
+            chunk = session.connection.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return bytes(data)
+
+    @staticmethod
+    def __close_session__(session: BrokerSession):
+        try:
+            session.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        session.connection.close()
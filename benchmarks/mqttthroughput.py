@@ -0,0 +1,224 @@
+import argparse
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+from benchmarks.mqttbroker import LocalMqttBroker, ReceivedMessage
+from benchmarks.presslatency import percentiles, print_report
+from network.mqtt.mqttclient import MqttClient, MqttLoopType
+from network.mqtt.mqttresponsecode import MqttResponseCode
+from network.mqtt.mqtttopic import MqttTopic
+from network.url import BasicAuthURL
+
+TOPIC_NAME = 'benchmark/mqtt'
+
+
+class MqttBenchmark:
+    # Mide un MqttClient contra el broker local: mensajes por segundo, latencia desde publish() hasta que el broker
+    # recibe el mensaje y tiempo de recuperación después de cortar la conexión
+    CONNECT_TIMEOUT = 5.0
+
+    def __init__(self, broker: LocalMqttBroker, loop_type: MqttLoopType, async_publish: bool, qos: int = 0,
+                 queue_size: int = 100000, persistent_session: bool = False, keepalive: int = 60):
+        self.broker = broker
+        self.loop_type = loop_type
+        self.async_publish = async_publish
+        self.topic = MqttTopic(name=TOPIC_NAME, qos=qos)
+        self.queue_size = queue_size
+        self.persistent_session = persistent_session
+        self.keepalive = keepalive
+        self.client = None
+        self.loop_thread = None
+        self.sent_at: Dict[int, float] = {}
+        self.latencies: List[float] = []
+        self.received_after: Optional[float] = None
+        self.first_received_at: Optional[float] = None
+        self.lock = threading.Lock()
+        broker.on_message = self.__on_message__
+
+    def __enter__(self):
+        self.init_context()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close_context()
+
+    def init_context(self):
+        url = BasicAuthURL(protocol="mqtt", hostname=self.broker.host, port=self.broker.port)
+        self.client = MqttClient(broker_url=url, loop_type=self.loop_type, async_publish=self.async_publish,
+                                 max_queue_size=self.queue_size, reconnect_min_delay=0.05, reconnect_max_delay=0.5,
+                                 name=self.get_name(), persistent_session=self.persistent_session,
+                                 keepalive=self.keepalive)
+        self.client.init_context()
+        if not self.async_publish and self.loop_type != MqttLoopType.NO_LOOP:
+            if self.loop_type == MqttLoopType.NOT_BLOCKING:
+                self.client.start_loop()
+            else:
+                # Los loops BLOCKING y CUSTOM no vuelven hasta que se para el cliente
+                self.loop_thread = threading.Thread(name="MqttBenchmarkLoop", target=self.client.start_loop,
+                                                    daemon=True)
+                self.loop_thread.start()
+        deadline = time.monotonic() + self.CONNECT_TIMEOUT
+        while len(self.broker.get_connected_clients()) == 0 and time.monotonic() < deadline:
+            time.sleep(0.001)
+
+    def close_context(self):
+        self.client.close_context()
+        if self.loop_thread is not None:
+            self.loop_thread.join(timeout=2)
+            self.loop_thread = None
+
+    def get_name(self) -> str:
+        return get_mode_name(self.loop_type, self.async_publish)
+
+    def run_throughput(self, messages: int, timeout: float = 30.0):
+        baseline = self.broker.get_stats()['published']
+        errors = 0
+        start = time.monotonic()
+        for seq in range(messages):
+            errors += not self.__publish__(f"t:{seq}")
+        publish_elapsed = time.monotonic() - start
+        complete = self.broker.wait_for_messages(baseline + messages, timeout)
+        elapsed = time.monotonic() - start
+        received = self.broker.get_stats()['published'] - baseline
+        return {'messages': messages, 'received': received, 'errors': errors, 'complete': complete,
+                'publish_calls_per_second': messages / publish_elapsed if publish_elapsed > 0 else None,
+                'messages_per_second': received / elapsed if elapsed > 0 else None}
+
+    def run_latency(self, messages: int, interval_ms: float, timeout: float = 10.0):
+        with self.lock:
+            self.sent_at = {}
+            self.latencies = []
+        baseline = self.broker.get_stats()['published']
+        for seq in range(messages):
+            with self.lock:
+                self.sent_at[seq] = time.monotonic()
+            self.__publish__(f"l:{seq}")
+            time.sleep(interval_ms / 1000)
+        self.broker.wait_for_messages(baseline + messages, timeout)
+        with self.lock:
+            latencies = [latency * 1000 for latency in self.latencies]
+        return {'messages': messages, 'received': len(latencies), 'latency_ms': percentiles(latencies)}
+
+    def run_recovery(self, cycles: int, interval_ms: float, refuse_code: MqttResponseCode = None,
+                     refuse_seconds: float = 0, timeout: float = 10.0):
+        # Se publica sin parar mientras se corta la conexión; la recuperación es el tiempo desde el corte hasta que
+        # el broker recibe el primer mensaje por una conexión nueva
+        recoveries = []
+        lost = 0
+        errors = 0
+        for _ in range(cycles):
+            with self.lock:
+                self.first_received_at = None
+            baseline = self.broker.get_stats()['published']
+            sent = 0
+            if refuse_code is not None:
+                self.broker.refuse_connections(refuse_code)
+            dropped_at = time.monotonic()
+            with self.lock:
+                self.received_after = dropped_at
+            self.broker.drop_connections()
+            refusing = refuse_code is not None
+            while time.monotonic() - dropped_at < timeout:
+                if refusing and time.monotonic() - dropped_at >= refuse_seconds:
+                    self.broker.refuse_connections(MqttResponseCode.NO_ERROR)
+                    refusing = False
+                errors += not self.__publish__(f"r:{sent}")
+                sent += 1
+                with self.lock:
+                    if self.first_received_at is not None:
+                        break
+                time.sleep(interval_ms / 1000)
+            if refusing:
+                self.broker.refuse_connections(MqttResponseCode.NO_ERROR)
+            with self.lock:
+                recovered_at = self.first_received_at
+                self.received_after = None
+            # Se deja que se vacíe la cola antes de contar los mensajes perdidos
+            self.broker.wait_for_messages(baseline + sent, 1.0)
+            lost += max(sent - (self.broker.get_stats()['published'] - baseline), 0)
+            recoveries.append((recovered_at - dropped_at) * 1000 if recovered_at is not None else None)
+        recovered = [recovery for recovery in recoveries if recovery is not None]
+        return {'cycles': cycles, 'recovered': len(recovered), 'lost_messages': lost, 'publish_errors': errors,
+                'reconnects': self.client.get_publish_stats()['reconnects'],
+                'recovery_ms': percentiles(recovered)}
+
+    def __publish__(self, payload: str) -> bool:
+        # En modo síncrono un broker caído hace que publish() intente reconectar y puede lanzar la excepción
+        try:
+            self.client.publish(self.topic, payload)
+            return True
+        except Exception as e:
+            logging.debug(f"Publish failed: {str(e)}")
+            return False
+
+    def __on_message__(self, message: ReceivedMessage):
+        kind, seq = message.payload.decode().split(':', 1)
+        with self.lock:
+            if kind == 'l':
+                sent_at = self.sent_at.get(int(seq))
+                if sent_at is not None:
+                    self.latencies.append(message.received_at - sent_at)
+            elif kind == 'r' and self.received_after is not None and self.first_received_at is None and \
+                    message.received_at > self.received_after:
+                self.first_received_at = message.received_at
+
+
+def get_mode_name(loop_type: MqttLoopType, async_publish: bool) -> str:
+    return f"{loop_type.name.lower()}{'_async' if async_publish else ''}"
+
+
+# (loop_type, async_publish). En modo asíncrono el cliente siempre usa el loop NOT_BLOCKING
+MODES = [(MqttLoopType.BLOCKING, False), (MqttLoopType.NOT_BLOCKING, False), (MqttLoopType.CUSTOM, False),
+         (MqttLoopType.NO_LOOP, False), (MqttLoopType.NOT_BLOCKING, True)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MqttClient throughput, latency and recovery benchmark against an "
+                                                 "in-process MQTT broker.")
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--latency-messages', type=int, default=200)
+    parser.add_argument('--interval-ms', type=float, default=2)
+    parser.add_argument('--cycles', type=int, default=3)
+    parser.add_argument('--qos', type=int, default=1, choices=[0, 1, 2])
+    parser.add_argument('--loop-types', default=None,
+                        help="Comma separated loop types (blocking, not_blocking, custom, no_loop, "
+                             "not_blocking_async). All by default.")
+    parser.add_argument('--connack-delay-ms', type=float, default=0)
+    parser.add_argument('--puback-delay-ms', type=float, default=0)
+    parser.add_argument('--refuse-code', default=None,
+                        help="MqttResponseCode sent in CONNACK while recovering, e.g. conn_refused_server_unavailable")
+    parser.add_argument('--refuse-ms', type=float, default=500)
+    parser.add_argument('--recovery-timeout', type=float, default=15,
+                        help="Seconds to wait for each recovery before giving up.")
+    parser.add_argument('--persistent-session', action='store_true',
+                        help="Reconnect with a persistent session, reusing the paho client.")
+    parser.add_argument('--keepalive', type=int, default=60)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+
+    refuse_code = MqttResponseCode[args.refuse_code.upper()] if args.refuse_code is not None else None
+    selected = [name.strip().lower() for name in args.loop_types.split(',')] if args.loop_types else None
+    with LocalMqttBroker(record_messages=False) as broker:
+        broker.connack_delay = args.connack_delay_ms / 1000
+        broker.puback_delay = args.puback_delay_ms / 1000
+        for loop_type, async_publish in MODES:
+            if selected is not None and get_mode_name(loop_type, async_publish) not in selected:
+                continue
+            with MqttBenchmark(broker, loop_type, async_publish, qos=args.qos,
+                               persistent_session=args.persistent_session, keepalive=args.keepalive) as benchmark:
+                results = {}
+                results.update(benchmark.run_throughput(args.messages))
+                latency = benchmark.run_latency(args.latency_messages, args.interval_ms)
+                results['latency_ms'] = latency['latency_ms']
+                recovery = benchmark.run_recovery(args.cycles, args.interval_ms, refuse_code=refuse_code,
+                                                  refuse_seconds=args.refuse_ms / 1000,
+                                                  timeout=args.recovery_timeout)
+                results.update({f"recovery_{key}" if key != 'recovery_ms' else key: value
+                                for key, value in recovery.items()})
+                print_report(f"MQTT {benchmark.get_name()} (qos {args.qos})", results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+import argparse
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+from benchmarks.presslatency import percentiles, print_report
+from benchmarks.webhookserver import LocalWebhookServer, ReceivedRequest
+from events.ringevent import RingEvent
+from gpio.pressdetector import PressType
+from network.notify.notificationdispatcher import NotificationDispatcher
+from network.notify.unixsocketsink import UnixSocketSink
+from network.notify.webhooksink import WebhookSink
+
+
+class LatencyRecorder:
+    # Latencia desde notify() hasta que el destino recibe el evento, a partir del seq del evento en json
+    def __init__(self):
+        self.sent_at: Dict[int, float] = {}
+        self.latencies: List[float] = []
+        self.lock = threading.Lock()
+
+    def sent(self, event: RingEvent):
+        with self.lock:
+            self.sent_at[event.seq] = time.monotonic()
+
+    def received(self, payload: bytes, received_at: float):
+        seq = json.loads(payload)['seq']
+        with self.lock:
+            sent_at = self.sent_at.pop(seq, None)
+            if sent_at is not None:
+                self.latencies.append((received_at - sent_at) * 1000)
+
+    def on_request(self, request: ReceivedRequest):
+        self.received(request.body, request.received_at)
+
+    def get_latencies(self) -> List[float]:
+        with self.lock:
+            return list(self.latencies)
+
+
+class UnixSocketReader:
+    # Cliente del socket UNIX: lee un evento json por línea
+    def __init__(self, path: str, recorder: LatencyRecorder):
+        self.path = path
+        self.recorder = recorder
+        self.received = 0
+        self.sock = None
+        self.thread = None
+
+    def __enter__(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+        self.thread = threading.Thread(name="UnixSocketReader", target=self.__read__, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.sock.shutdown(socket.SHUT_RDWR)
+        self.sock.close()
+        self.thread.join()
+
+    def wait_for_events(self, count: int, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while self.received < count and time.monotonic() < deadline:
+            time.sleep(0.001)
+        return self.received >= count
+
+    def __read__(self):
+        buffer = b''
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except OSError:
+                return
+            if not data:
+                return
+            received_at = time.monotonic()
+            buffer += data
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                self.recorder.received(line, received_at)
+                self.received += 1
+
+
+def create_event(indx: int) -> RingEvent:
+    return RingEvent(device_id='benchmark', input_name='main', pin=indx % 40, press_type=PressType.SINGLE,
+                     timestamp=time.time())
+
+
+def wait_for_sink(sink: WebhookSink, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = sink.get_stats()
+        if stats['queue_size'] == 0 and stats['retry_queue_size'] == 0:
+            return
+        time.sleep(0.001)
+
+
+def run_webhook(events: int, connections: int, interval_ms: float, keep_alive: bool, timeout: float):
+    recorder = LatencyRecorder()
+    with LocalWebhookServer(on_request=recorder.on_request, record_requests=False) as server:
+        server.close_connections = not keep_alive
+        with WebhookSink('benchmark', server.url, connections=connections, max_queue_size=events) as sink:
+            start = time.monotonic()
+            for indx in range(events):
+                event = create_event(indx)
+                recorder.sent(event)
+                sink.notify(event)
+                if interval_ms > 0:
+                    time.sleep(interval_ms / 1000)
+            complete = server.wait_for_requests(events, timeout)
+            elapsed = time.monotonic() - start
+            server_stats = server.get_stats()
+            pool_stats = sink.get_stats()['connections']
+    return {'events': events, 'received': server_stats['requests'], 'complete': complete,
+            'events_per_second': server_stats['requests'] / elapsed if elapsed > 0 else None,
+            'server_connections': server_stats['connections'],
+            'requests_per_connection': server_stats['requests'] / max(server_stats['connections'], 1),
+            'pool_created': pool_stats['created'], 'pool_reused': pool_stats['reused'],
+            'latency_ms': percentiles(recorder.get_latencies())}
+
+
+def run_slow_endpoint(events: int, slow_delay_ms: float, interval_ms: float, timeout: float):
+    # Un webhook lento junto a uno rápido y al socket UNIX: notify() tiene que seguir tardando microsegundos y los
+    # destinos rápidos no pueden esperar al lento
+    fast_recorder = LatencyRecorder()
+    socket_recorder = LatencyRecorder()
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            LocalWebhookServer(record_requests=False) as slow_server, \
+            LocalWebhookServer(on_request=fast_recorder.on_request, record_requests=False) as fast_server:
+        slow_server.response_delay = slow_delay_ms / 1000
+        socket_path = os.path.join(tmp_dir, 'events.sock')
+        sinks = [WebhookSink('slow', slow_server.url, timeout=max(slow_delay_ms / 1000 * 4, 1),
+                             max_queue_size=events),
+                 WebhookSink('fast', fast_server.url, max_queue_size=events),
+                 UnixSocketSink('socket', path=socket_path)]
+        with NotificationDispatcher(sinks) as dispatcher, UnixSocketReader(socket_path, socket_recorder) as reader:
+            notify_times = []
+            for indx in range(events):
+                event = create_event(indx)
+                fast_recorder.sent(event)
+                socket_recorder.sent(event)
+                start = time.perf_counter()
+                dispatcher.notify(event)
+                notify_times.append((time.perf_counter() - start) * 1000)
+                time.sleep(interval_ms / 1000)
+            fast_complete = fast_server.wait_for_requests(events, timeout)
+            socket_complete = reader.wait_for_events(events, timeout)
+            slow_received = slow_server.get_stats()['requests']
+            stats = dispatcher.get_stats()
+    return {'events': events, 'notify_ms': percentiles(notify_times),
+            'fast_complete': fast_complete, 'fast_latency_ms': percentiles(fast_recorder.get_latencies()),
+            'socket_complete': socket_complete, 'socket_latency_ms': percentiles(socket_recorder.get_latencies()),
+            'slow_received_while_running': slow_received, 'slow_dropped': stats['slow']['dropped']}
+
+
+def run_retries(events: int, failures: int, status: int, timeout: float):
+    with LocalWebhookServer(record_requests=False) as server:
+        server.fail_next(failures, status)
+        with WebhookSink('retries', server.url, max_queue_size=events, retry_min_delay=0.05,
+                         retry_max_delay=0.5) as sink:
+            start = time.monotonic()
+            for indx in range(events):
+                sink.notify(create_event(indx))
+            complete = server.wait_for_requests(events, timeout)
+            elapsed = time.monotonic() - start
+            wait_for_sink(sink, 1.0)
+            stats = sink.get_stats()
+    return {'events': events, 'injected_failures': failures, 'complete': complete, 'delivered': stats['delivered'],
+            'retried': stats['retried'], 'failed': stats['failed'], 'elapsed_s': elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Notification sinks throughput, latency and isolation benchmark "
+                                                 "against an in-process HTTP server.")
+    parser.add_argument('--events', type=int, default=1000)
+    parser.add_argument('--connections', type=int, default=2)
+    parser.add_argument('--interval-ms', type=float, default=0)
+    parser.add_argument('--slow-events', type=int, default=50)
+    parser.add_argument('--slow-delay-ms', type=float, default=500)
+    parser.add_argument('--slow-interval-ms', type=float, default=5)
+    parser.add_argument('--failures', type=int, default=10)
+    parser.add_argument('--failure-status', type=int, default=503)
+    parser.add_argument('--timeout', type=float, default=30)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+
+    for keep_alive in (True, False):
+        results = run_webhook(args.events, args.connections, args.interval_ms, keep_alive, args.timeout)
+        print_report(f"Webhook {'keep-alive' if keep_alive else 'connection per request'} "
+                     f"({args.connections} connections)", results)
+    print_report(f"Slow webhook ({args.slow_delay_ms:.0f} ms) next to a fast webhook and a UNIX socket",
+                 run_slow_endpoint(args.slow_events, args.slow_delay_ms, args.slow_interval_ms, args.timeout))
+    print_report(f"Webhook retries (status {args.failure_status})",
+                 run_retries(args.events // 10 or 1, args.failures, args.failure_status, args.timeout))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+import argparse
+import math
+import os
+import struct
+import tempfile
+import threading
+import time
+import wave
+from typing import Dict, List
+
+# Sin tarjeta de sonido se usa el driver nulo de SDL. Tiene que estar definido antes de importar pygame
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+from benchmarks.mqttbroker import LocalMqttBroker, ReceivedMessage
+from events.ringevent import RingEvent
+from events.ringeventpublisher import RingEventPublisher
+from events.ringeventserializer import JsonRingEventSerializer
+from gpio.edgebuffer import EdgeBuffer
+from gpio.gpiobackend import PinMode, PullMode, EdgeType
+from gpio.pressdetector import PressDetector, PressEvent
+from gpio.simulatedbackend import SimulatedBackend
+from network.mqtt.mqttclient import MqttClient, MqttLoopType
+from network.mqtt.mqtttopic import MqttTopic
+from network.url import BasicAuthURL
+from soundplayer.playbackworker import CoalescePolicy
+from soundplayer.soundplayer import SoundPlayer
+
+PIN = 10
+CONNECT_TIMEOUT = 5.0
+
+
+def percentiles(values: List[float], points=(50, 90, 99)):
+    if len(values) == 0:
+        return {f"p{p}": None for p in points}
+    values = sorted(values)
+    result = {f"p{p}": values[min(len(values) - 1, int(math.ceil(p / 100 * len(values))) - 1)] for p in points}
+    result['max'] = values[-1]
+    return result
+
+
+def create_test_sound(dir_path: str, duration: float = 0.2, frequency: int = 22050) -> str:
+    sound_path = os.path.join(dir_path, 'benchmark.wav')
+    with wave.open(sound_path, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(frequency)
+        wav_file.writeframes(b''.join(struct.pack('<h', int(8000 * math.sin(i / 8)))
+                                      for i in range(int(duration * frequency))))
+    return sound_path
+
+
+class PressLatencyBenchmark:
+    # Cada pulsación sigue el mismo camino que en SmartDoorbell.__on_press__: se crea el RingEvent, se pide el sonido
+    # y se publica con RingEventPublisher y un MqttClient real contra el broker local. La latencia de publicación es
+    # desde el primer flanco hasta que el broker termina de leer el PUBLISH con el evento
+    def __init__(self, sound_path: str, broker: LocalMqttBroker, debounce_ms: int = 20,
+                 policy: CoalescePolicy = CoalescePolicy.LATEST_WINS, seed: int = 0, qos: int = 0,
+                 async_publish: bool = True):
+        self.sound_path = sound_path
+        self.broker = broker
+        self.topic = MqttTopic(name="benchmark/press", qos=qos)
+        self.async_publish = async_publish
+        self.debounce_ms = debounce_ms
+        self.policy = policy
+        self.backend = SimulatedBackend(seed=seed)
+        self.serializer = JsonRingEventSerializer()
+        self.samples = []
+        # seq del evento -> time.monotonic() en el que lo recibe el broker
+        self.received_at: Dict[int, float] = {}
+        self.lock = threading.Lock()
+        broker.on_message = self.__on_message__
+
+    def run_latency(self, presses: int, min_gap_ms: float, max_gap_ms: float, max_bounces: int):
+        edge_train = self.backend.create_random_train(presses, min_gap_ms=min_gap_ms, max_gap_ms=max_gap_ms,
+                                                      min_hold_ms=self.debounce_ms * 2,
+                                                      max_hold_ms=self.debounce_ms * 5, max_bounces=max_bounces)
+        elapsed, detected = self.__run__(edge_train)
+        playback = [(command.started_at - event.pressed_at / 1e9) * 1000 for event, command, _ in self.samples
+                    if command is not None and command.started_at is not None]
+        with self.lock:
+            broker = [(self.received_at[seq] - event.pressed_at / 1e9) * 1000 for event, _, seq in self.samples
+                      if seq in self.received_at]
+        return {'presses': presses, 'detected': detected, 'elapsed': elapsed,
+                'press_to_playback_ms': percentiles(playback), 'published': len(broker),
+                'press_to_broker_ms': percentiles(broker)}
+
+    def run_throughput(self, presses: int, hold_ms: float):
+        edge_train = []
+        for _ in range(presses):
+            press_train = self.backend.create_press_train(hold_ms=hold_ms)
+            # Entre pulsaciones se deja el mismo tiempo que el antirrebote para que no se fusionen
+            press_train[0] = (self.debounce_ms * 1.5 / 1000, press_train[0][1])
+            edge_train += press_train
+        elapsed, detected = self.__run__(edge_train)
+        return {'presses': presses, 'detected': detected, 'elapsed': elapsed,
+                'presses_per_second': detected / elapsed if elapsed > 0 else None}
+
+    def __run__(self, edge_train):
+        self.samples = []
+        with self.lock:
+            self.received_at = {}
+        baseline = self.broker.get_stats()['published']
+        edge_buffer = EdgeBuffer()
+        detector = PressDetector(edge_buffer, is_pressed=lambda source: self.backend.digital_read(PIN) == 0,
+                                 debounce_ms=self.debounce_ms)
+        self.backend.setup()
+        self.backend.pin_mode(PIN, PinMode.INPUT)
+        self.backend.pull_up_dn_control(PIN, PullMode.UP)
+        self.backend.isr(PIN, EdgeType.BOTH, lambda: edge_buffer.push(0, time.monotonic_ns()))
+
+        # Como en MqttFanoutClient.create_from_conf: el cliente no tiene hilo de loop propio
+        mqtt_client = MqttClient(broker_url=BasicAuthURL(protocol="mqtt", hostname=self.broker.host,
+                                                         port=self.broker.port),
+                                 loop_type=MqttLoopType.NO_LOOP, async_publish=self.async_publish,
+                                 name="benchmark")
+        with SoundPlayer(policy=self.policy) as sound_player, mqtt_client, \
+                RingEventPublisher(mqtt_client, serializer=self.serializer) as publisher:
+            deadline = time.monotonic() + CONNECT_TIMEOUT
+            while len(self.broker.get_connected_clients()) == 0 and time.monotonic() < deadline:
+                time.sleep(0.001)
+
+            def on_press(event: PressEvent):
+                ring_event = RingEvent.create_from_press('benchmark', 'benchmark', PIN, event)
+                command = sound_player.play_sound(self.sound_path)
+                publisher.publish(self.topic, ring_event)
+                with self.lock:
+                    self.samples.append((event, command, ring_event.seq))
+
+            detector.add_handler(on_press)
+            detector.start()
+            start = time.monotonic()
+            self.backend.run_edge_train(PIN, edge_train)
+            # Se espera a que la última pulsación pase el antirrebote y empiece a sonar
+            time.sleep(self.debounce_ms * 3 / 1000 + 0.1)
+            elapsed = time.monotonic() - start
+            detector.stop()
+            self.broker.wait_for_messages(baseline + len(self.samples), 2.0)
+        return elapsed, detector.get_stats()['presses']
+
+    def __on_message__(self, message: ReceivedMessage):
+        received_at = message.received_at
+        for ring_event in self.serializer.deserialize(message.payload):
+            with self.lock:
+                self.received_at[ring_event.seq] = received_at
+
+
+def print_report(title: str, results: dict):
+    print(f"\n{title}")
+    for key, value in results.items():
+        if isinstance(value, dict):
+            print(f"  {key}: " + ", ".join(f"{k} = {v:.3f}" if v is not None else f"{k} = -"
+                                           for k, v in value.items()))
+        elif isinstance(value, float):
+            print(f"  {key}: {value:.3f}")
+        else:
+            print(f"  {key}: {value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Press latency benchmark using the simulated GPIO backend.")
+    parser.add_argument('--presses', type=int, default=100)
+    parser.add_argument('--debounce-ms', type=int, default=20)
+    parser.add_argument('--min-gap-ms', type=float, default=100)
+    parser.add_argument('--max-gap-ms', type=float, default=300)
+    parser.add_argument('--max-bounces', type=int, default=3)
+    parser.add_argument('--policy', default='latest_wins')
+    parser.add_argument('--sound', default=None, help="Sound file or folder. A generated WAV is used by default.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--qos', type=int, default=0, choices=[0, 1, 2])
+    parser.add_argument('--sync-publish', action='store_true',
+                        help="Publish from the press thread instead of the MqttClient publish queue.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir, LocalMqttBroker(record_messages=False) as broker:
+        sound_path = args.sound if args.sound is not None else create_test_sound(tmp_dir)
+        benchmark = PressLatencyBenchmark(sound_path, broker, debounce_ms=args.debounce_ms,
+                                          policy=CoalescePolicy.create_from_str(args.policy), seed=args.seed,
+                                          qos=args.qos, async_publish=not args.sync_publish)
+        print_report("Press latency", benchmark.run_latency(args.presses, args.min_gap_ms, args.max_gap_ms,
+                                                            args.max_bounces))
+        print_report("Sustained presses", benchmark.run_throughput(args.presses, hold_ms=args.debounce_ms * 1.5))
+
+
+if __name__ == '__main__':
+    main()
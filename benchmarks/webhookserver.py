@@ -0,0 +1,161 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+
+@dataclass
+class ReceivedRequest:
+    method: str
+    path: str
+    headers: Dict[str, str]
+    body: bytes
+    client_port: int  # Puerto del cliente: las peticiones por la misma conexión keep-alive comparten puerto
+    received_at: float  # time.monotonic() al terminar de leer el cuerpo
+
+
+class LocalWebhookServer:
+    # Servidor HTTP/1.1 mínimo para probar y medir los webhooks. Mantiene las conexiones abiertas (keep-alive), guarda
+    # las peticiones y permite inyectar fallos: retrasar las respuestas, responder con un código de error a las
+    # siguientes peticiones, cortar la conexión sin responder, cerrar la conexión después de cada respuesta y cerrar sin
+    # avisar las conexiones que llevan idle_timeout segundos sin peticiones
+    DEFAULT_HOST = '127.0.0.1'
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = 0,
+                 on_request: Callable[[ReceivedRequest], None] = None, record_requests: bool = True):
+        self.host = host
+        self.port = port
+        self.on_request = on_request
+        self.record_requests = record_requests
+        self.requests: List[ReceivedRequest] = []
+        self.lock = threading.Lock()
+        self.http_server = None
+        self.thread = None
+        # Fallos inyectados
+        self.response_delay = 0.0
+        self.close_connections = False
+        self.idle_timeout = None
+        self.fail_status = 500
+        self.failures_left = 0
+        self.drops_left = 0
+        self.stats = {'connections': 0, 'requests': 0, 'failed': 0}
+
+    def __enter__(self):
+        self.init_context()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close_context()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/webhook"
+
+    def init_context(self):
+        server = self
+
+        class WebhookRequestHandler(BaseHTTPRequestHandler):
+            # HTTP/1.1 para que las conexiones se mantengan abiertas entre peticiones
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                # Con timeout el servidor cierra la conexión cuando no llega otra petición a tiempo
+                self.timeout = server.idle_timeout
+                super().setup()
+                with server.lock:
+                    server.stats['connections'] += 1
+
+            def do_POST(self):
+                self.__handle__()
+
+            def do_PUT(self):
+                self.__handle__()
+
+            def __handle__(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                status = server.__record__(ReceivedRequest(method=self.command, path=self.path,
+                                                           headers=dict(self.headers.items()), body=body,
+                                                           client_port=self.client_address[1],
+                                                           received_at=time.monotonic()))
+                if status is None:
+                    # La petición se ha leído entera, pero la conexión se corta sin enviar la respuesta
+                    self.close_connection = True
+                    return
+                if server.response_delay > 0:
+                    time.sleep(server.response_delay)
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                if server.close_connections:
+                    self.send_header('Connection', 'close')
+                    self.close_connection = True
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logging.debug(f"Webhook request from {self.address_string()}: {format % args}")
+
+        self.http_server = ThreadingHTTPServer((self.host, self.port), WebhookRequestHandler)
+        self.http_server.daemon_threads = True
+        # Con puerto 0 el sistema elige uno libre
+        self.port = self.http_server.server_address[1]
+        self.thread = threading.Thread(name="LocalWebhookServer", target=self.http_server.serve_forever, daemon=True)
+        self.thread.start()
+        logging.info(f"Local webhook server listening on {self.url}")
+
+    def close_context(self):
+        if self.http_server is None:
+            return
+        self.http_server.shutdown()
+        self.http_server.server_close()
+        self.thread.join()
+        self.http_server = None
+        self.thread = None
+
+    def fail_next(self, count: int, status: int = 500):
+        # Las siguientes `count` peticiones reciben este código
+        with self.lock:
+            self.failures_left = count
+            self.fail_status = status
+
+    def drop_next(self, count: int):
+        # Las siguientes `count` peticiones se leen, pero se cierra la conexión sin responder, como un servidor que se
+        # cae mientras procesa la petición
+        with self.lock:
+            self.drops_left = count
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def clear(self):
+        with self.lock:
+            self.requests = []
+
+    def wait_for_requests(self, count: int, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if self.stats['requests'] - self.stats['failed'] >= count:
+                    return True
+            time.sleep(0.001)
+        return False
+
+    def __record__(self, request: ReceivedRequest) -> Optional[int]:
+        # Devuelve el código de la respuesta, o None si no se responde. Solo se guardan y cuentan como recibidas las que
+        # responden 200
+        with self.lock:
+            self.stats['requests'] += 1
+            if self.drops_left > 0:
+                self.drops_left -= 1
+                self.stats['failed'] += 1
+                return None
+            if self.failures_left > 0:
+                self.failures_left -= 1
+                self.stats['failed'] += 1
+                return self.fail_status
+            if self.record_requests:
+                self.requests.append(request)
+        if self.on_request is not None:
+            self.on_request(request)
+        return 200
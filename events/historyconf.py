@@ -0,0 +1,52 @@
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from events.ringeventstore import RingEventStore
+from network.mqtt.mqtttopic import MqttTopic
+
+
+@dataclass
+class HistoryConf:
+    DEFAULT_MAX_RESULTS = 100
+
+    path: str = RingEventStore.DEFAULT_PATH
+    max_events: int = RingEventStore.DEFAULT_MAX_EVENTS
+    max_age_days: float = None
+    queue_size: int = RingEventStore.DEFAULT_MAX_QUEUE_SIZE
+    query_topic: MqttTopic = None
+    response_topic: MqttTopic = None
+    max_results: int = DEFAULT_MAX_RESULTS
+
+    def create_event_store(self) -> RingEventStore:
+        return RingEventStore(path=self.path, max_events=self.max_events, max_age_days=self.max_age_days,
+                              max_queue_size=self.queue_size)
+
+    @staticmethod
+    def create_from_dict(cfg) -> Optional['HistoryConf']:
+        # Sin sección history no se guarda el historial de pulsaciones
+        if 'history' not in cfg:
+            return None
+        history_cfg = cfg['history'] or {}
+        history_conf = HistoryConf()
+        if 'path' in history_cfg:
+            history_conf.path = history_cfg['path']
+        else:
+            logging.warning(f"No history path section into configuration file. Using "
+                            f"{RingEventStore.DEFAULT_PATH}.")
+        if 'max_events' in history_cfg:
+            history_conf.max_events = int(history_cfg['max_events'])
+        if 'max_age_days' in history_cfg:
+            history_conf.max_age_days = float(history_cfg['max_age_days'])
+        if 'queue_size' in history_cfg:
+            history_conf.queue_size = int(history_cfg['queue_size'])
+        if 'max_results' in history_cfg:
+            history_conf.max_results = int(history_cfg['max_results'])
+        if 'query_topic' in history_cfg:
+            history_conf.query_topic = MqttTopic.create_from_cfg(history_cfg['query_topic'])
+            if 'response_topic' in history_cfg:
+                history_conf.response_topic = MqttTopic.create_from_cfg(history_cfg['response_topic'])
+            else:
+                history_conf.response_topic = MqttTopic(name=f"{history_conf.query_topic.name}/response",
+                                                        qos=history_conf.query_topic.qos)
+        return history_conf
@@ -0,0 +1,33 @@
+import itertools
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+from gpio.pressdetector import PressEvent, PressType
+
+# Número de secuencia del proceso: permite al consumidor detectar eventos perdidos o duplicados
+__SEQUENCE__ = itertools.count()
+
+
+@dataclass
+class RingEvent:
+    device_id: str
+    input_name: str
+    pin: int
+    press_type: PressType
+    timestamp: float  # Segundos desde epoch (UTC) del primer flanco de la pulsación
+    seq: int = field(default_factory=lambda: next(__SEQUENCE__))
+
+    def get_datetime(self) -> datetime:
+        return datetime.fromtimestamp(self.timestamp, timezone.utc)
+
+    @staticmethod
+    def create_from_press(device_id: str, input_name: str, pin: int, press_event: PressEvent) -> 'RingEvent':
+        # PressEvent usa el reloj monótono; se pasa a tiempo real restando lo que ha pasado desde la pulsación
+        elapsed = (time.monotonic_ns() - press_event.pressed_at) / 1e9
+        return RingEvent(device_id=device_id, input_name=input_name, pin=pin, press_type=press_event.press_type,
+                         timestamp=time.time() - elapsed)
+
+    def __repr__(self):
+        return f"RingEvent[device_id = {self.device_id}, input_name = {self.input_name}, pin = {self.pin}, " \
+               f"press_type = {self.press_type.name}, timestamp = {self.get_datetime().isoformat()}, seq = {self.seq}]"
@@ -0,0 +1,118 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+from events.ringevent import RingEvent
+from events.ringeventserializer import RingEventSerializer, JsonRingEventSerializer
+from network.mqtt.mqttclient import MqttClient
+from network.mqtt.mqtttopic import MqttTopic
+
+
+class RingEventPublisher:
+    DEFAULT_BATCH_WINDOW_MS = 0
+    DEFAULT_MAX_BATCH_SIZE = 16
+
+    def __init__(self, mqtt_client: MqttClient, serializer: RingEventSerializer = None,
+                 batch_window_ms: float = DEFAULT_BATCH_WINDOW_MS, max_batch_size: int = DEFAULT_MAX_BATCH_SIZE):
+        self.mqtt_client = mqtt_client
+        self.serializer = serializer if serializer is not None else JsonRingEventSerializer()
+        self.batch_window = batch_window_ms / 1000
+        self.max_batch_size = max_batch_size
+        # topic -> (instante en el que hay que enviar el lote, MqttTopic, [(evento, on_result)])
+        self.batches: Dict[str, Tuple[float, MqttTopic, List[Tuple[RingEvent, Callable]]]] = {}
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def __enter__(self):
+        self.init_context()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close_context()
+
+    def init_context(self):
+        if self.batch_window <= 0:
+            return
+        with self.condition:
+            self.running = True
+        self.thread = threading.Thread(name="RingEventBatcher", target=self.__run__, daemon=True)
+        self.thread.start()
+
+    def close_context(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        # Lo que quede pendiente se envía antes de cerrar
+        for topic, events in self.__take_batches__(force=True):
+            self.__publish_batch__(topic, events)
+
+    def is_healthy(self):
+        # Sin ventana de agrupación no hay hilo que vigilar
+        return self.batch_window <= 0 or (self.thread is not None and self.thread.is_alive())
+
+    def publish(self, topic: MqttTopic, event: RingEvent, on_result: Callable = None):
+        # on_result recibe el resultado de la publicación que devuelve el cliente MQTT
+        if self.batch_window <= 0:
+            self.mqtt_client.publish(topic, self.serializer.serialize(event), on_result=on_result)
+            return
+        with self.condition:
+            deadline, _, events = self.batches.setdefault(topic.name, (time.monotonic() + self.batch_window, topic,
+                                                                       []))
+            events.append((event, on_result))
+            # Solo hace falta despertar al hilo si el lote es nuevo (nuevo plazo) o si ya está lleno
+            if len(events) == 1 or len(events) >= self.max_batch_size:
+                self.condition.notify()
+
+    def __run__(self):
+        while True:
+            with self.condition:
+                while self.running:
+                    wait_time = self.__next_wait_time__()
+                    if wait_time is not None and wait_time <= 0:
+                        break
+                    self.condition.wait(timeout=wait_time)
+                if not self.running:
+                    return
+            for topic, events in self.__take_batches__():
+                self.__publish_batch__(topic, events)
+
+    def __next_wait_time__(self):
+        if len(self.batches) == 0:
+            return None
+        now = time.monotonic()
+        return min(0 if len(events) >= self.max_batch_size else deadline - now
+                   for deadline, _, events in self.batches.values())
+
+    def __take_batches__(self, force: bool = False) -> List[Tuple[MqttTopic, List[Tuple[RingEvent, Callable]]]]:
+        now = time.monotonic()
+        ready = []
+        with self.condition:
+            for topic_name, (deadline, topic, events) in list(self.batches.items()):
+                if force or now >= deadline or len(events) >= self.max_batch_size:
+                    del self.batches[topic_name]
+                    ready.append((topic, events))
+        return ready
+
+    def __publish_batch__(self, topic: MqttTopic, events: List[Tuple[RingEvent, Callable]]):
+        try:
+            for indx in range(0, len(events), self.max_batch_size):
+                batch = events[indx:indx + self.max_batch_size]
+                payload = self.serializer.serialize_batch([event for event, _ in batch])
+                callbacks = [on_result for _, on_result in batch if on_result is not None]
+                self.mqtt_client.publish(topic, payload,
+                                         on_result=self.__combine_callbacks__(callbacks) if callbacks else None)
+        except Exception as e:
+            logging.exception(f"Failed to publish {len(events)} ring events to {topic}: {str(e)}")
+
+    @staticmethod
+    def __combine_callbacks__(callbacks: List[Callable]) -> Callable:
+        # Todos los eventos de un lote comparten el resultado del mensaje en el que van
+        def on_result(result):
+            for callback in callbacks:
+                callback(result)
+        return on_result
@@ -0,0 +1,115 @@
+import json
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from events.ringeventstore import RingEventStore
+from network.mqtt.mqttclient import MqttClient
+from network.mqtt.mqttfanoutclient import MqttFanoutClient
+from network.mqtt.mqtttopic import MqttTopic
+
+
+class RingEventQueryService:
+    # Responde por MQTT a las consultas sobre el historial de pulsaciones. Las peticiones son JSON:
+    #   {"id": "...", "last": 10, "input": "principal"}
+    #   {"id": "...", "from": "2026-01-01T00:00:00+00:00", "to": 1767225600, "limit": 50}
+    # y la respuesta {"id": "...", "count": N, "events": [...]} o {"id": "...", "error": "..."} se publica en el
+    # response_topic de la petición o en el configurado, siempre en el broker del que llega la petición
+    DEFAULT_MAX_RESULTS = 100
+
+    def __init__(self, event_store: RingEventStore, mqtt_client: MqttFanoutClient, query_topic: MqttTopic,
+                 response_topic: MqttTopic, max_results: int = DEFAULT_MAX_RESULTS):
+        self.event_store = event_store
+        self.mqtt_client = mqtt_client
+        self.query_topic = query_topic
+        self.response_topic = response_topic
+        self.max_results = max_results
+        self.subscriptions: List[Tuple[MqttClient, MqttTopic]] = []
+        self.stats = {'queries': 0, 'errors': 0}
+        self.stats_lock = threading.Lock()
+
+    def __enter__(self):
+        self.init_context()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close_context()
+
+    def init_context(self):
+        for broker_conf, client in self.mqtt_client.clients:
+            query_topic = broker_conf.map_topic(self.query_topic)
+            response_topic = broker_conf.map_topic(self.response_topic)
+            if query_topic is None or response_topic is None:
+                continue
+            if not client.async_publish:
+                logging.warning(f"MQTT broker {broker_conf.name} uses synchronous publishing, so it doesn't receive "
+                                f"ring event history queries.")
+            # Las consultas leen de disco, así que no se atienden en el hilo de red de paho
+            topic = MqttTopic(name=query_topic.name, qos=query_topic.qos, threaded_callback=True,
+                              callback=lambda topic_name, payload, client=client, response_topic=response_topic:
+                              self.__on_query__(client, response_topic, payload))
+            client.subscribe(topic)
+            self.subscriptions.append((client, topic))
+            logging.info(f"Ring event history queries are served on {query_topic.name} of MQTT broker "
+                         f"{broker_conf.name}.")
+
+    def close_context(self):
+        for client, topic in self.subscriptions:
+            client.unsubscribe(topic)
+        self.subscriptions = []
+
+    def get_stats(self):
+        with self.stats_lock:
+            return dict(self.stats)
+
+    def __on_query__(self, client: MqttClient, response_topic: MqttTopic, payload):
+        request_id = None
+        try:
+            request = json.loads(payload)
+            if not isinstance(request, dict):
+                raise ValueError("Query must be a JSON object")
+            request_id = request.get('id')
+            if request.get('response_topic'):
+                response_topic = MqttTopic(name=str(request['response_topic']), qos=response_topic.qos)
+            events = self.__execute__(request)
+            response = {'id': request_id, 'count': len(events), 'events': events}
+            self.__count__('queries')
+        except (ValueError, TypeError) as e:
+            logging.warning(f"Invalid ring event history query {payload!r}: {str(e)}")
+            response = {'id': request_id, 'error': str(e)}
+            self.__count__('errors')
+        except Exception as e:
+            logging.exception(f"Ring event history query {payload!r} failed: {str(e)}")
+            response = {'id': request_id, 'error': 'Internal error'}
+            self.__count__('errors')
+        client.publish(response_topic, json.dumps(response))
+
+    def __count__(self, stat: str):
+        with self.stats_lock:
+            self.stats[stat] += 1
+
+    def __execute__(self, request: Dict) -> List[Dict]:
+        input_name = request.get('input')
+        limit = self.__get_count__(request, 'limit')
+        if 'last' in request:
+            return self.event_store.get_last(self.__get_count__(request, 'last'), input_name)
+        if 'from' in request or 'to' in request:
+            start = self.__parse_time__(request['from']) if 'from' in request else 0
+            end = self.__parse_time__(request['to']) if 'to' in request else datetime.now().timestamp()
+            return self.event_store.get_between(start, end, limit, input_name)
+        raise ValueError("Query must contain 'last' or 'from'/'to'")
+
+    def __get_count__(self, request: Dict, key: str) -> int:
+        # SQLite trata un LIMIT negativo como sin límite, así que solo se admiten valores positivos
+        count = int(request.get(key, self.max_results))
+        if count <= 0:
+            raise ValueError(f"'{key}' must be a positive number")
+        return min(count, self.max_results)
+
+    @staticmethod
+    def __parse_time__(value) -> float:
+        # Segundos desde epoch o fecha ISO 8601. Las fechas sin zona horaria son hora local
+        if isinstance(value, (int, float)):
+            return float(value)
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
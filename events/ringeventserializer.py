@@ -0,0 +1,119 @@
+import json
+import struct
+from datetime import datetime
+from typing import List, Union
+
+from events.ringevent import RingEvent
+from gpio.pressdetector import PressType
+
+
+class RingEventSerializer:
+    def serialize(self, event: RingEvent) -> Union[str, bytes]:
+        raise NotImplementedError()
+
+    def serialize_batch(self, events: List[RingEvent]) -> Union[str, bytes]:
+        raise NotImplementedError()
+
+    def deserialize(self, payload: Union[str, bytes]) -> List[RingEvent]:
+        """Admite tanto un evento suelto como un lote. Siempre devuelve una lista."""
+        raise NotImplementedError()
+
+    @staticmethod
+    def create_from_name(serializer_name: str) -> 'RingEventSerializer':
+        serializer_name = str(serializer_name).lower()
+        if serializer_name == 'json':
+            return JsonRingEventSerializer()
+        if serializer_name == 'binary':
+            return BinaryRingEventSerializer()
+        if serializer_name == 'text':
+            return TextRingEventSerializer()
+        raise ValueError(f"Unknown ring event serializer {serializer_name}")
+
+
+class JsonRingEventSerializer(RingEventSerializer):
+    def serialize(self, event: RingEvent) -> str:
+        return json.dumps(self.__to_dict__(event), separators=(',', ':'))
+
+    def serialize_batch(self, events: List[RingEvent]) -> str:
+        return json.dumps({'events': [self.__to_dict__(event) for event in events]}, separators=(',', ':'))
+
+    def deserialize(self, payload: Union[str, bytes]) -> List[RingEvent]:
+        data = json.loads(payload)
+        event_dicts = data['events'] if 'events' in data else [data]
+        return [RingEvent(device_id=d['device_id'], input_name=d['input'], pin=d['pin'],
+                          press_type=PressType[d['press_type'].upper()],
+                          timestamp=datetime.fromisoformat(d['timestamp']).timestamp(), seq=d['seq'])
+                for d in event_dicts]
+
+    @staticmethod
+    def __to_dict__(event: RingEvent):
+        return {'device_id': event.device_id,
+                'input': event.input_name,
+                'pin': event.pin,
+                'press_type': event.press_type.name.lower(),
+                'timestamp': event.get_datetime().isoformat(timespec='milliseconds'),
+                'seq': event.seq}
+
+
+class BinaryRingEventSerializer(RingEventSerializer):
+    """
+    Cabecera: magic 'RE', versión, número de eventos y device_id (longitud de 1 byte + UTF-8). Cada evento: timestamp
+    (double), seq (uint32), pin (uint8), tipo de pulsación (uint8) y nombre de la entrada (longitud de 1 byte + UTF-8).
+    Todo en little endian. Un evento suelto es un lote de un elemento.
+    """
+    MAGIC = b'RE'
+    VERSION = 1
+    HEADER = struct.Struct('<2sBH')
+    EVENT = struct.Struct('<dIBB')
+
+    def serialize(self, event: RingEvent) -> bytes:
+        return self.serialize_batch([event])
+
+    def serialize_batch(self, events: List[RingEvent]) -> bytes:
+        device_id = events[0].device_id if len(events) > 0 else ''
+        chunks = [self.HEADER.pack(self.MAGIC, self.VERSION, len(events)), self.__pack_str__(device_id)]
+        for event in events:
+            chunks.append(self.EVENT.pack(event.timestamp, event.seq & 0xFFFFFFFF, event.pin,
+                                          event.press_type.value))
+            chunks.append(self.__pack_str__(event.input_name))
+        return b''.join(chunks)
+
+    def deserialize(self, payload: Union[str, bytes]) -> List[RingEvent]:
+        magic, version, count = self.HEADER.unpack_from(payload, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError(f"Unsupported ring event payload: magic = {magic}, version = {version}")
+        device_id, offset = self.__unpack_str__(payload, self.HEADER.size)
+        events = []
+        for _ in range(count):
+            timestamp, seq, pin, press_type = self.EVENT.unpack_from(payload, offset)
+            input_name, offset = self.__unpack_str__(payload, offset + self.EVENT.size)
+            events.append(RingEvent(device_id=device_id, input_name=input_name, pin=pin,
+                                    press_type=PressType(press_type), timestamp=timestamp, seq=seq))
+        return events
+
+    @staticmethod
+    def __pack_str__(value: str) -> bytes:
+        encoded = (value or '').encode('utf-8')[:255]
+        return bytes([len(encoded)]) + encoded
+
+    @staticmethod
+    def __unpack_str__(payload: bytes, offset: int):
+        length = payload[offset]
+        return payload[offset + 1:offset + 1 + length].decode('utf-8'), offset + 1 + length
+
+
+class TextRingEventSerializer(RingEventSerializer):
+    """Formato anterior: solo la fecha y hora local de la pulsación. Se mantiene para los consumidores existentes."""
+
+    def serialize(self, event: RingEvent) -> str:
+        return str(datetime.fromtimestamp(event.timestamp))
+
+    def serialize_batch(self, events: List[RingEvent]) -> str:
+        return "\n".join(self.serialize(event) for event in events)
+
+    def deserialize(self, payload: Union[str, bytes]) -> List[RingEvent]:
+        if isinstance(payload, bytes):
+            payload = payload.decode('utf-8')
+        return [RingEvent(device_id=None, input_name=None, pin=None, press_type=PressType.SINGLE,
+                          timestamp=datetime.fromisoformat(line).timestamp(), seq=None)
+                for line in payload.splitlines() if len(line) > 0]
@@ -0,0 +1,249 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from events.ringevent import RingEvent
+from metrics.metricsregistry import DEFAULT_REGISTRY
+
+RING_EVENT_STORE_WRITES = DEFAULT_REGISTRY.counter('doorbell_history_writes_total',
+                                                   'Ring event history write operations', ['result'])
+
+
+@dataclass
+class RingEventRecord:
+    event: RingEvent
+    # Lo asigna el hilo de escritura al insertar el evento
+    row_id: int = None
+
+
+class RingEventStore:
+    # Historial local de pulsaciones en SQLite. Las escrituras las hace un hilo propio a partir de una cola, de forma
+    # que la pulsación solo paga el coste de añadir una operación a la cola
+    DEFAULT_PATH = './data/history/events.db'
+    DEFAULT_MAX_EVENTS = 10000
+    DEFAULT_MAX_QUEUE_SIZE = 256
+    MAX_WRITE_BATCH_SIZE = 64
+    RETENTION_INTERVAL = 60.0
+
+    SCHEMA = ["CREATE TABLE IF NOT EXISTS ring_events ("
+              "id INTEGER PRIMARY KEY, "
+              "timestamp REAL NOT NULL, "
+              "device_id TEXT, "
+              "input_name TEXT, "
+              "pin INTEGER, "
+              "press_type TEXT, "
+              "seq INTEGER, "
+              "sound_path TEXT, "
+              "sound_played INTEGER, "
+              "publish_result TEXT)",
+              "CREATE INDEX IF NOT EXISTS ring_events_timestamp ON ring_events (timestamp)"]
+    COLUMNS = "id, timestamp, device_id, input_name, pin, press_type, seq, sound_path, sound_played, publish_result"
+
+    def __init__(self, path: str = DEFAULT_PATH, max_events: int = DEFAULT_MAX_EVENTS, max_age_days: float = None,
+                 max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE):
+        self.path = path
+        self.max_events = max_events
+        self.max_age_days = max_age_days
+        self.max_queue_size = max_queue_size
+        # Cola de operaciones (tipo, registro, valor). Las actualizaciones de un evento van siempre detrás de su
+        # inserción, así que cuando se ejecutan ya tienen row_id
+        self.operations = deque()
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.connection = None
+        self.next_retention = 0
+        self.stats = {'written': 0, 'updated': 0, 'dropped': 0, 'failed': 0, 'deleted': 0}
+
+    def __enter__(self):
+        self.init_context()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close_context()
+
+    def init_context(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        # WAL permite leer el historial mientras se escribe; con NORMAL solo se sincroniza al hacer checkpoint
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            for statement in self.SCHEMA:
+                self.connection.execute(statement)
+        self.__enforce_retention__()
+        with self.condition:
+            self.running = True
+        self.thread = threading.Thread(name="RingEventStore", target=self.__run__, daemon=True)
+        self.thread.start()
+
+    def close_context(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        # El hilo vacía la cola antes de terminar
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def is_healthy(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def record(self, event: RingEvent) -> RingEventRecord:
+        record = RingEventRecord(event)
+        self.__submit__('insert', record, None)
+        return record
+
+    def set_sound(self, record: RingEventRecord, sound_path: Optional[str], played: bool):
+        self.__submit__('sound', record, (sound_path, 1 if played else 0))
+
+    def set_publish_result(self, record: RingEventRecord, publish_result: str):
+        self.__submit__('publish', record, publish_result)
+
+    def get_last(self, count: int, input_name: str = None) -> List[Dict]:
+        query = f"SELECT {self.COLUMNS} FROM ring_events"
+        params = []
+        if input_name is not None:
+            query += " WHERE input_name = ?"
+            params.append(input_name)
+        query += " ORDER BY timestamp DESC LIMIT ?"
+        params.append(count)
+        return self.__query__(query, params)
+
+    def get_between(self, start: float, end: float, limit: int, input_name: str = None) -> List[Dict]:
+        # La búsqueda por rango de tiempo usa el índice de timestamp
+        query = f"SELECT {self.COLUMNS} FROM ring_events WHERE timestamp >= ? AND timestamp <= ?"
+        params = [start, end]
+        if input_name is not None:
+            query += " AND input_name = ?"
+            params.append(input_name)
+        query += " ORDER BY timestamp LIMIT ?"
+        params.append(limit)
+        return self.__query__(query, params)
+
+    def get_stats(self):
+        with self.condition:
+            return dict(self.stats, queue_size=len(self.operations))
+
+    def __submit__(self, operation: str, record: RingEventRecord, value):
+        with self.condition:
+            if len(self.operations) >= self.max_queue_size:
+                self.operations.popleft()
+                self.stats['dropped'] += 1
+                RING_EVENT_STORE_WRITES.labels('dropped').inc()
+                logging.warning(f"Ring event history queue is full ({self.max_queue_size} operations). Dropping the "
+                                f"oldest.")
+            self.operations.append((operation, record, value))
+            self.condition.notify()
+
+    def __run__(self):
+        while True:
+            with self.condition:
+                while self.running and len(self.operations) == 0:
+                    self.condition.wait(timeout=self.RETENTION_INTERVAL)
+                    if time.monotonic() >= self.next_retention:
+                        break
+                batch = [self.operations.popleft()
+                         for _ in range(min(len(self.operations), self.MAX_WRITE_BATCH_SIZE))]
+                running = self.running
+            if batch:
+                self.__write__(batch)
+            if not running and not batch:
+                self.__enforce_retention__()
+                return
+            if time.monotonic() >= self.next_retention:
+                self.__enforce_retention__()
+
+    def __write__(self, batch):
+        # Todas las operaciones del lote van en una sola transacción
+        written = 0
+        updated = 0
+        try:
+            with self.connection:
+                for operation, record, value in batch:
+                    if operation == 'insert':
+                        event = record.event
+                        cursor = self.connection.execute(
+                            "INSERT INTO ring_events (timestamp, device_id, input_name, pin, press_type, seq) "
+                            "VALUES (?, ?, ?, ?, ?, ?)",
+                            (event.timestamp, event.device_id, event.input_name, event.pin, event.press_type.name,
+                             event.seq))
+                        record.row_id = cursor.lastrowid
+                        written += 1
+                    elif record.row_id is None:
+                        # La inserción se ha descartado o ha fallado
+                        continue
+                    elif operation == 'sound':
+                        self.connection.execute("UPDATE ring_events SET sound_path = ?, sound_played = ? WHERE id = ?",
+                                                (value[0], value[1], record.row_id))
+                        updated += 1
+                    elif operation == 'publish':
+                        self.connection.execute("UPDATE ring_events SET publish_result = ? WHERE id = ?",
+                                                (value, record.row_id))
+                        updated += 1
+        except sqlite3.Error as e:
+            with self.condition:
+                self.stats['failed'] += len(batch)
+            RING_EVENT_STORE_WRITES.labels('failed').inc(len(batch))
+            logging.error(f"{len(batch)} operations couldn't be written into ring event history {self.path}: "
+                          f"{str(e)}")
+            return
+        with self.condition:
+            self.stats['written'] += written
+            self.stats['updated'] += updated
+        RING_EVENT_STORE_WRITES.labels('written').inc(written)
+        RING_EVENT_STORE_WRITES.labels('updated').inc(updated)
+
+    def __enforce_retention__(self):
+        self.next_retention = time.monotonic() + self.RETENTION_INTERVAL
+        try:
+            with self.connection:
+                deleted = 0
+                if self.max_age_days is not None:
+                    deleted += self.connection.execute("DELETE FROM ring_events WHERE timestamp < ?",
+                                                       (time.time() - self.max_age_days * 86400,)).rowcount
+                if self.max_events is not None:
+                    deleted += self.connection.execute(
+                        "DELETE FROM ring_events WHERE id <= (SELECT id FROM ring_events ORDER BY id DESC "
+                        "LIMIT 1 OFFSET ?)", (self.max_events,)).rowcount
+        except sqlite3.Error as e:
+            logging.error(f"Retention couldn't be applied to ring event history {self.path}: {str(e)}")
+            return
+        if deleted:
+            with self.condition:
+                self.stats['deleted'] += deleted
+            logging.debug(f"{deleted} old events removed from ring event history.")
+
+    def __query__(self, query: str, params) -> List[Dict]:
+        # Cada consulta usa su propia conexión: con WAL las lecturas no esperan al hilo de escritura
+        connection = sqlite3.connect(self.path)
+        try:
+            rows = connection.execute(query, params).fetchall()
+        finally:
+            connection.close()
+        return [self.__to_dict__(row) for row in rows]
+
+    @staticmethod
+    def __to_dict__(row) -> Dict:
+        row_id, timestamp, device_id, input_name, pin, press_type, seq, sound_path, sound_played, publish_result = row
+        return {'id': row_id,
+                'timestamp': timestamp,
+                'datetime': datetime.fromtimestamp(timestamp, timezone.utc).isoformat(),
+                'device_id': device_id,
+                'input': input_name,
+                'pin': pin,
+                'press_type': press_type,
+                'seq': seq,
+                'sound': sound_path,
+                'sound_played': None if sound_played is None else bool(sound_played),
+                'publish_result': publish_result}
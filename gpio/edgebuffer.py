@@ -0,0 +1,58 @@
+import itertools
+import threading
+from array import array
+from typing import List, Tuple
+
+from metrics.metricsregistry import DEFAULT_REGISTRY
+
+EDGE_OVERFLOWS = DEFAULT_REGISTRY.counter('doorbell_gpio_edge_overflows_total',
+                                          'GPIO edges lost because the edge buffer was full')
+
+
+class EdgeBuffer:
+    DEFAULT_SIZE = 256
+
+    def __init__(self, size: int = DEFAULT_SIZE):
+        self.size = size
+        # Todo se reserva al crear el buffer para que la ISR no tenga que reservar memoria
+        self.timestamps = array('q', [0] * size)
+        self.sources = array('i', [0] * size)
+        self.sequences = array('q', [-1] * size)
+        # next() sobre itertools.count es atómico en CPython, así varias ISR pueden escribir sin locks
+        self.write_counter = itertools.count()
+        self.read_seq = 0
+        self.overflows = 0
+        self.data_ready = threading.Event()
+
+    def push(self, source: int, timestamp: int):
+        seq = next(self.write_counter)
+        indx = seq % self.size
+        self.timestamps[indx] = timestamp
+        self.sources[indx] = source
+        self.sequences[indx] = seq
+        self.data_ready.set()
+
+    def pop_all(self) -> List[Tuple[int, int]]:
+        edges = []
+        while True:
+            indx = self.read_seq % self.size
+            seq = self.sequences[indx]
+            if seq < self.read_seq:
+                # La ISR todavía no ha escrito este hueco
+                break
+            if seq > self.read_seq:
+                # El productor ha dado la vuelta al buffer y se han perdido flancos. Se continúa por el más antiguo
+                # que sigue en el buffer
+                oldest_seq = seq - self.size + 1
+                self.overflows += oldest_seq - self.read_seq
+                EDGE_OVERFLOWS.inc(oldest_seq - self.read_seq)
+                self.read_seq = oldest_seq
+                continue
+            edges.append((self.sources[indx], self.timestamps[indx]))
+            self.read_seq += 1
+        return edges
+
+    def wait(self, timeout: float = None) -> bool:
+        ready = self.data_ready.wait(timeout)
+        self.data_ready.clear()
+        return ready
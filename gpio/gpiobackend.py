@@ -0,0 +1,50 @@
+from enum import Enum
+from typing import Callable
+
+
+class PinMode(Enum):
+    INPUT = 0
+    OUTPUT = 1
+
+
+class PullMode(Enum):
+    OFF = 0
+    DOWN = 1
+    UP = 2
+
+
+class EdgeType(Enum):
+    FALLING = 0
+    RISING = 1
+    BOTH = 2
+
+
+class GpioBackend:
+    def setup(self):
+        raise NotImplementedError()
+
+    def pin_mode(self, pin: int, mode: PinMode):
+        raise NotImplementedError()
+
+    def pull_up_dn_control(self, pin: int, pull: PullMode):
+        raise NotImplementedError()
+
+    def isr(self, pin: int, edge: EdgeType, callback: Callable[[], None]):
+        raise NotImplementedError()
+
+    def digital_read(self, pin: int) -> int:
+        raise NotImplementedError()
+
+    def delay(self, ms: int):
+        raise NotImplementedError()
+
+    @staticmethod
+    def create_from_name(backend_name: str) -> 'GpioBackend':
+        backend_name = str(backend_name).lower()
+        if backend_name == 'wiringpi':
+            from gpio.wiringpibackend import WiringPiBackend
+            return WiringPiBackend()
+        if backend_name == 'simulated':
+            from gpio.simulatedbackend import SimulatedBackend
+            return SimulatedBackend()
+        raise ValueError(f"Unknown gpio backend {backend_name}")
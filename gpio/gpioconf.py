@@ -0,0 +1,44 @@
+import logging
+from dataclasses import dataclass
+
+from gpio.pressdetector import PressDetector
+
+
+@dataclass
+class GpioConf:
+    DEFAULT_SWITCH_PIN = 10
+    DEFAULT_ACTIVE_LOW = True
+    DEFAULT_BACKEND = 'wiringpi'
+
+    switch_pin: int = DEFAULT_SWITCH_PIN
+    active_low: bool = DEFAULT_ACTIVE_LOW
+    backend: str = DEFAULT_BACKEND
+    debounce_ms: float = PressDetector.DEFAULT_DEBOUNCE_MS
+    long_press_ms: float = PressDetector.DEFAULT_LONG_PRESS_MS
+    double_press_ms: float = PressDetector.DEFAULT_DOUBLE_PRESS_MS
+
+    @staticmethod
+    def create_from_dict(cfg) -> 'GpioConf':
+        gpio_conf = GpioConf()
+        if 'gpio' not in cfg:
+            logging.warning("No gpio section in conf file. It's going to use default switch pin = {}"
+                            .format(GpioConf.DEFAULT_SWITCH_PIN))
+            return gpio_conf
+
+        gpio_cfg = cfg['gpio']
+        if 'switch_pin' in gpio_cfg:
+            gpio_conf.switch_pin = gpio_cfg['switch_pin']
+        else:
+            logging.warning("No gpio switch_pin in conf file. It's going to use default switch pin = {}"
+                            .format(GpioConf.DEFAULT_SWITCH_PIN))
+        if 'backend' in gpio_cfg:
+            gpio_conf.backend = gpio_cfg['backend']
+        if 'active_low' in gpio_cfg:
+            gpio_conf.active_low = bool(gpio_cfg['active_low'])
+        if 'debounce_ms' in gpio_cfg:
+            gpio_conf.debounce_ms = gpio_cfg['debounce_ms']
+        if 'long_press_ms' in gpio_cfg:
+            gpio_conf.long_press_ms = gpio_cfg['long_press_ms']
+        if 'double_press_ms' in gpio_cfg:
+            gpio_conf.double_press_ms = gpio_cfg['double_press_ms']
+        return gpio_conf
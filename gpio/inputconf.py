@@ -0,0 +1,62 @@
+import logging
+from dataclasses import dataclass
+from typing import List
+
+from network.mqtt.mqtttopic import MqttTopic
+from soundplayer.playbackworker import CoalescePolicy
+
+
+@dataclass
+class InputConf:
+    name: str = None
+    pin: int = 10
+    active_low: bool = True
+    audio_path: str = './data/sounds'
+    volume: float = None
+    topic: MqttTopic = None
+    priority: int = 0
+    policy: CoalescePolicy = None
+
+    def __repr__(self):
+        policy = self.policy.name.lower() if self.policy is not None else None
+        return f"InputConf[name = {self.name}, pin = {self.pin}, audio_path = {self.audio_path}, " \
+               f"volume = {self.volume}, priority = {self.priority}, policy = {policy}, topic = {self.topic}]"
+
+    @staticmethod
+    def create_list_from_dict(cfg, default_input: 'InputConf') -> List['InputConf']:
+        if 'inputs' not in cfg or not cfg['inputs']:
+            return [default_input]
+
+        inputs = []
+        used_pins = set()
+        for indx, input_cfg in enumerate(cfg['inputs']):
+            if 'pin' not in input_cfg:
+                logging.error(f"Input number {indx} has no pin in conf file. It's going to be ignored.")
+                continue
+            pin = input_cfg['pin']
+            if pin in used_pins:
+                logging.error(f"Pin {pin} is used by more than one input in conf file. Input number {indx} "
+                              f"is going to be ignored.")
+                continue
+            used_pins.add(pin)
+
+            topic = default_input.topic
+            if 'pub_topic' in input_cfg:
+                default_qos = default_input.topic.qos if default_input.topic is not None else 0
+                topic = MqttTopic.create_from_cfg(input_cfg['pub_topic'], default_qos)
+            policy = default_input.policy
+            if 'policy' in input_cfg:
+                try:
+                    policy = CoalescePolicy.create_from_str(input_cfg['policy'])
+                except KeyError:
+                    logging.warning(f"Unknown policy {input_cfg['policy']} for input number {indx}. "
+                                    f"It's going to use audio policy.")
+            inputs.append(InputConf(name=input_cfg.get('name', f"input_{indx}"),
+                                    pin=pin,
+                                    active_low=bool(input_cfg.get('active_low', default_input.active_low)),
+                                    audio_path=input_cfg.get('audio_path', default_input.audio_path),
+                                    volume=input_cfg.get('volume', default_input.volume),
+                                    topic=topic,
+                                    priority=int(input_cfg.get('priority', default_input.priority)),
+                                    policy=policy))
+        return inputs
@@ -0,0 +1,221 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from enum import Enum
+from typing import Callable, Dict, List
+
+from gpio.edgebuffer import EdgeBuffer
+from metrics.metricsregistry import DEFAULT_REGISTRY
+
+# Los flancos se cuentan en el hilo de detección y no en la ISR, que solo escribe en el EdgeBuffer
+GPIO_EDGES = DEFAULT_REGISTRY.counter('doorbell_gpio_edges_total', 'GPIO edges captured by the interrupt handlers',
+                                      ['source'])
+PRESSES = DEFAULT_REGISTRY.counter('doorbell_presses_total', 'Debounced button presses', ['source', 'type'])
+PRESS_DETECTION_SECONDS = DEFAULT_REGISTRY.histogram('doorbell_press_detection_seconds',
+                                                     'Time from the first edge of a press to its press event')
+
+
+class PressType(Enum):
+    SINGLE = 0
+    DOUBLE = 1
+    LONG = 2
+
+
+@dataclass
+class PressEvent:
+    source: int
+    press_type: PressType
+    pressed_at: int  # time.monotonic_ns() del primer flanco de la pulsación
+    detected_at: int = None
+
+    def get_detection_latency(self):
+        if self.detected_at is None:
+            return None
+        return (self.detected_at - self.pressed_at) / 1e9
+
+    def __repr__(self):
+        return f"PressEvent[source = {self.source}, press_type = {self.press_type.name}, " \
+               f"detection_latency = {self.get_detection_latency()}]"
+
+
+class PressState(Enum):
+    IDLE = 0
+    PRESSED = 1  # Pulsado, todavía no se sabe si es pulsación larga
+    WAIT_SECOND = 2  # Soltado, esperando una posible segunda pulsación
+    WAIT_RELEASE = 3  # El evento ya se ha emitido, se espera a que se suelte
+
+
+class PressClassifier:
+    def __init__(self, source: int, long_press_ns: int = 0, double_press_ns: int = 0):
+        self.source = source
+        self.long_press_ns = long_press_ns
+        self.double_press_ns = double_press_ns
+        self.state = PressState.IDLE
+        self.pressed = False
+        self.pressed_at = None
+        self.deadline = None
+
+    def on_level(self, pressed: bool, timestamp: int) -> List[PressEvent]:
+        if pressed == self.pressed:
+            return []
+        self.pressed = pressed
+        events = []
+        if pressed:
+            if self.state == PressState.IDLE:
+                self.pressed_at = timestamp
+                if self.long_press_ns == 0 and self.double_press_ns == 0:
+                    # Sin pulsación larga ni doble no hay nada que esperar
+                    events.append(self.__event__(PressType.SINGLE))
+                    self.state = PressState.WAIT_RELEASE
+                else:
+                    self.state = PressState.PRESSED
+                    self.deadline = timestamp + self.long_press_ns if self.long_press_ns > 0 else None
+            elif self.state == PressState.WAIT_SECOND:
+                events.append(self.__event__(PressType.DOUBLE))
+                self.state = PressState.WAIT_RELEASE
+                self.deadline = None
+        else:
+            if self.state == PressState.PRESSED:
+                if self.double_press_ns > 0:
+                    self.state = PressState.WAIT_SECOND
+                    self.deadline = timestamp + self.double_press_ns
+                else:
+                    events.append(self.__event__(PressType.SINGLE))
+                    self.state = PressState.IDLE
+                    self.deadline = None
+            elif self.state == PressState.WAIT_RELEASE:
+                self.state = PressState.IDLE
+        return events
+
+    def on_timeout(self, now: int) -> List[PressEvent]:
+        if self.deadline is None or now < self.deadline:
+            return []
+        self.deadline = None
+        if self.state == PressState.PRESSED:
+            self.state = PressState.WAIT_RELEASE
+            return [self.__event__(PressType.LONG)]
+        if self.state == PressState.WAIT_SECOND:
+            self.state = PressState.IDLE
+            return [self.__event__(PressType.SINGLE)]
+        return []
+
+    def __event__(self, press_type: PressType) -> PressEvent:
+        return PressEvent(source=self.source, press_type=press_type, pressed_at=self.pressed_at)
+
+
+class PressDetector:
+    DEFAULT_DEBOUNCE_MS = 20
+    DEFAULT_LONG_PRESS_MS = 0
+    DEFAULT_DOUBLE_PRESS_MS = 0
+
+    def __init__(self, edge_buffer: EdgeBuffer, is_pressed: Callable[[int], bool],
+                 debounce_ms: int = DEFAULT_DEBOUNCE_MS, long_press_ms: int = DEFAULT_LONG_PRESS_MS,
+                 double_press_ms: int = DEFAULT_DOUBLE_PRESS_MS):
+        self.edge_buffer = edge_buffer
+        self.is_pressed = is_pressed
+        self.debounce_ns = int(debounce_ms * 1e6)
+        self.long_press_ns = int(long_press_ms * 1e6)
+        self.double_press_ns = int(double_press_ms * 1e6)
+        self.classifiers: Dict[int, PressClassifier] = {}
+        # source -> (timestamp del primer flanco de la ráfaga, instante en el que la línea se considera estable)
+        self.settling: Dict[int, List[int]] = {}
+        self.handlers: List[Callable[[PressEvent], None]] = []
+        self.running = False
+        self.thread = None
+        # Se llama si el hilo termina por un error inesperado
+        self.on_failure = None
+        self.stats = {'edges': 0, 'presses': 0}
+
+    def set_timings(self, debounce_ms: int, long_press_ms: int, double_press_ms: int):
+        self.debounce_ns = int(debounce_ms * 1e6)
+        self.long_press_ns = int(long_press_ms * 1e6)
+        self.double_press_ns = int(double_press_ms * 1e6)
+        # Los clasificadores existentes se actualizan; una pulsación en curso termina con los tiempos nuevos
+        for classifier in list(self.classifiers.values()):
+            classifier.long_press_ns = self.long_press_ns
+            classifier.double_press_ns = self.double_press_ns
+
+    def add_handler(self, handler: Callable[[PressEvent], None]):
+        self.handlers.append(handler)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(name="PressDetector", target=self.__run_guarded__, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.edge_buffer.data_ready.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['overflows'] = self.edge_buffer.overflows
+        return stats
+
+    def is_alive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def __run_guarded__(self):
+        try:
+            self.__run__()
+        except Exception as e:
+            logging.exception(f"PressDetector stopped unexpectedly: {str(e)}")
+            if self.on_failure is not None:
+                self.on_failure()
+
+    def __run__(self):
+        while self.running:
+            self.edge_buffer.wait(self.__next_timeout__())
+            if not self.running:
+                break
+            for source, timestamp in self.edge_buffer.pop_all():
+                self.stats['edges'] += 1
+                GPIO_EDGES.labels(source).inc()
+                settling = self.settling.get(source)
+                if settling is None:
+                    self.settling[source] = [timestamp, timestamp + self.debounce_ns]
+                else:
+                    settling[1] = timestamp + self.debounce_ns
+            now = time.monotonic_ns()
+            for source, (first_edge, stable_at) in list(self.settling.items()):
+                if now >= stable_at:
+                    del self.settling[source]
+                    # La línea lleva debounce_ms sin cambiar: su nivel actual es el nivel real del pulsador
+                    self.__emit__(self.__get_classifier__(source).on_level(self.is_pressed(source), first_edge))
+            for classifier in self.classifiers.values():
+                self.__emit__(classifier.on_timeout(now))
+
+    def __next_timeout__(self):
+        deadlines = [stable_at for _, stable_at in self.settling.values()]
+        deadlines += [c.deadline for c in self.classifiers.values() if c.deadline is not None]
+        if len(deadlines) == 0:
+            return None
+        return max(min(deadlines) - time.monotonic_ns(), 0) / 1e9
+
+    def __get_classifier__(self, source: int) -> PressClassifier:
+        classifier = self.classifiers.get(source)
+        if classifier is None:
+            classifier = PressClassifier(source, long_press_ns=self.long_press_ns,
+                                         double_press_ns=self.double_press_ns)
+            self.classifiers[source] = classifier
+        return classifier
+
+    def __emit__(self, events: List[PressEvent]):
+        for event in events:
+            event.detected_at = time.monotonic_ns()
+            self.stats['presses'] += 1
+            PRESSES.labels(event.source, event.press_type.name.lower()).inc()
+            PRESS_DETECTION_SECONDS.observe(event.get_detection_latency())
+            # Argumentos diferidos: el texto solo se construye si el mensaje se llega a escribir
+            logging.debug("Button pressed! %s", event)
+            for handler in self.handlers:
+                try:
+                    handler(event)
+                except Exception as e:
+                    logging.exception(f"Error handling {event}: {str(e)}")
@@ -0,0 +1,93 @@
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+from gpio.gpiobackend import GpioBackend, PinMode, PullMode, EdgeType
+
+
+class SimulatedBackend(GpioBackend):
+    def __init__(self, seed: int = None):
+        self.levels: Dict[int, int] = {}
+        self.callbacks: Dict[int, Tuple[EdgeType, Callable[[], None]]] = {}
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+
+    def setup(self):
+        pass
+
+    def pin_mode(self, pin: int, mode: PinMode):
+        with self.lock:
+            self.levels.setdefault(pin, 0)
+
+    def pull_up_dn_control(self, pin: int, pull: PullMode):
+        # La resistencia de pull fija el nivel de reposo del pin
+        with self.lock:
+            self.levels[pin] = 1 if pull == PullMode.UP else 0
+
+    def isr(self, pin: int, edge: EdgeType, callback: Callable[[], None]):
+        with self.lock:
+            self.callbacks[pin] = (edge, callback)
+
+    def digital_read(self, pin: int) -> int:
+        return self.levels.get(pin, 0)
+
+    def delay(self, ms: int):
+        time.sleep(ms / 1000)
+
+    def set_level(self, pin: int, level: int):
+        with self.lock:
+            old_level = self.levels.get(pin, 0)
+            self.levels[pin] = level
+            edge, callback = self.callbacks.get(pin, (None, None))
+        if callback is None or old_level == level:
+            return
+        if edge == EdgeType.BOTH or (edge == EdgeType.RISING and level == 1) or \
+                (edge == EdgeType.FALLING and level == 0):
+            callback()
+
+    def run_edge_train(self, pin: int, edge_train: List[Tuple[float, int]]):
+        # Cada elemento es (segundos de espera antes del flanco, nivel tras el flanco)
+        for wait_time, level in edge_train:
+            if wait_time > 0:
+                time.sleep(wait_time)
+            self.set_level(pin, level)
+
+    def press(self, pin: int, hold_ms: float = 50, bounces: int = 0, bounce_ms: float = 0,
+              active_low: bool = True) -> int:
+        pressed_at = time.monotonic_ns()
+        self.run_edge_train(pin, self.create_press_train(hold_ms, bounces, bounce_ms, active_low))
+        return pressed_at
+
+    def create_press_train(self, hold_ms: float = 50, bounces: int = 0, bounce_ms: float = 0,
+                           active_low: bool = True) -> List[Tuple[float, int]]:
+        pressed_level = 0 if active_low else 1
+        released_level = 1 - pressed_level
+        edge_train = self.__transition__(pressed_level, released_level, bounces, bounce_ms)
+        release_train = self.__transition__(released_level, pressed_level, bounces, bounce_ms)
+        release_train[0] = (hold_ms / 1000, released_level)
+        return edge_train + release_train
+
+    def create_random_train(self, presses: int, min_gap_ms: float = 100, max_gap_ms: float = 1000,
+                            min_hold_ms: float = 30, max_hold_ms: float = 300, max_bounces: int = 3,
+                            max_bounce_ms: float = 5, active_low: bool = True) -> List[Tuple[float, int]]:
+        edge_train = []
+        for _ in range(presses):
+            press_train = self.create_press_train(hold_ms=self.random.uniform(min_hold_ms, max_hold_ms),
+                                                  bounces=self.random.randrange(max_bounces + 1),
+                                                  bounce_ms=self.random.uniform(0, max_bounce_ms),
+                                                  active_low=active_low)
+            press_train[0] = (self.random.uniform(min_gap_ms, max_gap_ms) / 1000, press_train[0][1])
+            edge_train += press_train
+        return edge_train
+
+    @staticmethod
+    def __transition__(target_level: int, previous_level: int, bounces: int,
+                       bounce_ms: float) -> List[Tuple[float, int]]:
+        # Cambio de nivel con ruido de rebote: la línea vuelve al nivel anterior varias veces antes de estabilizarse
+        gap = bounce_ms / 1000 / (2 * bounces) if bounces > 0 else 0
+        edge_train = [(0, target_level)]
+        for _ in range(bounces):
+            edge_train.append((gap, previous_level))
+            edge_train.append((gap, target_level))
+        return edge_train
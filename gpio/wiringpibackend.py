@@ -0,0 +1,36 @@
+from typing import Callable
+
+from gpio.gpiobackend import GpioBackend, PinMode, PullMode, EdgeType
+
+
+class WiringPiBackend(GpioBackend):
+    def __init__(self):
+        # wiringpi solo se puede importar en la placa, así el resto del código se puede usar fuera de ella
+        import wiringpi
+        self.wiringpi = wiringpi
+        self.pin_modes = {PinMode.INPUT: wiringpi.GPIO.INPUT,
+                          PinMode.OUTPUT: wiringpi.GPIO.OUTPUT}
+        self.pull_modes = {PullMode.OFF: wiringpi.GPIO.PUD_OFF,
+                           PullMode.DOWN: wiringpi.GPIO.PUD_DOWN,
+                           PullMode.UP: wiringpi.GPIO.PUD_UP}
+        self.edge_types = {EdgeType.FALLING: wiringpi.GPIO.INT_EDGE_FALLING,
+                           EdgeType.RISING: wiringpi.GPIO.INT_EDGE_RISING,
+                           EdgeType.BOTH: wiringpi.GPIO.INT_EDGE_BOTH}
+
+    def setup(self):
+        self.wiringpi.wiringPiSetupGpio()
+
+    def pin_mode(self, pin: int, mode: PinMode):
+        self.wiringpi.pinMode(pin, self.pin_modes[mode])
+
+    def pull_up_dn_control(self, pin: int, pull: PullMode):
+        self.wiringpi.pullUpDnControl(pin, self.pull_modes[pull])
+
+    def isr(self, pin: int, edge: EdgeType, callback: Callable[[], None]):
+        self.wiringpi.wiringPiISR(pin, self.edge_types[edge], callback)
+
+    def digital_read(self, pin: int) -> int:
+        return self.wiringpi.digitalRead(pin)
+
+    def delay(self, ms: int):
+        self.wiringpi.delay(ms)
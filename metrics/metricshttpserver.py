@@ -0,0 +1,61 @@
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from metrics.metricsregistry import MetricsRegistry, DEFAULT_REGISTRY
+
+
+class MetricsHttpServer:
+    DEFAULT_HOST = '127.0.0.1'
+    DEFAULT_PORT = 9108
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, registry: MetricsRegistry = DEFAULT_REGISTRY, host: str = DEFAULT_HOST,
+                 port: int = DEFAULT_PORT):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.http_server = None
+        self.thread = None
+
+    def __enter__(self):
+        self.init_context()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close_context()
+
+    def init_context(self):
+        registry = self.registry
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', MetricsHttpServer.CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug(f"Metrics request from {self.address_string()}: {format % args}")
+
+        self.http_server = ThreadingHTTPServer((self.host, self.port), MetricsRequestHandler)
+        self.http_server.daemon_threads = True
+        # Con puerto 0 el sistema elige uno libre
+        self.port = self.http_server.server_address[1]
+        self.thread = threading.Thread(name="MetricsHttpServer", target=self.http_server.serve_forever, daemon=True)
+        self.thread.start()
+        logging.info(f"Metrics endpoint listening on http://{self.host}:{self.port}/metrics")
+
+    def close_context(self):
+        if self.http_server is None:
+            return
+        self.http_server.shutdown()
+        self.http_server.server_close()
+        self.thread.join()
+        self.http_server = None
+        self.thread = None
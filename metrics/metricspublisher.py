@@ -0,0 +1,48 @@
+import json
+import logging
+import threading
+
+from metrics.metricsregistry import MetricsRegistry, DEFAULT_REGISTRY
+from network.mqtt.mqttclient import MqttClient
+from network.mqtt.mqtttopic import MqttTopic
+
+
+class MetricsPublisher:
+    DEFAULT_INTERVAL = 60.0
+
+    def __init__(self, mqtt_client: MqttClient, topic: MqttTopic, registry: MetricsRegistry = DEFAULT_REGISTRY,
+                 interval: float = DEFAULT_INTERVAL):
+        self.mqtt_client = mqtt_client
+        self.topic = topic
+        self.registry = registry
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        self.init_context()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close_context()
+
+    def init_context(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(name="MetricsPublisher", target=self.__run__, daemon=True)
+        self.thread.start()
+
+    def close_context(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def publish(self):
+        self.mqtt_client.publish(topic=self.topic, payload=json.dumps(self.registry.get_snapshot()))
+
+    def __run__(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.publish()
+            except Exception as e:
+                logging.exception(f"Metrics couldn't be published to {self.topic}: {str(e)}")
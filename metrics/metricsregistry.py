@@ -0,0 +1,224 @@
+import bisect
+import math
+import threading
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+# Pensados para latencias de un timbre: desde lo que tarda el antirrebote hasta un broker lento
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class CounterValue:
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        # Un lock sin contención cuesta lo mismo que una llamada a función, se puede usar desde la ISR
+        with self.lock:
+            self.value += amount
+
+    def get(self) -> float:
+        return self.value
+
+
+class GaugeValue:
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+        self.lock = threading.Lock()
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1.0):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def set_function(self, function: Callable[[], float]):
+        # El valor se calcula al leer la métrica, así no hay que actualizarlo desde el código instrumentado
+        self.function = function
+
+    def get(self) -> float:
+        if self.function is not None:
+            return self.function()
+        return self.value
+
+
+class HistogramValue:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        indx = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[indx] += 1
+            self.sum += value
+            self.count += 1
+
+    def get(self) -> Tuple[List[Tuple[float, int]], float, int]:
+        with self.lock:
+            counts = list(self.counts)
+            total_sum = self.sum
+            total_count = self.count
+        cumulative = []
+        accumulated = 0
+        for upper_bound, count in zip(list(self.buckets) + [math.inf], counts):
+            accumulated += count
+            cumulative.append((upper_bound, accumulated))
+        return cumulative, total_sum, total_count
+
+
+class Metric:
+    TYPE = None
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.values: Dict[Tuple[str, ...], Any] = {}
+        self.lock = threading.Lock()
+        self.default = self.labels() if len(self.label_names) == 0 else None
+
+    def labels(self, *label_values):
+        key = tuple(str(label_value) for label_value in label_values)
+        value = self.values.get(key)
+        if value is None:
+            if len(key) != len(self.label_names):
+                raise ValueError(f"Metric {self.name} expects labels {self.label_names}, got {key}.")
+            with self.lock:
+                value = self.values.setdefault(key, self.__create_value__())
+        return value
+
+    def get_values(self) -> List[Tuple[Dict[str, str], Any]]:
+        with self.lock:
+            items = list(self.values.items())
+        return [(dict(zip(self.label_names, key)), value.get()) for key, value in items]
+
+    def __create_value__(self):
+        raise NotImplementedError()
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def inc(self, amount: float = 1.0):
+        self.default.inc(amount)
+
+    def __create_value__(self):
+        return CounterValue()
+
+
+class Gauge(Metric):
+    TYPE = 'gauge'
+
+    def set(self, value: float):
+        self.default.set(value)
+
+    def inc(self, amount: float = 1.0):
+        self.default.inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self.default.dec(amount)
+
+    def set_function(self, function: Callable[[], float]):
+        self.default.set_function(function)
+
+    def __create_value__(self):
+        return GaugeValue()
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help_text, label_names)
+
+    def observe(self, value: float):
+        self.default.observe(value)
+
+    def __create_value__(self):
+        return HistogramValue(self.buckets)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self.lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> Counter:
+        return self.__register__(Counter(name, help_text, label_names))
+
+    def gauge(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self.__register__(Gauge(name, help_text, label_names))
+
+    def histogram(self, name: str, help_text: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        return self.__register__(Histogram(name, help_text, label_names, buckets))
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for metric in self.__get_metrics__():
+            lines.append(f"# HELP {metric.name} {self.__escape__(metric.help_text, help_text=True)}")
+            lines.append(f"# TYPE {metric.name} {metric.TYPE}")
+            for labels, value in metric.get_values():
+                if isinstance(metric, Histogram):
+                    buckets, total_sum, total_count = value
+                    for upper_bound, count in buckets:
+                        bucket_labels = dict(labels)
+                        bucket_labels['le'] = '+Inf' if math.isinf(upper_bound) else repr(upper_bound)
+                        lines.append(f"{metric.name}_bucket{self.__format_labels__(bucket_labels)} {count}")
+                    lines.append(f"{metric.name}_sum{self.__format_labels__(labels)} {repr(float(total_sum))}")
+                    lines.append(f"{metric.name}_count{self.__format_labels__(labels)} {total_count}")
+                else:
+                    lines.append(f"{metric.name}{self.__format_labels__(labels)} {repr(float(value))}")
+        return "\n".join(lines) + "\n"
+
+    def get_snapshot(self) -> Dict[str, Any]:
+        snapshot = {}
+        for metric in self.__get_metrics__():
+            values = {}
+            for labels, value in metric.get_values():
+                if isinstance(metric, Histogram):
+                    _, total_sum, total_count = value
+                    value = {'count': total_count, 'sum': total_sum}
+                values[",".join(f"{k}={v}" for k, v in labels.items())] = value
+            snapshot[metric.name] = values[''] if len(metric.label_names) == 0 else values
+        return snapshot
+
+    def __register__(self, metric: Metric):
+        with self.lock:
+            # Registrar dos veces el mismo nombre devuelve la métrica existente, así los módulos se pueden recargar
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.label_names != metric.label_names:
+                    raise ValueError(f"Metric {metric.name} is already registered with a different definition.")
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def __get_metrics__(self) -> List[Metric]:
+        with self.lock:
+            return list(self.metrics.values())
+
+    @staticmethod
+    def __format_labels__(labels: Dict[str, str]) -> str:
+        if len(labels) == 0:
+            return ''
+        return '{' + ','.join(f'{k}="{MetricsRegistry.__escape__(v)}"' for k, v in labels.items()) + '}'
+
+    @staticmethod
+    def __escape__(text: str, help_text: bool = False) -> str:
+        text = text.replace('\\', '\\\\').replace('\n', '\\n')
+        return text if help_text else text.replace('"', '\\"')
+
+
+DEFAULT_REGISTRY = MetricsRegistry()
@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import random
+import threading
+import uuid
+from typing import Any, Callable, List
+
+from paho.mqtt import client as mqtt_client
+from paho.mqtt.client import MQTTv311
+
+from network.mqtt.mqttresponsecode import MqttResponseCode
+from network.mqtt.mqtttopic import MqttTopic
+from network.mqtt.mqtttopictrie import MqttTopicTrie
+from network.url import BasicAuthURL
+from utils.stringutils import is_empty_string
+
+
+class AsyncMqttClient:
+    MISC_INTERVAL = 1.0
+    CONNACK_TIMEOUT = 10.0
+    DISCONNECT_TIMEOUT = 5.0
+    DEFAULT_RECONNECT_MIN_DELAY = 1.0
+    DEFAULT_RECONNECT_MAX_DELAY = 60.0
+
+    def __init__(self, client_id: str = None, broker_url: BasicAuthURL = None, subscribed_topics: List[MqttTopic] = [],
+                 use_web_sockets: bool = False, on_connect_success: Callable = None,
+                 on_connect_error: Callable = None, reconnect_min_delay: float = DEFAULT_RECONNECT_MIN_DELAY,
+                 reconnect_max_delay: float = DEFAULT_RECONNECT_MAX_DELAY):
+
+        self.client_id = str(uuid.uuid1()) if is_empty_string(client_id) else f"{client_id}_{str(uuid.uuid1())}"
+        self.broker_url = broker_url
+        self.mqtt_client = None
+        self.loop = None
+        self.loop_thread = None
+        self.subscribed_topics = list(subscribed_topics)
+        self.topic_trie = MqttTopicTrie()
+        for topic in self.subscribed_topics:
+            self.topic_trie.add(topic)
+        self.use_web_sockets = use_web_sockets
+        self.on_connect_success = on_connect_success
+        self.on_connect_error = on_connect_error
+        self.reconnect_min_delay = reconnect_min_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.connack_future = None
+        self.disconnect_future = None
+        self.misc_handle = None
+        self.reconnect_task = None
+        self.closing = False
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.disconnect()
+
+    async def connect(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.current_thread()
+        self.closing = False
+        self.__create_mqtt_client__()
+        logging.info(f"Connecting asyncio MQTT client with ID = {self.client_id}")
+        self.connack_future = self.loop.create_future()
+        # La conexión TCP (y el handshake TLS si lo hay) es bloqueante, así que se hace fuera del event loop
+        await self.loop.run_in_executor(None, self.mqtt_client.connect, self.broker_url.hostname,
+                                        self.broker_url.port)
+        rc = await asyncio.wait_for(self.connack_future, timeout=self.CONNACK_TIMEOUT)
+        if rc != MqttResponseCode.NO_ERROR:
+            raise ConnectionError(str(rc))
+
+    async def disconnect(self):
+        self.closing = True
+        if self.reconnect_task is not None:
+            self.reconnect_task.cancel()
+            self.reconnect_task = None
+        if self.mqtt_client is None:
+            return
+        logging.info(f"Asyncio MQTT client with ID = {self.client_id} is disconnecting.")
+        self.disconnect_future = self.loop.create_future()
+        self.mqtt_client.disconnect()
+        try:
+            await asyncio.wait_for(self.disconnect_future, timeout=self.DISCONNECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.warning(f"Asyncio MQTT client with ID = {self.client_id} didn't disconnect cleanly.")
+
+    def is_connected(self):
+        return self.mqtt_client is not None and self.mqtt_client.is_connected()
+
+    def publish(self, topic: MqttTopic, payload: Any) -> MqttResponseCode:
+        # paho solo encola el paquete; la escritura la hace el event loop cuando el socket admite datos
+        result = self.mqtt_client.publish(topic=topic.name, qos=topic.qos, payload=payload)
+        status = MqttResponseCode(result[0])
+        if status != MqttResponseCode.NO_ERROR:
+            logging.error(f"Failed to send message to topic = {topic}. Status code = {str(status)}.")
+        return status
+
+    def subscribe(self, topic: MqttTopic):
+        self.subscribed_topics.append(topic)
+        previous_qos = self.topic_trie.get_qos(topic.name)
+        self.topic_trie.add(topic)
+        if (previous_qos is None or topic.qos > previous_qos) and self.is_connected():
+            self.mqtt_client.subscribe(topic.name, topic.qos)
+
+    def unsubscribe(self, topic: MqttTopic):
+        if topic in self.subscribed_topics:
+            self.subscribed_topics.remove(topic)
+        if self.topic_trie.remove(topic) and self.is_connected():
+            self.mqtt_client.unsubscribe(topic.name)
+
+    def __create_mqtt_client__(self):
+        if self.use_web_sockets:
+            self.mqtt_client = mqtt_client.Client(client_id=self.client_id, protocol=MQTTv311, transport='websockets')
+        else:
+            self.mqtt_client = mqtt_client.Client(client_id=self.client_id, protocol=MQTTv311)
+
+        if self.broker_url.tls_cert_path is not None:
+            self.mqtt_client.tls_set(self.broker_url.tls_cert_path)
+
+        if isinstance(self.broker_url, BasicAuthURL) and self.broker_url.user is not None and \
+                self.broker_url.passwd is not None:
+            self.mqtt_client.username_pw_set(self.broker_url.user, self.broker_url.passwd)
+
+        self.mqtt_client.on_connect = self.__on_connect__
+        self.mqtt_client.on_disconnect = self.__on_disconnect__
+        self.mqtt_client.on_message = self.__on_message__
+        self.mqtt_client.on_socket_open = self.__on_socket_open__
+        self.mqtt_client.on_socket_close = self.__on_socket_close__
+        self.mqtt_client.on_socket_register_write = self.__on_socket_register_write__
+        self.mqtt_client.on_socket_unregister_write = self.__on_socket_unregister_write__
+
+    def __call_in_loop__(self, function: Callable, *args):
+        # connect() se ejecuta en un hilo del executor, pero el registro de sockets se tiene que hacer en el loop
+        if threading.current_thread() is self.loop_thread:
+            function(*args)
+        else:
+            self.loop.call_soon_threadsafe(function, *args)
+
+    def __on_socket_open__(self, client, userdata, sock):
+        def register():
+            self.loop.add_reader(sock, client.loop_read)
+            self.__schedule_misc__()
+        self.__call_in_loop__(register)
+
+    def __on_socket_close__(self, client, userdata, sock):
+        def unregister():
+            self.loop.remove_reader(sock)
+            self.loop.remove_writer(sock)
+            if self.misc_handle is not None:
+                self.misc_handle.cancel()
+                self.misc_handle = None
+        self.__call_in_loop__(unregister)
+
+    def __on_socket_register_write__(self, client, userdata, sock):
+        self.__call_in_loop__(self.loop.add_writer, sock, client.loop_write)
+
+    def __on_socket_unregister_write__(self, client, userdata, sock):
+        self.__call_in_loop__(self.loop.remove_writer, sock)
+
+    def __schedule_misc__(self):
+        # loop_misc gestiona los keepalive y los reintentos; se ejecuta con un timer del event loop, sin polling
+        def misc():
+            if self.mqtt_client is not None and self.mqtt_client.loop_misc() == mqtt_client.MQTT_ERR_SUCCESS:
+                self.misc_handle = self.loop.call_later(self.MISC_INTERVAL, misc)
+            else:
+                self.misc_handle = None
+        if self.misc_handle is None:
+            self.misc_handle = self.loop.call_later(self.MISC_INTERVAL, misc)
+
+    def __on_connect__(self, client, userdata, flags, rc):
+        rc = MqttResponseCode(rc)
+        if self.connack_future is not None and not self.connack_future.done():
+            self.connack_future.set_result(rc)
+        if rc == MqttResponseCode.NO_ERROR:
+            logging.info(f"Asyncio MQTT client with id = {self.client_id} is connected to Broker!")
+            topics = self.topic_trie.get_filters()
+            if len(topics) > 0:
+                self.mqtt_client.subscribe(topics)
+            if self.on_connect_success is not None:
+                self.on_connect_success()
+        else:
+            logging.error(f"Asyncio MQTT client with id = {self.client_id} connection attempt failed: {str(rc)}")
+            if self.on_connect_error is not None:
+                self.on_connect_error()
+
+    def __on_disconnect__(self, client, userdata, rc):
+        rc = MqttResponseCode(rc)
+        if self.disconnect_future is not None and not self.disconnect_future.done():
+            self.disconnect_future.set_result(rc)
+        if rc != MqttResponseCode.NO_ERROR:
+            logging.error(f"Asyncio MQTT client with id = {self.client_id}. Unexpected disconnection! "
+                          f"Response code = {str(rc)}.")
+            if not self.closing and self.reconnect_task is None:
+                self.reconnect_task = self.loop.create_task(self.__reconnect__())
+        else:
+            logging.info(f"Asyncio MQTT client with id = {self.client_id} disconnected successfully.")
+
+    def __on_message__(self, client, userdata, msg):
+        logging.debug("topic = %s, payload = %s", msg.topic, msg.payload)
+        for topic in self.topic_trie.match(msg.topic):
+            if topic.callback is None:
+                continue
+            if asyncio.iscoroutinefunction(topic.callback):
+                self.loop.create_task(topic.callback(msg.topic, msg.payload))
+            elif topic.threaded_callback:
+                self.loop.run_in_executor(None, topic.callback, msg.topic, msg.payload)
+            else:
+                topic.callback(msg.topic, msg.payload)
+
+    async def __reconnect__(self):
+        delay = self.reconnect_min_delay
+        try:
+            while not self.closing:
+                wait_time = delay / 2 + random.uniform(0, delay / 2)
+                logging.info(f"Asyncio MQTT client with ID = {self.client_id} reconnecting in {wait_time:.2f}s.")
+                await asyncio.sleep(wait_time)
+                try:
+                    await self.connect()
+                    return
+                except Exception as e:
+                    logging.error(f"Asyncio MQTT client with ID = {self.client_id} couldn't reconnect: {str(e)}")
+                delay = min(delay * 2, self.reconnect_max_delay)
+        finally:
+            self.reconnect_task = None
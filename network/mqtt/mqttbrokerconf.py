@@ -0,0 +1,82 @@
+import logging
+from typing import Dict, Optional
+
+from network.mqtt.mqttexceptions import NoMqttHostSection
+from network.mqtt.mqtttopic import MqttTopic
+from network.url import BasicAuthURL
+
+
+class MqttBrokerConf:
+    DEFAULT_NAME = 'default'
+    DEFAULT_PORT = 1883
+
+    def __init__(self, name: str = DEFAULT_NAME,
+                 url: BasicAuthURL = BasicAuthURL(protocol="mqtt", hostname="127.0.0.1", port=DEFAULT_PORT),
+                 topic_prefix: str = None, topic_map: Dict[str, Optional[MqttTopic]] = None):
+        self.name = name
+        self.url = url
+        self.topic_prefix = topic_prefix
+        # topic del timbre -> topic en este broker. None indica que ese topic no se publica en este broker
+        self.topic_map = topic_map if topic_map is not None else {}
+        self.mapped_topics: Dict[str, Optional[MqttTopic]] = {}
+
+    def __repr__(self):
+        return f"MqttBrokerConf[name = {self.name}, url = {self.url!r}, topic_prefix = {self.topic_prefix}, " \
+               f"topic_map = {self.topic_map}]"
+
+    def __eq__(self, other):
+        if not isinstance(other, MqttBrokerConf):
+            return False
+        return self.name == other.name and self.url == other.url and \
+            self.url.tls_cert_path == other.url.tls_cert_path and self.topic_prefix == other.topic_prefix and \
+            self.topic_map == other.topic_map
+
+    def map_topic(self, topic: MqttTopic) -> Optional[MqttTopic]:
+        # Los topics traducidos se guardan para no crear un MqttTopic nuevo en cada publicación
+        if topic.name in self.mapped_topics:
+            return self.mapped_topics[topic.name]
+        if topic.name in self.topic_map:
+            mapped_topic = self.topic_map[topic.name]
+        elif self.topic_prefix:
+            mapped_topic = MqttTopic(name=f"{self.topic_prefix.rstrip('/')}/{topic.name}", qos=topic.qos)
+        else:
+            mapped_topic = topic
+        self.mapped_topics[topic.name] = mapped_topic
+        return mapped_topic
+
+    @staticmethod
+    def create_from_dict(broker_cfg, name: str = DEFAULT_NAME, default_qos: int = 0) -> 'MqttBrokerConf':
+        user = None
+        passwd = None
+        port = MqttBrokerConf.DEFAULT_PORT
+
+        if 'host' in broker_cfg:
+            host = broker_cfg['host']
+        else:
+            raise NoMqttHostSection()
+
+        if 'port' in broker_cfg:
+            port = broker_cfg['port']
+        else:
+            logging.warning(f"No mqtt broker {name} port section into configuration file. Mqtt client is going to "
+                            f"start using {MqttBrokerConf.DEFAULT_PORT} port.")
+
+        if 'user' in broker_cfg:
+            user = broker_cfg['user']
+        else:
+            logging.warning(f"No mqtt broker {name} user section into configuration file.")
+
+        if 'passwd' in broker_cfg:
+            passwd = broker_cfg['passwd']
+        else:
+            logging.warning(f"No mqtt broker {name} passwd section into configuration file.")
+
+        url = BasicAuthURL(protocol="mqtt", hostname=host, port=port, user=user, passwd=passwd)
+        if 'tls_cert' in broker_cfg:
+            url.tls_cert_path = broker_cfg['tls_cert']
+
+        topic_map = {}
+        for topic_name, mapped_topic_cfg in (broker_cfg.get('topics') or {}).items():
+            topic_map[str(topic_name)] = MqttTopic.create_from_cfg(mapped_topic_cfg, default_qos) \
+                if mapped_topic_cfg else None
+        return MqttBrokerConf(name=name, url=url, topic_prefix=broker_cfg.get('topic_prefix'), topic_map=topic_map)
@@ -0,0 +1,141 @@
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Callable, Dict, List
+
+
+class OverflowPolicy(Enum):
+    BLOCK = 0
+    DROP_OLDEST = 1
+    DROP_NEWEST = 2
+
+    @staticmethod
+    def create_from_str(policy_name: str):
+        return OverflowPolicy[str(policy_name).upper()]
+
+
+@dataclass
+class TopicStats:
+    queue_depth: int = 0
+    processed: int = 0
+    dropped: int = 0
+    total_duration: float = 0.0
+    max_duration: float = 0.0
+
+    def get_avg_duration(self):
+        return self.total_duration / self.processed if self.processed > 0 else None
+
+
+class CallbackWorker:
+    def __init__(self, name: str, executor: 'MqttCallbackExecutor'):
+        self.name = name
+        self.executor = executor
+        self.tasks = deque()
+        self.condition = threading.Condition(executor.lock)
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(name=self.name, target=self.__run__, daemon=True)
+        self.thread.start()
+
+    def join(self):
+        # Un callback que publica puede acabar parando el executor desde su propio hilo (al reconectar el cliente). Ese
+        # hilo no se espera: termina solo al volver del callback, porque ya no es el hilo del worker
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def __run__(self):
+        while True:
+            with self.condition:
+                while self.executor.running and len(self.tasks) == 0 and self.thread is threading.current_thread():
+                    self.condition.wait()
+                if len(self.tasks) == 0 or self.thread is not threading.current_thread():
+                    return
+                topic_name, callback, payload = self.tasks.popleft()
+                self.executor.stats[topic_name].queue_depth -= 1
+                # Se avisa a los productores bloqueados de que hay hueco
+                self.condition.notify_all()
+
+            start = time.monotonic()
+            try:
+                callback(topic_name, payload)
+            except Exception as e:
+                logging.exception(f"Error in callback for topic = {topic_name}: {str(e)}")
+            duration = time.monotonic() - start
+
+            with self.condition:
+                topic_stats = self.executor.stats[topic_name]
+                topic_stats.processed += 1
+                topic_stats.total_duration += duration
+                topic_stats.max_duration = max(topic_stats.max_duration, duration)
+
+
+class MqttCallbackExecutor:
+    DEFAULT_WORKERS = 2
+    DEFAULT_MAX_QUEUE_SIZE = 32
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+                 overflow_policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST):
+        self.max_queue_size = max_queue_size
+        self.overflow_policy = overflow_policy
+        self.lock = threading.Lock()
+        self.workers: List[CallbackWorker] = [CallbackWorker(f"MqttCallbackWorker-{indx}", self)
+                                              for indx in range(workers)]
+        self.stats: Dict[str, TopicStats] = {}
+        self.running = False
+
+    def start(self):
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+            for worker in self.workers:
+                worker.condition.notify_all()
+        for worker in self.workers:
+            worker.join()
+
+    def submit(self, topic_name: str, callback: Callable[[str, Any], None], payload: Any) -> bool:
+        if not self.running:
+            self.start()
+        # Todos los mensajes de un mismo topic van al mismo worker, así se procesan en orden
+        worker = self.workers[hash(topic_name) % len(self.workers)]
+        with worker.condition:
+            topic_stats = self.stats.setdefault(topic_name, TopicStats())
+            if len(worker.tasks) >= self.max_queue_size:
+                if self.overflow_policy == OverflowPolicy.BLOCK:
+                    worker.condition.wait_for(lambda: len(worker.tasks) < self.max_queue_size or not self.running)
+                elif self.overflow_policy == OverflowPolicy.DROP_OLDEST:
+                    dropped_topic_name, _, _ = worker.tasks.popleft()
+                    self.stats[dropped_topic_name].queue_depth -= 1
+                    self.stats[dropped_topic_name].dropped += 1
+                    logging.warning(f"{worker.name} queue is full. Dropping oldest message for topic = "
+                                    f"{dropped_topic_name}.")
+                else:
+                    topic_stats.dropped += 1
+                    logging.warning(f"{worker.name} queue is full. Dropping message for topic = {topic_name}.")
+                    return False
+            if not self.running:
+                return False
+            worker.tasks.append((topic_name, callback, payload))
+            topic_stats.queue_depth += 1
+            worker.condition.notify_all()
+        return True
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            return {topic_name: {'queue_depth': topic_stats.queue_depth,
+                                 'processed': topic_stats.processed,
+                                 'dropped': topic_stats.dropped,
+                                 'avg_duration': topic_stats.get_avg_duration(),
+                                 'max_duration': topic_stats.max_duration}
+                    for topic_name, topic_stats in self.stats.items()}
@@ -1,18 +1,40 @@
 import logging
+import random
+import socket
 import ssl
 import threading
+import time
 import uuid
+from collections import deque
+from dataclasses import dataclass
 from enum import Enum
-from typing import List, Any, Dict, Callable
+from typing import List, Any, Callable, Dict, Optional, Set
 
 from paho.mqtt import client as mqtt_client
 from paho.mqtt.client import MQTTv311
 
+from metrics.metricsregistry import DEFAULT_REGISTRY
+from network.mqtt.mqttcallbackexecutor import MqttCallbackExecutor
+from network.mqtt.mqttjournal import MqttJournal
 from network.mqtt.mqttresponsecode import MqttResponseCode
+from network.mqtt.mqtttlscontext import MqttTLSContext
 from network.mqtt.mqtttopic import MqttTopic
+from network.mqtt.mqtttopictrie import MqttTopicTrie
 from network.url import BasicAuthURL
 from utils.stringutils import is_empty_string
 
+MQTT_PUBLISH_RESULTS = DEFAULT_REGISTRY.counter('doorbell_mqtt_publish_total', 'MQTT publish attempts by result code',
+                                                ['broker', 'code'])
+MQTT_PUBLISH_SECONDS = DEFAULT_REGISTRY.histogram('doorbell_mqtt_publish_seconds',
+                                                  'Time from publish request to the message being handed to the '
+                                                  'network', ['broker'])
+MQTT_DELIVERY_SECONDS = DEFAULT_REGISTRY.histogram('doorbell_mqtt_delivery_seconds',
+                                                   'Time from publish request to the broker acknowledging the message '
+                                                   '(or to the message being written to the socket with qos 0)',
+                                                   ['broker'])
+MQTT_RECONNECTS = DEFAULT_REGISTRY.counter('doorbell_mqtt_reconnects_total', 'Successful MQTT reconnections',
+                                           ['broker'])
+
 
 class MqttLoopType(Enum):
     BLOCKING = 0
@@ -26,23 +48,113 @@ class MqttLoopType(Enum):
         return self.value == other.value
 
 
+class PublishOutcome(Enum):
+    PUBLISHED = 0  # El broker ha confirmado el mensaje (PUBACK o PUBCOMP). Con qos 0, se ha entregado a la red
+    FAILED = 1  # Publicación síncrona fallida
+    DROPPED = 2  # Descartado por estar llena la cola de envío
+    JOURNALED = 3  # Guardado en el journal para reenviarlo al reconectar
+
+
+@dataclass
+class InflightMessage:
+    # Mensaje entregado a paho a la espera de la confirmación del broker
+    topic: MqttTopic
+    payload: Any
+    enqueued_at: float
+    on_result: Callable[[PublishOutcome], None] = None
+    journal_seq: Optional[int] = None  # seq en el journal de los mensajes reenviados desde el journal
+
+
 class MqttClient:
+    DEFAULT_MAX_QUEUE_SIZE = 64
+    DEFAULT_RECONNECT_MIN_DELAY = 1.0
+    DEFAULT_RECONNECT_MAX_DELAY = 60.0
+    DEFAULT_REPLAY_BATCH_SIZE = 10
+    DEFAULT_REPLAY_RATE = 20.0
+    CONNACK_TIMEOUT = 10.0
+    DEFAULT_NAME = 'default'
+    DEFAULT_KEEPALIVE = 60
+    # Confirmaciones de mensajes que llegan antes de que publish() devuelva su mid. Se limitan para que los mensajes
+    # que nunca se registran no acumulen memoria
+    MAX_EARLY_DELIVERIES = 256
+    # Tiempo máximo que close_context espera las confirmaciones de los mensajes en vuelo
+    CLOSE_ACK_TIMEOUT = 1.0
+
     def __init__(self, client_id: str = None, broker_url: BasicAuthURL = None, subscribed_topics: List[MqttTopic] = [],
                  loop_type: MqttLoopType = MqttLoopType.NOT_BLOCKING,
                  use_web_sockets: bool = False, on_connect_success: Callable = None,
-                 on_connect_error: Callable = None, custom_loop_callback: Callable = None):
+                 on_connect_error: Callable = None, custom_loop_callback: Callable = None,
+                 async_publish: bool = False, max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+                 reconnect_min_delay: float = DEFAULT_RECONNECT_MIN_DELAY,
+                 reconnect_max_delay: float = DEFAULT_RECONNECT_MAX_DELAY, journal: MqttJournal = None,
+                 replay_batch_size: int = DEFAULT_REPLAY_BATCH_SIZE, replay_rate: float = DEFAULT_REPLAY_RATE,
+                 callback_executor: MqttCallbackExecutor = None, name: str = DEFAULT_NAME,
+                 persistent_session: bool = False, keepalive: int = DEFAULT_KEEPALIVE):
 
-        self.client_id = str(uuid.uuid1()) if is_empty_string(client_id) else f"{client_id}_{str(uuid.uuid1())}"
+        # Con sesión persistente el broker conserva las suscripciones y los mensajes con qos > 0 entre conexiones.
+        # La sesión se identifica por el client id, así que tiene que ser el mismo en cada conexión y arranque
+        self.persistent_session = persistent_session
+        if persistent_session:
+            self.client_id = f"{socket.gethostname()}_{name}" if is_empty_string(client_id) else client_id
+        else:
+            self.client_id = str(uuid.uuid1()) if is_empty_string(client_id) else f"{client_id}_{str(uuid.uuid1())}"
+        self.keepalive = keepalive
         self.broker_url = broker_url
+        self.name = name
         self.mqtt_client = None
         self.running = False
         self.loop_type = loop_type
-        self.subscribed_topics = subscribed_topics
-        self.subscribed_topics_by_name: Dict[str, MqttTopic] = {}
+        self.subscribed_topics = list(subscribed_topics)
+        self.topic_trie = MqttTopicTrie()
+        for topic in self.subscribed_topics:
+            self.topic_trie.add(topic)
         self.use_web_sockets = use_web_sockets
         self.on_connect_success = on_connect_success
         self.on_connect_error = on_connect_error
         self.custom_loop_callback = custom_loop_callback
+        # Los callbacks con threaded_callback se ejecutan en un pool de hilos fijo en vez de un hilo por mensaje
+        self.callback_executor = callback_executor if callback_executor is not None else MqttCallbackExecutor()
+
+        self.async_publish = async_publish
+        if self.async_publish and self.loop_type != MqttLoopType.NOT_BLOCKING:
+            # En modo asíncrono el hilo de red necesita el loop de paho en su propio hilo
+            logging.info(f"MQTT client with ID = {self.client_id} uses asynchronous publishing. "
+                         f"Loop type {self.loop_type.name} is replaced by {MqttLoopType.NOT_BLOCKING.name}.")
+            self.loop_type = MqttLoopType.NOT_BLOCKING
+        self.max_queue_size = max_queue_size
+        self.reconnect_min_delay = reconnect_min_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.outbound_queue = deque()
+        self.publish_condition = threading.Condition()
+        self.network_thread = None
+        # Se llama si el hilo de red termina por un error inesperado
+        self.on_failure = None
+        self.connected = False
+        self.has_been_connected = False
+        # Código del último CONNACK; None mientras se espera
+        self.connack_rc = None
+        # Filtros suscritos en la sesión del broker -> qos
+        self.session_filters: Dict[str, int] = {}
+        # Se mantiene entre clientes de paho para reanudar la sesión TLS
+        self.tls_context = None
+        self.journal = journal
+        self.replay_batch_size = replay_batch_size
+        self.replay_rate = replay_rate
+        self.next_replay_time = 0
+        self.publish_stats = {'published': 0, 'failed': 0, 'dropped': 0, 'reconnects': 0, 'journaled': 0,
+                              'replayed': 0, 'last_latency': None, 'max_latency': None, 'total_latency': 0.0,
+                              'delivered': 0, 'last_delivery_latency': None, 'max_delivery_latency': None,
+                              'total_delivery_latency': 0.0, 'sessions_resumed': 0, 'requeued': 0}
+        # mid -> mensaje entregado a paho. Con qos > 0 el resultado se notifica y el journal se confirma cuando llega la
+        # confirmación del broker: que paho acepte el mensaje solo significa que lo tiene en su cola
+        self.inflight: Dict[int, InflightMessage] = {}
+        self.early_deliveries: Dict[int, float] = {}
+        # seq del último mensaje del journal entregado al cliente de paho actual y seqs de los que esperan confirmación
+        self.replay_cursor: Optional[int] = None
+        self.journal_unacked: Set[int] = set()
+        self.delivery_lock = threading.Lock()
+        self.publish_seconds = MQTT_PUBLISH_SECONDS.labels(self.name)
+        self.delivery_seconds = MQTT_DELIVERY_SECONDS.labels(self.name)
 
     def __enter__(self):
         self.init_context()
@@ -52,10 +164,29 @@ class MqttClient:
         self.close_context()
 
     def init_context(self):
-        self.__connect_mqtt__()
+        if self.async_publish:
+            if self.journal is not None:
+                self.journal.open()
+            self.__start_network_thread__()
+        else:
+            self.__connect_mqtt__()
 
     def close_context(self):
+        if self.async_publish:
+            self.__stop_network_thread__()
+        self.__wait_for_acks__()
+        # El siguiente init_context crea otro cliente de paho, que no conoce los mensajes sin confirmar
+        self.__requeue_unacked__()
+        if self.async_publish and self.journal is not None:
+            # Lo que no se ha llegado a enviar se guarda para enviarlo en el siguiente arranque
+            self.__spool_to_journal__()
+            self.journal.close()
         self.stop_loop()
+        if self.async_publish:
+            # El siguiente init_context crea un cliente nuevo, por si ha cambiado el broker. La sesión del broker se
+            # mantiene porque el client id es el mismo
+            self.mqtt_client = None
+        self.callback_executor.stop()
 
     def start_loop(self):
         self.running = True
@@ -71,6 +202,8 @@ class MqttClient:
             self.__custom_loop__()
 
     def stop_loop(self):
+        if self.mqtt_client is None:
+            return
         logging.info(f"MQTT client with ID = {self.client_id} is stopping loop.")
         self.running = False
         if self.loop_type == MqttLoopType.NOT_BLOCKING:
@@ -84,24 +217,447 @@ class MqttClient:
             pass
         logging.info(f"MQTT client with ID = {self.client_id} loop is stopped.")
 
-    def publish(self, topic: MqttTopic, payload: Any):
+    def publish(self, topic: MqttTopic, payload: Any, on_result: Callable[[PublishOutcome], None] = None):
+        # on_result se llama una única vez con el destino final del mensaje: desde el hilo de red en modo asíncrono y,
+        # con qos > 0, desde el loop de paho al llegar la confirmación del broker
+        if self.async_publish:
+            self.__enqueue__(topic, payload, on_result)
+            return
+        start = time.monotonic()
+        self.__service_network__()
+        status = self.__send__(topic, payload, start, on_result)
+        kept = self.__kept_in_session__(topic, status)
+        if status == MqttResponseCode.NO_ERROR:
+            self.publish_seconds.observe(time.monotonic() - start)
+            if topic.qos == 0:
+                self.__notify_result__(on_result, PublishOutcome.PUBLISHED)
+        elif not kept:
+            self.__notify_result__(on_result, PublishOutcome.FAILED)
+        if status != MqttResponseCode.NO_ERROR:
+            if kept:
+                logging.warning(f"MQTT client with ID = {self.client_id} is not connected. Message to topic = {topic} "
+                                f"is kept in the persistent session. Trying to reconnect...")
+            else:
+                logging.error(f"Failed to send message to topic = {topic}. Status code = {str(status)}. "
+                              f"Trying to reconnect...")
+            self.__recover_connection__()
+
+    def subscribe(self, topic: MqttTopic):
+        self.subscribed_topics.append(topic)
+        previous_qos = self.topic_trie.get_qos(topic.name)
+        self.topic_trie.add(topic)
+        # Solo hace falta ir al broker si el filtro es nuevo o si se pide más qos de la que ya había
+        if (previous_qos is None or topic.qos > previous_qos) and self.is_connected():
+            self.mqtt_client.subscribe(topic.name, topic.qos)
+            self.session_filters[topic.name] = topic.qos
+
+    def unsubscribe(self, topic: MqttTopic):
+        if topic in self.subscribed_topics:
+            self.subscribed_topics.remove(topic)
+        if self.topic_trie.remove(topic) and self.is_connected():
+            self.mqtt_client.unsubscribe(topic.name)
+            self.session_filters.pop(topic.name, None)
+
+    def get_callback_stats(self):
+        return self.callback_executor.get_stats()
+
+    def is_connected(self):
+        with self.publish_condition:
+            return self.connected
+
+    def is_healthy(self):
+        # Estar desconectado no es un fallo: el hilo de red se encarga de reconectar mientras siga vivo
+        if self.async_publish:
+            return self.network_thread is not None and self.network_thread.is_alive()
+        return self.mqtt_client is not None
+
+    def get_publish_stats(self):
+        with self.publish_condition:
+            stats = dict(self.publish_stats)
+            stats['queue_depth'] = len(self.outbound_queue)
+            stats['max_queue_size'] = self.max_queue_size
+            stats['connected'] = self.connected
+        if self.journal is not None:
+            stats['journal'] = self.journal.get_stats()
+        if self.tls_context is not None:
+            stats['tls'] = self.tls_context.get_stats()
+        stats['avg_latency'] = stats['total_latency'] / stats['published'] if stats['published'] > 0 else None
+        stats['avg_delivery_latency'] = stats['total_delivery_latency'] / stats['delivered'] \
+            if stats['delivered'] > 0 else None
+        return stats
+
+    def __enqueue__(self, topic: MqttTopic, payload: Any, on_result: Callable[[PublishOutcome], None] = None):
+        dropped_on_result = None
+        with self.publish_condition:
+            if len(self.outbound_queue) >= self.max_queue_size:
+                # Se descarta el mensaje más antiguo para que los eventos más recientes lleguen al broker
+                dropped_topic, _, _, dropped_on_result = self.outbound_queue.popleft()
+                self.publish_stats['dropped'] += 1
+                logging.warning(f"MQTT client with ID = {self.client_id} outbound queue is full. "
+                                f"Dropping oldest message for topic = {dropped_topic}.")
+            self.outbound_queue.append((topic, payload, time.monotonic(), on_result))
+            self.publish_condition.notify_all()
+        self.__notify_result__(dropped_on_result, PublishOutcome.DROPPED)
+
+    @staticmethod
+    def __notify_result__(on_result: Callable[[PublishOutcome], None], outcome: PublishOutcome):
+        if on_result is None:
+            return
+        try:
+            on_result(outcome)
+        except Exception as e:
+            logging.exception(f"Error notifying publish result {outcome.name}: {str(e)}")
+
+    def __start_network_thread__(self):
+        with self.publish_condition:
+            if self.network_thread is not None:
+                return
+            self.running = True
+        self.network_thread = threading.Thread(name=f"MqttNetworkThread-{self.name}",
+                                               target=self.__network_loop_guarded__, daemon=True)
+        self.network_thread.start()
+
+    def __stop_network_thread__(self):
+        with self.publish_condition:
+            self.running = False
+            self.publish_condition.notify_all()
+        if self.network_thread is not None:
+            self.network_thread.join()
+            self.network_thread = None
+
+    def __network_loop_guarded__(self):
+        try:
+            self.__network_loop__()
+        except Exception as e:
+            logging.exception(f"MQTT client with ID = {self.client_id} network thread stopped unexpectedly: {str(e)}")
+            if self.on_failure is not None:
+                self.on_failure()
+
+    def __network_loop__(self):
+        while self.running:
+            if not self.is_connected():
+                self.__spool_to_journal__()
+                if not self.__reconnect__():
+                    continue
+            with self.publish_condition:
+                # Los eventos en vivo tienen prioridad; el histórico del journal se reenvía por lotes con la
+                # velocidad limitada por replay_rate
+                while self.running and self.connected and len(self.outbound_queue) == 0 and not self.__replay_due__():
+                    self.publish_condition.wait(timeout=self.__replay_wait_time__())
+                if not self.running or not self.connected:
+                    continue
+                queued_message = self.outbound_queue.popleft() if len(self.outbound_queue) > 0 else None
+            if queued_message is not None:
+                self.__publish_queued__(*queued_message)
+            else:
+                self.__replay_batch__()
+
+    def __replay_due__(self):
+        return self.__journal_pending__() > 0 and time.monotonic() >= self.next_replay_time
+
+    def __replay_wait_time__(self):
+        if self.__journal_pending__() == 0:
+            return None
+        return max(self.next_replay_time - time.monotonic(), 0)
+
+    def __journal_pending__(self) -> int:
+        # Mensajes del journal que todavía no se han entregado al cliente de paho actual
+        if self.journal is None:
+            return 0
+        with self.delivery_lock:
+            replay_cursor = self.replay_cursor
+        return self.journal.count_after(replay_cursor)
+
+    def __replay_batch__(self):
+        # Los mensajes se quedan en el journal hasta que el broker los confirma; replay_cursor evita leerlos otra vez
+        with self.delivery_lock:
+            replay_cursor = self.replay_cursor
+        batch = self.journal.read_batch(self.replay_batch_size, after_seq=replay_cursor)
+        replayed = 0
+        for seq, topic, payload in batch:
+            try:
+                status = self.__send__(topic, payload, time.monotonic(), journal_seq=seq)
+            except Exception as e:
+                logging.exception(f"Failed to replay message to topic = {topic}: {str(e)}")
+                status = MqttResponseCode.CONN_LOST
+                MQTT_PUBLISH_RESULTS.labels(self.name, status.name).inc()
+            if status != MqttResponseCode.NO_ERROR:
+                kept = self.__kept_in_session__(topic, status)
+                if kept:
+                    replayed += 1
+                else:
+                    logging.error(f"Failed to replay message to topic = {topic}. Status code = {str(status)}.")
+                with self.publish_condition:
+                    self.publish_stats['failed'] += not kept
+                    self.connected = False
+                break
+            replayed += 1
+        # Los mensajes con qos 0 no tienen confirmación: se dan por entregados al pasarlos a paho
+        self.__ack_journal__()
+        with self.publish_condition:
+            self.publish_stats['replayed'] += replayed
+            self.next_replay_time = time.monotonic() + max(replayed, 1) / self.replay_rate
+        logging.debug(f"MQTT client with ID = {self.client_id} replayed {replayed} journaled messages. "
+                      f"{len(self.journal)} messages left.")
+
+    def __spool_to_journal__(self):
+        if self.journal is None:
+            return
+        with self.publish_condition:
+            queued_messages = list(self.outbound_queue)
+            self.outbound_queue.clear()
+            self.publish_stats['journaled'] += len(queued_messages)
+        for topic, payload, _, on_result in queued_messages:
+            self.journal.append(topic, payload)
+            self.__notify_result__(on_result, PublishOutcome.JOURNALED)
+
+    def __wait_reconnect_delay__(self, wait_time: float):
+        deadline = time.monotonic() + wait_time
+        while self.running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            # Los mensajes que llegan durante la espera se pasan al journal en cuanto llegan
+            with self.publish_condition:
+                self.publish_condition.wait_for(lambda: not self.running or (self.journal is not None and
+                                                                             len(self.outbound_queue) > 0),
+                                                timeout=remaining)
+            self.__spool_to_journal__()
+
+    def __publish_queued__(self, topic: MqttTopic, payload: Any, enqueued_at: float,
+                           on_result: Callable[[PublishOutcome], None]):
+        try:
+            status = self.__send__(topic, payload, enqueued_at, on_result)
+        except Exception as e:
+            logging.exception(f"Failed to send message to topic = {topic}: {str(e)}")
+            status = MqttResponseCode.CONN_LOST
+            MQTT_PUBLISH_RESULTS.labels(self.name, status.name).inc()
+
+        with self.publish_condition:
+            if status == MqttResponseCode.NO_ERROR:
+                latency = time.monotonic() - enqueued_at
+                self.publish_seconds.observe(latency)
+                self.publish_stats['published'] += 1
+                self.publish_stats['last_latency'] = latency
+                self.publish_stats['total_latency'] += latency
+                if self.publish_stats['max_latency'] is None or latency > self.publish_stats['max_latency']:
+                    self.publish_stats['max_latency'] = latency
+            elif self.__kept_in_session__(topic, status):
+                logging.warning(f"MQTT client with ID = {self.client_id} is not connected. Message to topic = {topic} "
+                                f"is kept in the persistent session.")
+                self.connected = False
+            else:
+                logging.error(f"Failed to send message to topic = {topic}. Status code = {str(status)}. "
+                              f"Message is requeued.")
+                self.publish_stats['failed'] += 1
+                self.outbound_queue.appendleft((topic, payload, enqueued_at, on_result))
+                self.connected = False
+                return
+        if topic.qos == 0:
+            # Con qos > 0 el resultado se notifica al llegar la confirmación del broker
+            self.__notify_result__(on_result, PublishOutcome.PUBLISHED)
+
+    def __send__(self, topic: MqttTopic, payload: Any, enqueued_at: float,
+                 on_result: Callable[[PublishOutcome], None] = None, journal_seq: int = None) -> MqttResponseCode:
         result = self.mqtt_client.publish(topic=topic.name, qos=topic.qos, payload=payload)
         status = MqttResponseCode(result[0])
-        if status != MqttResponseCode.NO_ERROR:
-            logging.error(f"Failed to send message to topic = {topic}. Status code = {str(status)}. Trying to reconnect...")
+        MQTT_PUBLISH_RESULTS.labels(self.name, status.name).inc()
+        if status == MqttResponseCode.NO_ERROR or self.__kept_in_session__(topic, status):
+            message = InflightMessage(topic=topic, payload=payload, enqueued_at=enqueued_at, on_result=on_result,
+                                      journal_seq=journal_seq)
+            # No se puede tener un lock propio mientras se llama a publish: paho llama a on_publish con sus locks
+            # cogidos. Si la confirmación ha llegado antes de registrar el mid se completa ahora
+            with self.delivery_lock:
+                if journal_seq is not None:
+                    self.replay_cursor = journal_seq
+                delivered_at = self.early_deliveries.pop(result[1], None)
+                if delivered_at is None:
+                    self.inflight[result[1]] = message
+                    if journal_seq is not None and topic.qos > 0:
+                        self.journal_unacked.add(journal_seq)
+            if delivered_at is not None:
+                self.__complete_delivery__(message, delivered_at)
+        return status
+
+    def __complete_delivery__(self, message: InflightMessage, delivered_at: float):
+        self.__account_delivery__(delivered_at - message.enqueued_at)
+        if message.topic.qos == 0:
+            # Sin confirmación del broker: el resultado ya se ha notificado al pasar el mensaje a paho
+            return
+        if message.journal_seq is None:
+            self.__notify_result__(message.on_result, PublishOutcome.PUBLISHED)
+            return
+        with self.delivery_lock:
+            self.journal_unacked.discard(message.journal_seq)
+        self.__ack_journal__()
+
+    def __ack_journal__(self):
+        # El journal solo se confirma hasta el primer mensaje sin confirmación del broker. Los posteriores que ya estén
+        # confirmados se reenviarían si se pierde la conexión antes
+        with self.delivery_lock:
+            if self.replay_cursor is None:
+                return
+            ack_seq = min(self.journal_unacked) - 1 if len(self.journal_unacked) > 0 else self.replay_cursor
+        self.journal.ack(ack_seq)
+
+    def __requeue_unacked__(self):
+        # paho descarta los mensajes sin confirmar al crear otro cliente. Los del journal siguen en él y se reenvían
+        # desde el primero sin confirmar; el resto vuelve al principio de la cola de envío, o falla si no hay cola
+        with self.delivery_lock:
+            unacked = [message for message in self.inflight.values()
+                       if message.topic.qos > 0 and message.journal_seq is None]
+            self.inflight.clear()
+            self.early_deliveries.clear()
+            self.journal_unacked.clear()
+            self.replay_cursor = None
+        if len(unacked) == 0:
+            return
+        if self.async_publish:
+            with self.publish_condition:
+                self.outbound_queue.extendleft((message.topic, message.payload, message.enqueued_at, message.on_result)
+                                               for message in reversed(unacked))
+                self.publish_stats['requeued'] += len(unacked)
+                self.publish_condition.notify_all()
+            logging.warning(f"MQTT client with ID = {self.client_id} requeued {len(unacked)} messages not "
+                            f"acknowledged by the broker.")
+            return
+        with self.publish_condition:
+            self.publish_stats['failed'] += len(unacked)
+        logging.error(f"MQTT client with ID = {self.client_id} lost {len(unacked)} messages not acknowledged by the "
+                      f"broker.")
+        for message in unacked:
+            self.__notify_result__(message.on_result, PublishOutcome.FAILED)
+
+    def __wait_for_acks__(self):
+        # Se esperan un momento las confirmaciones pendientes para no volver a enviar mensajes que ya han llegado
+        deadline = time.monotonic() + self.CLOSE_ACK_TIMEOUT
+        while self.is_connected() and time.monotonic() < deadline:
+            with self.delivery_lock:
+                if not any(message.topic.qos > 0 for message in self.inflight.values()):
+                    return
+            self.__service_network__()
+            time.sleep(0.01)
+
+    def __kept_in_session__(self, topic: MqttTopic, status: MqttResponseCode) -> bool:
+        # Con sesión persistente paho guarda los mensajes con qos > 0 que no ha podido enviar por falta de conexión y
+        # los envía al reconectar con el mismo cliente, así que no hay que volver a encolarlos
+        return self.persistent_session and topic.qos > 0 and status.value == mqtt_client.MQTT_ERR_NO_CONN
+
+    def __service_network__(self):
+        # Sin loop nadie lee lo que envía el broker: los PUBACK no liberan los mensajes en vuelo, con lo que paho deja
+        # de enviar al llegar a max_inflight_messages, y no se mandan los PINGREQ del keepalive. Se atiende la red
+        # sin esperar antes de cada publicación
+        if self.loop_type == MqttLoopType.NO_LOOP and self.mqtt_client is not None:
+            self.mqtt_client.loop(timeout=0)
+
+    def __recover_connection__(self):
+        if not self.persistent_session or self.mqtt_client is None:
             self.close_context()
             self.init_context()
+            return
+        if self.running and self.loop_type in (MqttLoopType.BLOCKING, MqttLoopType.NOT_BLOCKING):
+            # El loop de paho ya reconecta por su cuenta con el mismo cliente
+            return
+        try:
+            self.__resume_mqtt_client__()
+        except Exception as e:
+            logging.error(f"MQTT client with ID = {self.client_id} couldn't reconnect to broker: {str(e)}")
+
+    def __account_delivery__(self, latency: float):
+        self.delivery_seconds.observe(latency)
+        with self.publish_condition:
+            self.publish_stats['delivered'] += 1
+            self.publish_stats['last_delivery_latency'] = latency
+            self.publish_stats['total_delivery_latency'] += latency
+            if self.publish_stats['max_delivery_latency'] is None or \
+                    latency > self.publish_stats['max_delivery_latency']:
+                self.publish_stats['max_delivery_latency'] = latency
+
+    def __reconnect__(self):
+        delay = self.reconnect_min_delay
+        while self.running:
+            try:
+                if self.persistent_session and self.mqtt_client is not None:
+                    self.__resume_mqtt_client__()
+                else:
+                    self.__release_mqtt_client__()
+                    self.__connect_mqtt__()
+                self.mqtt_client.loop_start()
+                with self.publish_condition:
+                    # Un CONNACK con error o un cierre de la conexión terminan la espera sin agotar el timeout
+                    self.publish_condition.wait_for(lambda: self.connack_rc is not None or not self.running,
+                                                    timeout=self.CONNACK_TIMEOUT)
+                    if self.connected:
+                        if self.has_been_connected:
+                            self.publish_stats['reconnects'] += 1
+                            MQTT_RECONNECTS.labels(self.name).inc()
+                        self.has_been_connected = True
+                        return True
+                    connack_rc = self.connack_rc
+                if connack_rc is None:
+                    logging.error(f"MQTT client with ID = {self.client_id} didn't get a CONNACK in "
+                                  f"{self.CONNACK_TIMEOUT}s.")
+                else:
+                    logging.error(f"MQTT client with ID = {self.client_id} didn't get a successful CONNACK: "
+                                  f"{str(connack_rc)}")
+            except Exception as e:
+                logging.error(f"MQTT client with ID = {self.client_id} couldn't connect to broker: {str(e)}")
+
+            # Backoff exponencial con jitter para que varios clientes no reconecten a la vez
+            wait_time = delay / 2 + random.uniform(0, delay / 2)
+            logging.info(f"MQTT client with ID = {self.client_id} retrying connection in {wait_time:.2f}s.")
+            self.__wait_reconnect_delay__(wait_time)
+            delay = min(delay * 2, self.reconnect_max_delay)
+        return False
+
+    def __release_mqtt_client__(self):
+        if self.mqtt_client is None:
+            return
+        self.mqtt_client.loop_stop()
+        try:
+            self.mqtt_client.disconnect()
+        except Exception:
+            pass
+        # Los mid se reinician con cada cliente de paho y los mensajes sin confirmar se pierden con el cliente
+        self.__requeue_unacked__()
+
+    def __resume_mqtt_client__(self):
+        # Se reutiliza el cliente de paho, que mantiene el client id, los mensajes con qos > 0 sin confirmar y el
+        # contexto TLS. disconnect() hace que termine el hilo del loop de paho aunque tenga mensajes pendientes
+        logging.info(f"Resuming MQTT session of client with ID = {self.client_id}")
+        try:
+            self.mqtt_client.disconnect()
+        except Exception:
+            pass
+        self.mqtt_client.loop_stop()
+        with self.publish_condition:
+            self.connack_rc = None
+        self.mqtt_client.reconnect()
+
+    def __get_tls_context__(self) -> MqttTLSContext:
+        if self.tls_context is None or self.tls_context.ca_cert_path != self.broker_url.tls_cert_path:
+            self.tls_context = MqttTLSContext.create(self.broker_url.tls_cert_path, self.name)
+        return self.tls_context
 
     def __connect_mqtt__(self):
         logging.info(f"Connecting MQTT client with ID = {self.client_id}")
         # Set Connecting Client ID
+        # En modo asíncrono las reconexiones las gestiona el hilo de red, no el loop de paho
+        reconnect_on_failure = not self.async_publish
+        clean_session = not self.persistent_session
         if self.use_web_sockets:
-            self.mqtt_client = mqtt_client.Client(client_id=self.client_id, protocol=MQTTv311, transport='websockets')
+            self.mqtt_client = mqtt_client.Client(client_id=self.client_id, clean_session=clean_session,
+                                                  protocol=MQTTv311, transport='websockets',
+                                                  reconnect_on_failure=reconnect_on_failure)
         else:
-            self.mqtt_client = mqtt_client.Client(client_id=self.client_id, protocol=MQTTv311)
+            self.mqtt_client = mqtt_client.Client(client_id=self.client_id, clean_session=clean_session,
+                                                  protocol=MQTTv311, reconnect_on_failure=reconnect_on_failure)
+        if self.persistent_session:
+            # Los mensajes que paho guarda mientras no hay conexión no pueden crecer sin límite
+            self.mqtt_client.max_queued_messages_set(self.max_queue_size)
 
         if self.broker_url.tls_cert_path is not None:
-            self.mqtt_client.tls_set(self.broker_url.tls_cert_path)
+            self.mqtt_client.tls_set_context(self.__get_tls_context__())
 
         if isinstance(self.broker_url, BasicAuthURL) and self.broker_url.user is not None and \
                 self.broker_url.passwd is not None:
@@ -109,17 +665,24 @@ class MqttClient:
 
         self.mqtt_client.on_connect = self.__on_connect__
         self.mqtt_client.on_disconnect = self.__on_disconnect__
-        self.mqtt_client.connect(self.broker_url.hostname, self.broker_url.port)
+        self.mqtt_client.on_message = self.__on_message__
+        self.mqtt_client.on_publish = self.__on_publish__
+        with self.publish_condition:
+            self.connack_rc = None
+        self.mqtt_client.connect(self.broker_url.hostname, self.broker_url.port, keepalive=self.keepalive)
 
     def __on_connect__(self, client, userdata, flags, rc):
         rc = MqttResponseCode(rc)
+        session_present = self.persistent_session and bool(flags.get('session present'))
+        with self.publish_condition:
+            self.connected = rc == MqttResponseCode.NO_ERROR
+            self.connack_rc = rc
+            self.publish_stats['sessions_resumed'] += self.connected and session_present
+            self.publish_condition.notify_all()
         if rc == MqttResponseCode.NO_ERROR:
-            logging.info(f"MQTT client with id = {self.client_id} is connected to Broker!")
-            topics = []
-            for topic in self.subscribed_topics:
-                topics.append((topic.name, topic.qos))
-                self.subscribed_topics_by_name[topic.name] = topic
-            self.__subscribe__(topics)
+            logging.info(f"MQTT client with id = {self.client_id} is connected to Broker!"
+                         f"{' Session resumed.' if session_present else ''}")
+            self.__sync_subscriptions__(session_present)
             if self.on_connect_success is not None:
                 self.on_connect_success()
         else:
@@ -127,26 +690,53 @@ class MqttClient:
             if self.on_connect_error is not None:
                 self.on_connect_error()
 
+    def __sync_subscriptions__(self, session_present: bool):
+        topics = self.topic_trie.get_filters()
+        if session_present:
+            # El broker conserva las suscripciones de la sesión; solo se envían los cambios hechos sin conexión
+            current_filters = dict(topics)
+            removed = [topic_filter for topic_filter in self.session_filters if topic_filter not in current_filters]
+            if len(removed) > 0:
+                self.mqtt_client.unsubscribe(removed)
+            topics = [(topic_filter, qos) for topic_filter, qos in topics
+                      if self.session_filters.get(topic_filter) != qos]
+        if len(topics) > 0:
+            self.mqtt_client.subscribe(topics)
+        self.session_filters = dict(self.topic_trie.get_filters())
+
     def __on_disconnect__(self, client, userdata, rc):
         rc = MqttResponseCode(rc)
+        with self.publish_condition:
+            self.connected = False
+            if self.connack_rc is None:
+                # La conexión se ha cerrado antes de recibir el CONNACK
+                self.connack_rc = MqttResponseCode.CONN_LOST
+            self.publish_condition.notify_all()
         if rc != MqttResponseCode.NO_ERROR:
             logging.error(f"MQTT client with id = {self.client_id}. Unexpected disconnection! Response code = {str(rc)}.")
         else:
             logging.info(f"MQTT client with id = {self.client_id} disconnected successfully.")
 
-    def __subscribe__(self, topics: List[MqttTopic]):
-        def on_message(client, userdata, msg):
-            logging.debug("topic = {}, payload = {}".format(msg.topic, msg.payload))
-            if self.subscribed_topics_by_name[msg.topic].threaded_callback:
-                t = threading.Thread(target=self.subscribed_topics_by_name[msg.topic].callback,
-                                     args=(msg.topic, msg.payload))
-                t.start()
-            else:
-                self.subscribed_topics_by_name[msg.topic].callback(msg.topic, msg.payload)
+    def __on_publish__(self, client, userdata, mid):
+        delivered_at = time.monotonic()
+        with self.delivery_lock:
+            message = self.inflight.pop(mid, None)
+            if message is None:
+                if len(self.early_deliveries) >= self.MAX_EARLY_DELIVERIES:
+                    self.early_deliveries.clear()
+                self.early_deliveries[mid] = delivered_at
+                return
+        self.__complete_delivery__(message, delivered_at)
 
-        if len(topics) > 0:
-            self.mqtt_client.subscribe(topics)
-            self.mqtt_client.on_message = on_message
+    def __on_message__(self, client, userdata, msg):
+        logging.debug("topic = %s, payload = %s", msg.topic, msg.payload)
+        for topic in self.topic_trie.match(msg.topic):
+            if topic.callback is None:
+                continue
+            if topic.threaded_callback:
+                self.callback_executor.submit(msg.topic, topic.callback, msg.payload)
+            else:
+                topic.callback(msg.topic, msg.payload)
 
     def __custom_loop__(self):
         while self.running:
@@ -1,53 +1,186 @@
 import logging
+import socket
+from typing import List
 
+from network.mqtt.mqttbrokerconf import MqttBrokerConf
+from network.mqtt.mqttcallbackexecutor import MqttCallbackExecutor, OverflowPolicy
 from network.mqtt.mqttexceptions import NoMqttHostSection, NoMqttConfSection
 from network.mqtt.mqtttopic import MqttTopic
 from network.url import BasicAuthURL
 
 
 class MqttConf:
+    DEFAULT_ASYNC_PUBLISH = True
+    DEFAULT_QUEUE_SIZE = 64
+    DEFAULT_RECONNECT_MIN_DELAY = 1.0
+    DEFAULT_RECONNECT_MAX_DELAY = 60.0
+    DEFAULT_JOURNAL_SIZE_KB = 256
+    DEFAULT_JOURNAL_SYNC_INTERVAL = 5.0
+    DEFAULT_REPLAY_BATCH_SIZE = 10
+    DEFAULT_REPLAY_RATE = 20.0
+    DEFAULT_CALLBACK_OVERFLOW_POLICY = OverflowPolicy.DROP_OLDEST
+    DEFAULT_QOS = 0
+    DEFAULT_PAYLOAD_FORMAT = 'json'
+    DEFAULT_BATCH_WINDOW_MS = 0
+    DEFAULT_MAX_BATCH_SIZE = 16
+    DEFAULT_KEEPALIVE = 60
+    DEFAULT_PERSISTENT_SESSION = False
+
     def __init__(self, url: BasicAuthURL = BasicAuthURL(protocol="mqtt", hostname="127.0.0.1", port=1883),
-                 topic: MqttTopic = None):
-        self.url = url
+                 topic: MqttTopic = None, async_publish: bool = DEFAULT_ASYNC_PUBLISH,
+                 queue_size: int = DEFAULT_QUEUE_SIZE, reconnect_min_delay: float = DEFAULT_RECONNECT_MIN_DELAY,
+                 reconnect_max_delay: float = DEFAULT_RECONNECT_MAX_DELAY, journal_path: str = None,
+                 journal_size: int = DEFAULT_JOURNAL_SIZE_KB * 1024,
+                 journal_sync_interval: float = DEFAULT_JOURNAL_SYNC_INTERVAL,
+                 replay_batch_size: int = DEFAULT_REPLAY_BATCH_SIZE, replay_rate: float = DEFAULT_REPLAY_RATE,
+                 callback_workers: int = MqttCallbackExecutor.DEFAULT_WORKERS,
+                 callback_queue_size: int = MqttCallbackExecutor.DEFAULT_MAX_QUEUE_SIZE,
+                 callback_overflow_policy: OverflowPolicy = DEFAULT_CALLBACK_OVERFLOW_POLICY,
+                 device_id: str = None, payload_format: str = DEFAULT_PAYLOAD_FORMAT,
+                 batch_window_ms: float = DEFAULT_BATCH_WINDOW_MS, max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+                 brokers: List[MqttBrokerConf] = None, client_id: str = None,
+                 persistent_session: bool = DEFAULT_PERSISTENT_SESSION, keepalive: int = DEFAULT_KEEPALIVE):
+        # Si no se indica la lista de brokers se usa un único broker con url
+        self.brokers = brokers if brokers else [MqttBrokerConf(url=url)]
         self.topic = topic
+        self.async_publish = async_publish
+        self.queue_size = queue_size
+        self.reconnect_min_delay = reconnect_min_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.journal_path = journal_path
+        self.journal_size = journal_size
+        self.journal_sync_interval = journal_sync_interval
+        self.replay_batch_size = replay_batch_size
+        self.replay_rate = replay_rate
+        self.callback_workers = callback_workers
+        self.callback_queue_size = callback_queue_size
+        self.callback_overflow_policy = callback_overflow_policy
+        self.device_id = device_id if device_id is not None else socket.gethostname()
+        self.payload_format = payload_format
+        self.batch_window_ms = batch_window_ms
+        self.max_batch_size = max_batch_size
+        # Con sesión persistente cada broker usa el client id <client_id>_<nombre del broker> en todas las conexiones
+        self.client_id = client_id if client_id is not None else f"doorbell_{self.device_id}"
+        self.persistent_session = persistent_session
+        self.keepalive = keepalive
 
+    @property
+    def url(self) -> BasicAuthURL:
+        return self.brokers[0].url
 
     @staticmethod
     def create_from_dict(cfg):
-        if 'mqtt' in cfg and 'broker' in cfg['mqtt']:
-            user = None
-            passwd = None
-            host = None
-            port = 1883
-            pub_topic_name = "ring_doorbell"
-            mqtt_cfg = cfg['mqtt']['broker']
-
-            if 'host' in mqtt_cfg:
-                host = mqtt_cfg['host']
-            else:
-                raise NoMqttHostSection()
-
-            if 'port' in mqtt_cfg:
-                port = mqtt_cfg['port']
-            else:
-                logging.warning(
-                    "No mqtt_broker port section into configuration file. Mqtt client is going to start using 1883 port.")
-
-            if 'user' in mqtt_cfg:
-                user = mqtt_cfg['user']
-            else:
-                logging.warning("No mqtt_broker user section into configuration file.")
-
-            if 'passwd' in mqtt_cfg:
-                passwd = mqtt_cfg['passwd']
-            else:
-                logging.warning("No mqtt_broker passwd section into configuration file.")
-
+        if 'mqtt' in cfg and ('broker' in cfg['mqtt'] or 'brokers' in cfg['mqtt']):
+            pub_topic_cfg = "ring_doorbell"
+            qos = MqttConf.DEFAULT_QOS
+            device_id = None
+            payload_format = MqttConf.DEFAULT_PAYLOAD_FORMAT
+            batch_window_ms = MqttConf.DEFAULT_BATCH_WINDOW_MS
+            max_batch_size = MqttConf.DEFAULT_MAX_BATCH_SIZE
+            async_publish = MqttConf.DEFAULT_ASYNC_PUBLISH
+            queue_size = MqttConf.DEFAULT_QUEUE_SIZE
+            reconnect_min_delay = MqttConf.DEFAULT_RECONNECT_MIN_DELAY
+            reconnect_max_delay = MqttConf.DEFAULT_RECONNECT_MAX_DELAY
+            journal_path = None
+            journal_size = MqttConf.DEFAULT_JOURNAL_SIZE_KB * 1024
+            journal_sync_interval = MqttConf.DEFAULT_JOURNAL_SYNC_INTERVAL
+            replay_batch_size = MqttConf.DEFAULT_REPLAY_BATCH_SIZE
+            replay_rate = MqttConf.DEFAULT_REPLAY_RATE
+            callback_workers = MqttCallbackExecutor.DEFAULT_WORKERS
+            callback_queue_size = MqttCallbackExecutor.DEFAULT_MAX_QUEUE_SIZE
+            callback_overflow_policy = MqttConf.DEFAULT_CALLBACK_OVERFLOW_POLICY
+            client_id = None
+            persistent_session = MqttConf.DEFAULT_PERSISTENT_SESSION
+            keepalive = MqttConf.DEFAULT_KEEPALIVE
             if 'pub_topic' in cfg['mqtt']:
-                pub_topic_name = cfg['mqtt']['pub_topic']
+                pub_topic_cfg = cfg['mqtt']['pub_topic']
+            if 'qos' in cfg['mqtt']:
+                qos = int(cfg['mqtt']['qos'])
+            brokers = MqttConf.__create_brokers__(cfg['mqtt'], qos)
+            if 'device_id' in cfg['mqtt']:
+                device_id = str(cfg['mqtt']['device_id'])
+
+            if 'payload' in cfg['mqtt']:
+                payload_cfg = cfg['mqtt']['payload']
+                if 'format' in payload_cfg:
+                    payload_format = str(payload_cfg['format']).lower()
+                if 'batch_window_ms' in payload_cfg:
+                    batch_window_ms = float(payload_cfg['batch_window_ms'])
+                if 'max_batch_size' in payload_cfg:
+                    max_batch_size = int(payload_cfg['max_batch_size'])
+
+            if 'async_publish' in cfg['mqtt']:
+                async_publish = bool(cfg['mqtt']['async_publish'])
+            if 'queue_size' in cfg['mqtt']:
+                queue_size = int(cfg['mqtt']['queue_size'])
+            if 'reconnect_min_delay' in cfg['mqtt']:
+                reconnect_min_delay = float(cfg['mqtt']['reconnect_min_delay'])
+            if 'reconnect_max_delay' in cfg['mqtt']:
+                reconnect_max_delay = float(cfg['mqtt']['reconnect_max_delay'])
+            if 'client_id' in cfg['mqtt'] and cfg['mqtt']['client_id']:
+                client_id = str(cfg['mqtt']['client_id'])
+            if 'persistent_session' in cfg['mqtt']:
+                persistent_session = bool(cfg['mqtt']['persistent_session'])
+            if 'keepalive' in cfg['mqtt']:
+                keepalive = max(1, int(cfg['mqtt']['keepalive']))
+
+            if 'journal' in cfg['mqtt']:
+                journal_cfg = cfg['mqtt']['journal']
+                if 'path' in journal_cfg:
+                    journal_path = journal_cfg['path']
+                else:
+                    logging.warning("No mqtt journal path section into configuration file. Journal is disabled.")
+                if 'size_kb' in journal_cfg:
+                    journal_size = int(journal_cfg['size_kb'] * 1024)
+                if 'sync_interval' in journal_cfg:
+                    journal_sync_interval = float(journal_cfg['sync_interval'])
+                if 'replay_batch_size' in journal_cfg:
+                    replay_batch_size = int(journal_cfg['replay_batch_size'])
+                if 'replay_rate' in journal_cfg:
+                    replay_rate = float(journal_cfg['replay_rate'])
+
+            if 'callbacks' in cfg['mqtt']:
+                callbacks_cfg = cfg['mqtt']['callbacks']
+                if 'workers' in callbacks_cfg:
+                    callback_workers = int(callbacks_cfg['workers'])
+                if 'queue_size' in callbacks_cfg:
+                    callback_queue_size = int(callbacks_cfg['queue_size'])
+                if 'overflow_policy' in callbacks_cfg:
+                    try:
+                        callback_overflow_policy = OverflowPolicy.create_from_str(callbacks_cfg['overflow_policy'])
+                    except KeyError:
+                        logging.warning(f"Unknown mqtt callbacks overflow_policy {callbacks_cfg['overflow_policy']}. "
+                                        f"Using {MqttConf.DEFAULT_CALLBACK_OVERFLOW_POLICY.name.lower()}.")
         else:
             raise NoMqttConfSection()
 
-        url = BasicAuthURL(protocol="mqtt", hostname=host, port=port, user=user, passwd=passwd)
-        topic = MqttTopic(name=pub_topic_name)
-        return MqttConf(url=url, topic=topic)
\ No newline at end of file
+        topic = MqttTopic.create_from_cfg(pub_topic_cfg, qos)
+        return MqttConf(brokers=brokers, topic=topic, async_publish=async_publish, queue_size=queue_size,
+                        reconnect_min_delay=reconnect_min_delay, reconnect_max_delay=reconnect_max_delay,
+                        journal_path=journal_path, journal_size=journal_size,
+                        journal_sync_interval=journal_sync_interval, replay_batch_size=replay_batch_size,
+                        replay_rate=replay_rate, callback_workers=callback_workers,
+                        callback_queue_size=callback_queue_size, callback_overflow_policy=callback_overflow_policy,
+                        device_id=device_id, payload_format=payload_format, batch_window_ms=batch_window_ms,
+                        max_batch_size=max_batch_size, client_id=client_id, persistent_session=persistent_session,
+                        keepalive=keepalive)
+
+    @staticmethod
+    def __create_brokers__(mqtt_cfg, default_qos: int) -> List[MqttBrokerConf]:
+        if 'brokers' not in mqtt_cfg:
+            return [MqttBrokerConf.create_from_dict(mqtt_cfg['broker'], default_qos=default_qos)]
+
+        brokers = []
+        for indx, broker_cfg in enumerate(mqtt_cfg['brokers'] or []):
+            name = str(broker_cfg.get('name', f"broker_{indx}"))
+            if any(broker.name == name for broker in brokers):
+                logging.error(f"Mqtt broker name {name} is used by more than one broker in conf file. Broker number "
+                              f"{indx} is going to be ignored.")
+                continue
+            try:
+                brokers.append(MqttBrokerConf.create_from_dict(broker_cfg, name=name, default_qos=default_qos))
+            except NoMqttHostSection as e:
+                logging.error(f"Mqtt broker number {indx} is going to be ignored: {str(e)}")
+        if len(brokers) == 0:
+            raise NoMqttHostSection()
+        return brokers
@@ -4,4 +4,8 @@ class NoMqttConfSection(Exception):
 
 class NoMqttHostSection(Exception):
     def __init__(self):
-        super().__init__("No mqtt_broker host section into configuration file. Mqtt client isn't going to start.")
\ No newline at end of file
+        super().__init__("No mqtt_broker host section into configuration file. Mqtt client isn't going to start.")
+class InvalidMqttTopicFilter(Exception):
+    def __init__(self, topic_filter: str):
+        super().__init__(f"Invalid MQTT topic filter '{topic_filter}'. Wildcards must take a whole level and '#' can "
+                         f"only be the last one.")
@@ -0,0 +1,148 @@
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Tuple
+
+from network.mqtt.mqttbrokerconf import MqttBrokerConf
+from network.mqtt.mqttcallbackexecutor import MqttCallbackExecutor
+from network.mqtt.mqttclient import MqttClient, MqttLoopType, PublishOutcome
+from network.mqtt.mqttconf import MqttConf
+from network.mqtt.mqttjournal import MqttJournal
+from network.mqtt.mqtttopic import MqttTopic
+
+
+class MqttFanoutClient:
+    # Publica cada mensaje en todos los brokers configurados. Cada broker tiene su propio MqttClient, con su conexión,
+    # su cola de envío y su hilo de red, de forma que un broker lento o caído no retrasa a los demás
+
+    def __init__(self, clients: List[Tuple[MqttBrokerConf, MqttClient]]):
+        self.clients = list(clients)
+
+    def __enter__(self):
+        self.init_context()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close_context()
+
+    def init_context(self):
+        for _, client in self.clients:
+            client.init_context()
+
+    def close_context(self):
+        for broker_conf, client in self.clients:
+            try:
+                client.close_context()
+            except Exception as e:
+                logging.error(f"MQTT client of broker {broker_conf.name} couldn't be closed: {str(e)}")
+
+    def publish(self, topic: MqttTopic, payload: Any,
+                on_result: Callable[[Dict[str, PublishOutcome]], None] = None):
+        targets = [(broker_conf.name, client, broker_conf.map_topic(topic)) for broker_conf, client in self.clients]
+        targets = [target for target in targets if target[2] is not None]
+        if on_result is None:
+            for _, client, broker_topic in targets:
+                client.publish(broker_topic, payload)
+            return
+        if len(targets) == 0:
+            on_result({})
+            return
+
+        # on_result se llama una sola vez, cuando todos los brokers han dado su resultado
+        results: Dict[str, PublishOutcome] = {}
+        lock = threading.Lock()
+
+        def on_broker_result(broker_name: str, outcome: PublishOutcome):
+            with lock:
+                results[broker_name] = outcome
+                finished = len(results) == len(targets)
+            if finished:
+                on_result(dict(results))
+
+        for name, client, broker_topic in targets:
+            client.publish(broker_topic, payload,
+                           on_result=lambda outcome, name=name: on_broker_result(name, outcome))
+
+    def subscribe(self, topic: MqttTopic):
+        for _, client in self.clients:
+            client.subscribe(topic)
+
+    def unsubscribe(self, topic: MqttTopic):
+        for _, client in self.clients:
+            client.unsubscribe(topic)
+
+    def is_connected(self):
+        return any(client.is_connected() for _, client in self.clients)
+
+    def is_healthy(self):
+        return all(client.is_healthy() for _, client in self.clients)
+
+    def restart_unhealthy(self):
+        # Solo se reinician los clientes que han fallado; el resto sigue publicando sin cortes
+        for broker_conf, client in self.clients:
+            if not client.is_healthy():
+                logging.warning(f"Restarting MQTT client of broker {broker_conf.name}.")
+                client.close_context()
+                client.init_context()
+
+    def set_on_failure(self, on_failure: Callable[[], None]):
+        for _, client in self.clients:
+            client.on_failure = on_failure
+
+    def get_broker_names(self) -> List[str]:
+        return [broker_conf.name for broker_conf, _ in self.clients]
+
+    def update_broker(self, broker_conf: MqttBrokerConf) -> bool:
+        # Aplica la nueva configuración de un broker existente. Solo se reconecta si cambian sus datos de conexión
+        for indx, (old_conf, client) in enumerate(self.clients):
+            if old_conf.name != broker_conf.name:
+                continue
+            self.clients[indx] = (broker_conf, client)
+            if broker_conf.url != old_conf.url or broker_conf.url.tls_cert_path != old_conf.url.tls_cert_path:
+                logging.info(f"MQTT broker {broker_conf.name} changed to {broker_conf.url}. Reconnecting.")
+                client.close_context()
+                client.broker_url = broker_conf.url
+                client.init_context()
+            return True
+        return False
+
+    def get_client(self, name: str) -> MqttClient:
+        return next((client for broker_conf, client in self.clients if broker_conf.name == name), None)
+
+    def get_publish_stats(self) -> Dict[str, dict]:
+        return {broker_conf.name: client.get_publish_stats() for broker_conf, client in self.clients}
+
+    def get_callback_stats(self) -> Dict[str, dict]:
+        return {broker_conf.name: client.get_callback_stats() for broker_conf, client in self.clients}
+
+    @staticmethod
+    def create_from_conf(mqtt_conf: MqttConf, loop_type: MqttLoopType = MqttLoopType.NO_LOOP) -> 'MqttFanoutClient':
+        async_publish = mqtt_conf.async_publish
+        if not async_publish and len(mqtt_conf.brokers) > 1:
+            # Con publicación síncrona un broker caído bloquearía la publicación en el resto
+            logging.info("MQTT async_publish is enabled because there is more than one broker.")
+            async_publish = True
+
+        clients = []
+        for indx, broker_conf in enumerate(mqtt_conf.brokers):
+            journal = None
+            if mqtt_conf.journal_path is not None:
+                # El primer broker usa el journal configurado; el resto uno propio al lado, para que cada broker
+                # reenvíe solo lo que él no ha recibido
+                journal_path = mqtt_conf.journal_path if indx == 0 \
+                    else f"{mqtt_conf.journal_path}.{broker_conf.name}"
+                journal = MqttJournal(path=journal_path, size=mqtt_conf.journal_size,
+                                      sync_interval=mqtt_conf.journal_sync_interval)
+            client = MqttClient(broker_url=broker_conf.url, loop_type=loop_type, async_publish=async_publish,
+                                max_queue_size=mqtt_conf.queue_size,
+                                reconnect_min_delay=mqtt_conf.reconnect_min_delay,
+                                reconnect_max_delay=mqtt_conf.reconnect_max_delay,
+                                journal=journal, replay_batch_size=mqtt_conf.replay_batch_size,
+                                replay_rate=mqtt_conf.replay_rate,
+                                callback_executor=MqttCallbackExecutor(
+                                    workers=mqtt_conf.callback_workers,
+                                    max_queue_size=mqtt_conf.callback_queue_size,
+                                    overflow_policy=mqtt_conf.callback_overflow_policy),
+                                name=broker_conf.name, client_id=f"{mqtt_conf.client_id}_{broker_conf.name}",
+                                persistent_session=mqtt_conf.persistent_session, keepalive=mqtt_conf.keepalive)
+            clients.append((broker_conf, client))
+        return MqttFanoutClient(clients)
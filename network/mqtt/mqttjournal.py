@@ -0,0 +1,219 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+from typing import List, Optional, Tuple
+
+from network.mqtt.mqtttopic import MqttTopic
+
+
+class MqttJournal:
+    MAGIC = b'MQJ1'
+    # magic, capacidad, head (offset de escritura), tail (offset de lectura), número de mensajes, siguiente seq
+    HEADER = struct.Struct('<4sQQQQQ')
+    HEADER_SIZE = 64
+    # longitud total del registro, seq, qos, longitud del topic
+    RECORD_HEADER = struct.Struct('<IQBH')
+    # Un registro de longitud 0 indica que el siguiente registro está al principio del buffer
+    WRAP_MARKER = struct.Struct('<I')
+
+    DEFAULT_SIZE = 256 * 1024
+    DEFAULT_SYNC_INTERVAL = 5.0
+
+    def __init__(self, path: str, size: int = DEFAULT_SIZE, sync_interval: float = DEFAULT_SYNC_INTERVAL):
+        self.path = path
+        self.size = size
+        self.capacity = size - self.HEADER_SIZE
+        self.sync_interval = sync_interval
+        self.head = 0
+        self.tail = 0
+        self.count = 0
+        self.next_seq = 0
+        self.dropped = 0
+        self.file = None
+        self.mmap = None
+        self.sync_timer = None
+        self.lock = threading.RLock()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.count
+
+    def open(self):
+        with self.lock:
+            if self.mmap is not None:
+                return
+            dir_path = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(dir_path, exist_ok=True)
+            exists = os.path.exists(self.path) and os.path.getsize(self.path) == self.size
+            self.file = open(self.path, 'r+b' if exists else 'w+b')
+            if not exists:
+                self.file.truncate(self.size)
+            self.mmap = mmap.mmap(self.file.fileno(), self.size)
+            magic, capacity, head, tail, count, next_seq = self.HEADER.unpack_from(self.mmap, 0)
+            if exists and magic == self.MAGIC and capacity == self.capacity:
+                self.head, self.tail, self.count, self.next_seq = head, tail, count, next_seq
+                logging.info(f"MQTT journal {self.path} opened with {self.count} pending messages.")
+            else:
+                if exists:
+                    logging.warning(f"MQTT journal {self.path} has an invalid header. It's going to be reset.")
+                self.head = self.tail = self.count = self.next_seq = 0
+                self.__write_header__()
+                self.mmap.flush()
+
+    def close(self):
+        with self.lock:
+            if self.mmap is None:
+                return
+            if self.sync_timer is not None:
+                self.sync_timer.cancel()
+                self.sync_timer = None
+            self.mmap.flush()
+            self.mmap.close()
+            self.file.close()
+            self.mmap = None
+            self.file = None
+
+    def append(self, topic: MqttTopic, payload) -> bool:
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        elif payload is None:
+            payload = b''
+        topic_name = topic.name.encode('utf-8')
+        record_size = self.RECORD_HEADER.size + len(topic_name) + len(payload)
+        if record_size > self.capacity:
+            logging.error(f"Message for topic = {topic} ({record_size} bytes) doesn't fit into MQTT journal.")
+            return False
+
+        with self.lock:
+            offset = self.__make_room__(record_size)
+            position = self.HEADER_SIZE + offset
+            self.RECORD_HEADER.pack_into(self.mmap, position, record_size, self.next_seq, topic.qos, len(topic_name))
+            position += self.RECORD_HEADER.size
+            self.mmap[position:position + len(topic_name)] = topic_name
+            position += len(topic_name)
+            self.mmap[position:position + len(payload)] = payload
+            self.head = offset + record_size
+            self.count += 1
+            self.next_seq += 1
+            self.__write_header__()
+            self.__schedule_sync__()
+        return True
+
+    def count_after(self, seq: Optional[int]) -> int:
+        # Mensajes con seq mayor que el indicado. Los seq son consecutivos y siempre se descartan los más antiguos
+        with self.lock:
+            if seq is None:
+                return self.count
+            return max(min(self.count, self.next_seq - seq - 1), 0)
+
+    def read_batch(self, max_messages: int, after_seq: int = None) -> List[Tuple[int, MqttTopic, bytes]]:
+        # Con after_seq se saltan los mensajes ya leídos que todavía no se han confirmado con ack
+        batch = []
+        with self.lock:
+            offset = self.tail
+            for _ in range(self.count):
+                if len(batch) >= max_messages:
+                    break
+                offset = self.__normalize_offset__(offset)
+                record_size, seq, qos, topic_len = self.RECORD_HEADER.unpack_from(self.mmap,
+                                                                                  self.HEADER_SIZE + offset)
+                if after_seq is not None and seq <= after_seq:
+                    offset += record_size
+                    continue
+                position = self.HEADER_SIZE + offset + self.RECORD_HEADER.size
+                topic_name = bytes(self.mmap[position:position + topic_len]).decode('utf-8')
+                payload = bytes(self.mmap[position + topic_len:self.HEADER_SIZE + offset + record_size])
+                batch.append((seq, MqttTopic(name=topic_name, qos=qos), payload))
+                offset += record_size
+        return batch
+
+    def ack(self, seq: int):
+        # Se eliminan todos los mensajes hasta seq (incluido). Si mientras tanto se han sobrescrito por falta de
+        # espacio simplemente ya no están. Una confirmación que llega con el journal cerrado se ignora: el mensaje se
+        # reenvía en el siguiente arranque
+        with self.lock:
+            if self.mmap is None:
+                return
+            while self.count > 0:
+                self.tail = self.__normalize_offset__(self.tail)
+                record_size, record_seq, _, _ = self.RECORD_HEADER.unpack_from(self.mmap, self.HEADER_SIZE + self.tail)
+                if record_seq > seq:
+                    break
+                self.__drop_oldest__()
+            self.__write_header__()
+            self.__schedule_sync__()
+
+    def sync(self):
+        with self.lock:
+            self.sync_timer = None
+            if self.mmap is not None:
+                self.mmap.flush()
+
+    def get_stats(self):
+        with self.lock:
+            return {'messages': self.count,
+                    'size': self.size,
+                    'used_bytes': self.__used_bytes__(),
+                    'dropped': self.dropped}
+
+    def __make_room__(self, record_size: int) -> int:
+        while True:
+            if self.count == 0:
+                self.head = self.tail = 0
+                return 0
+            if self.head > self.tail:
+                # Datos en [tail, head)
+                if self.capacity - self.head >= record_size:
+                    return self.head
+                if self.tail >= record_size:
+                    if self.capacity - self.head >= self.WRAP_MARKER.size:
+                        self.WRAP_MARKER.pack_into(self.mmap, self.HEADER_SIZE + self.head, 0)
+                    return 0
+            elif self.tail - self.head >= record_size:
+                # Datos en [tail, capacity) y [0, head)
+                return self.head
+            self.__drop_oldest__()
+            self.dropped += 1
+
+    def __drop_oldest__(self):
+        self.tail = self.__normalize_offset__(self.tail)
+        record_size = self.RECORD_HEADER.unpack_from(self.mmap, self.HEADER_SIZE + self.tail)[0]
+        self.tail += record_size
+        self.count -= 1
+        if self.count == 0:
+            self.head = self.tail = 0
+        else:
+            self.tail = self.__normalize_offset__(self.tail)
+
+    def __normalize_offset__(self, offset: int) -> int:
+        if offset + self.RECORD_HEADER.size > self.capacity or \
+                self.WRAP_MARKER.unpack_from(self.mmap, self.HEADER_SIZE + offset)[0] == 0:
+            return 0
+        return offset
+
+    def __used_bytes__(self) -> int:
+        if self.count == 0:
+            return 0
+        if self.head > self.tail:
+            return self.head - self.tail
+        return self.capacity - self.tail + self.head
+
+    def __write_header__(self):
+        self.HEADER.pack_into(self.mmap, 0, self.MAGIC, self.capacity, self.head, self.tail, self.count,
+                              self.next_seq)
+
+    def __schedule_sync__(self):
+        # Se agrupan las escrituras a disco para no desgastar la tarjeta SD
+        if self.sync_timer is None and self.mmap is not None:
+            self.sync_timer = threading.Timer(self.sync_interval, self.sync)
+            self.sync_timer.daemon = True
+            self.sync_timer.start()
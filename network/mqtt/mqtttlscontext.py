@@ -0,0 +1,70 @@
+import ssl
+import threading
+
+from metrics.metricsregistry import DEFAULT_REGISTRY
+
+MQTT_TLS_HANDSHAKES = DEFAULT_REGISTRY.counter('doorbell_mqtt_tls_handshakes_total',
+                                               'TLS handshakes with the MQTT broker by session resumption',
+                                               ['broker', 'resumed'])
+
+
+class ResumableSSLSocket(ssl.SSLSocket):
+    # Guarda en su contexto la sesión TLS para que la siguiente conexión la reanude. Con TLS 1.3 el ticket de sesión
+    # llega después del handshake, así que también se guarda al cerrar el socket
+
+    def do_handshake(self, *args, **kwargs):
+        super().do_handshake(*args, **kwargs)
+        self.context.on_handshake(self)
+
+    def close(self):
+        self.context.save_session(self.session)
+        super().close()
+
+
+class MqttTLSContext(ssl.SSLContext):
+    # paho crea el socket TLS con wrap_socket en cada connect() o reconnect(). Este contexto le pasa la sesión de la
+    # conexión anterior: si el broker la acepta el handshake se reanuda sin intercambio de certificados ni claves,
+    # que es la parte cara en la CPU de la Orange Pi. Si no la acepta se hace un handshake completo
+    sslsocket_class = ResumableSSLSocket
+
+    def __new__(cls, protocol=ssl.PROTOCOL_TLS_CLIENT, *args, **kwargs):
+        context = super().__new__(cls, protocol, *args, **kwargs)
+        context.ca_cert_path = None
+        context.name = None
+        context.session = None
+        context.session_lock = threading.Lock()
+        context.stats = {'handshakes': 0, 'resumed': 0}
+        return context
+
+    def wrap_socket(self, sock, *args, session=None, **kwargs):
+        with self.session_lock:
+            if session is None:
+                session = self.session
+        return super().wrap_socket(sock, *args, session=session, **kwargs)
+
+    def on_handshake(self, ssl_socket: ssl.SSLSocket):
+        resumed = ssl_socket.session_reused
+        with self.session_lock:
+            self.stats['handshakes'] += 1
+            self.stats['resumed'] += resumed
+        MQTT_TLS_HANDSHAKES.labels(self.name, str(resumed).lower()).inc()
+        self.save_session(ssl_socket.session)
+
+    def save_session(self, session: ssl.SSLSession):
+        if session is None:
+            return
+        with self.session_lock:
+            self.session = session
+
+    def get_stats(self):
+        with self.session_lock:
+            return dict(self.stats)
+
+    @staticmethod
+    def create(ca_cert_path: str, name: str) -> 'MqttTLSContext':
+        # Misma configuración que tls_set de paho: se verifica el certificado del broker y su hostname
+        context = MqttTLSContext(ssl.PROTOCOL_TLS_CLIENT)
+        context.load_verify_locations(ca_cert_path)
+        context.ca_cert_path = ca_cert_path
+        context.name = name
+        return context
@@ -1,3 +1,4 @@
+import logging
 from typing import Callable
 from dataclasses import dataclass
 
@@ -10,3 +11,17 @@ class MqttTopic:
 
     def __repr__(self):
         return f"MQTTTopic[name = {self.name}, qos = {self.qos}]"
+
+    @staticmethod
+    def create_from_cfg(topic_cfg, default_qos: int = 0) -> 'MqttTopic':
+        # El topic se puede indicar solo con el nombre o como {name: ..., qos: ...}
+        if isinstance(topic_cfg, dict):
+            name = topic_cfg['name']
+            qos = int(topic_cfg.get('qos', default_qos))
+        else:
+            name = str(topic_cfg)
+            qos = default_qos
+        if qos not in (0, 1, 2):
+            logging.warning(f"Invalid qos {qos} for topic {name}. Using qos {default_qos}.")
+            qos = default_qos
+        return MqttTopic(name=name, qos=qos)
@@ -0,0 +1,122 @@
+import threading
+from typing import Dict, List, Tuple
+
+from network.mqtt.mqttexceptions import InvalidMqttTopicFilter
+from network.mqtt.mqtttopic import MqttTopic
+
+SINGLE_LEVEL_WILDCARD = '+'
+MULTI_LEVEL_WILDCARD = '#'
+LEVEL_SEPARATOR = '/'
+
+
+class MqttTopicTrieNode:
+    def __init__(self):
+        self.children: Dict[str, 'MqttTopicTrieNode'] = {}
+        self.topics: List[MqttTopic] = []
+
+
+class MqttTopicTrie:
+    """
+    Árbol de filtros de suscripción indexado por niveles del topic. Buscar los manejadores de un mensaje cuesta lo que
+    la profundidad del topic (más las ramas con comodines que coinciden), no lo que el número de suscripciones.
+    """
+
+    def __init__(self):
+        self.root = MqttTopicTrieNode()
+        self.lock = threading.Lock()
+
+    def add(self, topic: MqttTopic) -> bool:
+        """Registra el manejador. Devuelve True si el filtro no tenía manejadores, es decir, si hay que suscribirse."""
+        levels = self.__split_filter__(topic.name)
+        with self.lock:
+            node = self.root
+            for level in levels:
+                node = node.children.setdefault(level, MqttTopicTrieNode())
+            is_new_filter = len(node.topics) == 0
+            # Copy-on-write: match() recorre las listas sin el lock
+            node.topics = node.topics + [topic]
+        return is_new_filter
+
+    def remove(self, topic: MqttTopic) -> bool:
+        """Quita el manejador. Devuelve True si el filtro se ha quedado sin manejadores y hay que desuscribirse."""
+        levels = self.__split_filter__(topic.name)
+        with self.lock:
+            path = [self.root]
+            for level in levels:
+                node = path[-1].children.get(level)
+                if node is None:
+                    return False
+                path.append(node)
+            node = path[-1]
+            if topic not in node.topics:
+                return False
+            topics = list(node.topics)
+            topics.remove(topic)
+            node.topics = topics
+            if len(topics) > 0:
+                return False
+            # Se podan los nodos que ya no llevan a ninguna suscripción
+            for level, parent, child in zip(reversed(levels), reversed(path[:-1]), reversed(path[1:])):
+                if len(child.children) > 0 or len(child.topics) > 0:
+                    break
+                del parent.children[level]
+            return True
+
+    def match(self, topic_name: str) -> List[MqttTopic]:
+        levels = topic_name.split(LEVEL_SEPARATOR)
+        matches = []
+        self.__match__(self.root, levels, 0, matches)
+        return matches
+
+    def get_filters(self) -> List[Tuple[str, int]]:
+        """Filtros suscritos junto con la mayor qos pedida para cada uno."""
+        filters = []
+        with self.lock:
+            self.__collect_filters__(self.root, [], filters)
+        return filters
+
+    def get_qos(self, topic_filter: str) -> int:
+        with self.lock:
+            node = self.root
+            for level in self.__split_filter__(topic_filter):
+                node = node.children.get(level)
+                if node is None:
+                    return None
+            return max((topic.qos for topic in node.topics), default=None)
+
+    def __match__(self, node: MqttTopicTrieNode, levels: List[str], indx: int, matches: List[MqttTopic]):
+        # Los comodines del primer nivel no coinciden con los topics de sistema ($SYS/...)
+        allow_wildcards = indx > 0 or not levels[0].startswith('$')
+        if allow_wildcards:
+            # '#' también coincide con el nivel padre: 'a/#' recibe los mensajes de 'a'
+            multi_level = node.children.get(MULTI_LEVEL_WILDCARD)
+            if multi_level is not None:
+                matches.extend(multi_level.topics)
+        if indx == len(levels):
+            matches.extend(node.topics)
+            return
+        child = node.children.get(levels[indx])
+        if child is not None:
+            self.__match__(child, levels, indx + 1, matches)
+        if allow_wildcards:
+            single_level = node.children.get(SINGLE_LEVEL_WILDCARD)
+            if single_level is not None:
+                self.__match__(single_level, levels, indx + 1, matches)
+
+    def __collect_filters__(self, node: MqttTopicTrieNode, levels: List[str], filters: List[Tuple[str, int]]):
+        if len(node.topics) > 0:
+            filters.append((LEVEL_SEPARATOR.join(levels), max(topic.qos for topic in node.topics)))
+        for level, child in node.children.items():
+            self.__collect_filters__(child, levels + [level], filters)
+
+    @staticmethod
+    def __split_filter__(topic_filter: str) -> List[str]:
+        if topic_filter is None or len(topic_filter) == 0:
+            raise InvalidMqttTopicFilter(topic_filter)
+        levels = topic_filter.split(LEVEL_SEPARATOR)
+        for indx, level in enumerate(levels):
+            if level == MULTI_LEVEL_WILDCARD and indx != len(levels) - 1:
+                raise InvalidMqttTopicFilter(topic_filter)
+            if len(level) > 1 and (SINGLE_LEVEL_WILDCARD in level or MULTI_LEVEL_WILDCARD in level):
+                raise InvalidMqttTopicFilter(topic_filter)
+        return levels
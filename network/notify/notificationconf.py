@@ -0,0 +1,144 @@
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Union
+from urllib.parse import urlsplit
+
+from events.ringeventserializer import RingEventSerializer
+from network.notify.notificationdispatcher import NotificationDispatcher
+from network.notify.notificationsink import NotificationSink
+from network.notify.unixsocketsink import UnixSocketSink
+from network.notify.webhooksink import WebhookSink
+
+DEFAULT_FORMAT = 'json'
+
+
+def create_serializer(sink_cfg, name: str) -> RingEventSerializer:
+    payload_format = sink_cfg.get('format', DEFAULT_FORMAT)
+    try:
+        return RingEventSerializer.create_from_name(payload_format)
+    except ValueError:
+        logging.warning(f"Unknown format {payload_format} in notification sink {name}. Using {DEFAULT_FORMAT}.")
+        return RingEventSerializer.create_from_name(DEFAULT_FORMAT)
+
+
+@dataclass
+class WebhookConf:
+    name: str
+    url: str
+    method: str = WebhookSink.DEFAULT_METHOD
+    headers: Dict[str, str] = field(default_factory=dict)
+    timeout: float = WebhookSink.DEFAULT_TIMEOUT
+    connections: int = WebhookSink.DEFAULT_CONNECTIONS
+    queue_size: int = WebhookSink.DEFAULT_MAX_QUEUE_SIZE
+    max_retries: int = WebhookSink.DEFAULT_MAX_RETRIES
+    retry_min_delay: float = WebhookSink.DEFAULT_RETRY_MIN_DELAY
+    retry_max_delay: float = WebhookSink.DEFAULT_RETRY_MAX_DELAY
+    tls_cert_path: str = None
+    serializer: RingEventSerializer = None
+
+    def create_sink(self) -> WebhookSink:
+        return WebhookSink(self.name, self.url, method=self.method, headers=self.headers, timeout=self.timeout,
+                           connections=self.connections, max_queue_size=self.queue_size,
+                           max_retries=self.max_retries, retry_min_delay=self.retry_min_delay,
+                           retry_max_delay=self.retry_max_delay, tls_cert_path=self.tls_cert_path,
+                           serializer=self.serializer)
+
+    @staticmethod
+    def create_from_dict(sink_cfg, name: str) -> 'WebhookConf':
+        if 'url' not in sink_cfg:
+            raise ValueError(f"No url in webhook {name}")
+        parsed_url = urlsplit(str(sink_cfg['url']))
+        if parsed_url.scheme not in ('http', 'https') or not parsed_url.hostname:
+            raise ValueError(f"Invalid url {sink_cfg['url']} in webhook {name}")
+        webhook_conf = WebhookConf(name=name, url=str(sink_cfg['url']),
+                                   serializer=create_serializer(sink_cfg, name))
+        if 'method' in sink_cfg:
+            webhook_conf.method = str(sink_cfg['method']).upper()
+        if 'headers' in sink_cfg:
+            webhook_conf.headers = {str(key): str(value) for key, value in (sink_cfg['headers'] or {}).items()}
+        if 'timeout' in sink_cfg:
+            webhook_conf.timeout = float(sink_cfg['timeout'])
+        if 'connections' in sink_cfg:
+            webhook_conf.connections = int(sink_cfg['connections'])
+        if 'queue_size' in sink_cfg:
+            webhook_conf.queue_size = int(sink_cfg['queue_size'])
+        if 'max_retries' in sink_cfg:
+            webhook_conf.max_retries = int(sink_cfg['max_retries'])
+        if 'retry_min_delay' in sink_cfg:
+            webhook_conf.retry_min_delay = float(sink_cfg['retry_min_delay'])
+        if 'retry_max_delay' in sink_cfg:
+            webhook_conf.retry_max_delay = float(sink_cfg['retry_max_delay'])
+        if 'tls_cert_path' in sink_cfg:
+            webhook_conf.tls_cert_path = sink_cfg['tls_cert_path']
+        return webhook_conf
+
+
+@dataclass
+class UnixSocketConf:
+    name: str
+    path: str = UnixSocketSink.DEFAULT_PATH
+    max_clients: int = UnixSocketSink.DEFAULT_MAX_CLIENTS
+    max_buffer_kb: int = UnixSocketSink.DEFAULT_MAX_BUFFER_SIZE // 1024
+    permissions: int = None
+    serializer: RingEventSerializer = None
+
+    def create_sink(self) -> UnixSocketSink:
+        return UnixSocketSink(self.name, path=self.path, max_clients=self.max_clients,
+                              max_buffer_size=self.max_buffer_kb * 1024, permissions=self.permissions,
+                              serializer=self.serializer)
+
+    @staticmethod
+    def create_from_dict(sink_cfg, name: str) -> 'UnixSocketConf':
+        unix_socket_conf = UnixSocketConf(name=name, serializer=create_serializer(sink_cfg, name))
+        if 'path' in sink_cfg:
+            unix_socket_conf.path = sink_cfg['path']
+        else:
+            logging.warning(f"No path in notification socket {name}. Using {UnixSocketSink.DEFAULT_PATH}.")
+        if 'max_clients' in sink_cfg:
+            unix_socket_conf.max_clients = int(sink_cfg['max_clients'])
+        if 'max_buffer_kb' in sink_cfg:
+            unix_socket_conf.max_buffer_kb = int(sink_cfg['max_buffer_kb'])
+        if 'permissions' in sink_cfg:
+            # En YAML 0660 es un entero en octal, pero "660" o "0o660" llegan como texto
+            permissions = sink_cfg['permissions']
+            unix_socket_conf.permissions = int(permissions, 8) if isinstance(permissions, str) else int(permissions)
+        return unix_socket_conf
+
+
+SINK_TYPES = {'webhook': WebhookConf, 'unix_socket': UnixSocketConf}
+
+
+@dataclass
+class NotificationConf:
+    sinks: List[Union[WebhookConf, UnixSocketConf]] = field(default_factory=list)
+
+    def create_dispatcher(self) -> NotificationDispatcher:
+        sinks: List[NotificationSink] = [sink_conf.create_sink() for sink_conf in self.sinks]
+        return NotificationDispatcher(sinks)
+
+    @staticmethod
+    def create_from_dict(cfg) -> Optional['NotificationConf']:
+        # Sin sección notifications los eventos solo se publican por MQTT
+        if not cfg.get('notifications'):
+            return None
+        notification_conf = NotificationConf()
+        names = set()
+        for indx, sink_cfg in enumerate(cfg['notifications']):
+            sink_cfg = sink_cfg or {}
+            name = str(sink_cfg.get('name', f"{sink_cfg.get('type', 'sink')}_{indx}"))
+            sink_type = str(sink_cfg.get('type', '')).lower()
+            if name in names:
+                logging.error(f"Notification sink {name} is duplicated. Ignoring it.")
+                continue
+            if sink_type not in SINK_TYPES:
+                logging.error(f"Unknown type {sink_type} in notification sink {name}. Valid types are "
+                              f"{', '.join(SINK_TYPES)}. Ignoring it.")
+                continue
+            try:
+                notification_conf.sinks.append(SINK_TYPES[sink_type].create_from_dict(sink_cfg, name))
+                names.add(name)
+            except (ValueError, TypeError, AttributeError) as e:
+                logging.error(f"Notification sink {name} isn't valid. Ignoring it: {str(e)}")
+        if len(notification_conf.sinks) == 0:
+            return None
+        return notification_conf
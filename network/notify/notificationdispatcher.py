@@ -0,0 +1,62 @@
+import logging
+from typing import Dict, List
+
+from events.ringevent import RingEvent
+from network.notify.notificationsink import NotificationSink
+
+
+class NotificationDispatcher:
+    # Reparte cada evento entre todos los sinks. Como notify() de cada sink solo encola, las entregas se hacen a la
+    # vez en los hilos de cada sink y el hilo de la pulsación nunca espera a la red
+
+    def __init__(self, sinks: List[NotificationSink]):
+        self.sinks = sinks
+
+    def __enter__(self):
+        self.init_context()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close_context()
+
+    def init_context(self):
+        # Un sink que no arranca (por ejemplo, un socket sin permisos) no impide que arranquen los demás; el
+        # supervisor lo reintentará
+        for sink in self.sinks:
+            try:
+                sink.init_context()
+            except Exception as e:
+                logging.error(f"Notification sink {sink.name} couldn't be started: {str(e)}")
+
+    def close_context(self):
+        for sink in self.sinks:
+            try:
+                sink.close_context()
+            except Exception as e:
+                logging.error(f"Notification sink {sink.name} couldn't be closed: {str(e)}")
+
+    def notify(self, event: RingEvent):
+        for sink in self.sinks:
+            try:
+                sink.notify(event)
+            except Exception as e:
+                logging.error(f"Notification sink {sink.name} couldn't queue event {event.seq}: {str(e)}")
+
+    def is_healthy(self) -> bool:
+        return all(sink.is_healthy() for sink in self.sinks)
+
+    def restart_unhealthy(self):
+        for sink in self.sinks:
+            if not sink.is_healthy():
+                logging.warning(f"Restarting notification sink {sink.name}.")
+                try:
+                    sink.close_context()
+                except Exception as e:
+                    logging.error(f"Notification sink {sink.name} couldn't be closed: {str(e)}")
+                sink.init_context()
+
+    def get_sink_names(self) -> List[str]:
+        return [sink.name for sink in self.sinks]
+
+    def get_stats(self) -> Dict[str, dict]:
+        return {sink.name: sink.get_stats() for sink in self.sinks}
@@ -0,0 +1,54 @@
+from typing import Union
+
+from events.ringevent import RingEvent
+from events.ringeventserializer import RingEventSerializer, JsonRingEventSerializer, BinaryRingEventSerializer
+from metrics.metricsregistry import DEFAULT_REGISTRY
+
+NOTIFICATION_RESULTS = DEFAULT_REGISTRY.counter('doorbell_notifications_total',
+                                                'Ring event notifications by sink and result', ['sink', 'result'])
+NOTIFICATION_SECONDS = DEFAULT_REGISTRY.histogram('doorbell_notification_seconds',
+                                                  'Time from the ring event being handed to a sink to its delivery',
+                                                  ['sink'])
+
+
+class NotificationSink:
+    # Destino de los eventos de pulsación aparte de MQTT. notify() nunca bloquea: solo encola el evento y cada sink lo
+    # serializa y lo entrega desde sus propios hilos, de forma que un destino lento o caído no retrasa el sonido, la
+    # publicación MQTT ni al resto de sinks
+
+    def __init__(self, name: str, serializer: RingEventSerializer = None):
+        self.name = name
+        self.serializer = serializer if serializer is not None else JsonRingEventSerializer()
+
+    def __enter__(self):
+        self.init_context()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close_context()
+
+    def init_context(self):
+        raise NotImplementedError()
+
+    def close_context(self):
+        raise NotImplementedError()
+
+    def is_healthy(self) -> bool:
+        raise NotImplementedError()
+
+    def notify(self, event: RingEvent):
+        raise NotImplementedError()
+
+    def get_stats(self):
+        raise NotImplementedError()
+
+    def serialize(self, event: RingEvent) -> bytes:
+        payload: Union[str, bytes] = self.serializer.serialize(event)
+        return payload.encode('utf-8') if isinstance(payload, str) else payload
+
+    def get_content_type(self) -> str:
+        if isinstance(self.serializer, JsonRingEventSerializer):
+            return 'application/json'
+        if isinstance(self.serializer, BinaryRingEventSerializer):
+            return 'application/octet-stream'
+        return 'text/plain; charset=utf-8'
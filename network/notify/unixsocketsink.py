@@ -0,0 +1,215 @@
+import logging
+import os
+import selectors
+import socket
+import stat
+import struct
+import threading
+from collections import deque
+from typing import Dict
+
+from events.ringevent import RingEvent
+from events.ringeventserializer import RingEventSerializer, BinaryRingEventSerializer
+from network.notify.notificationsink import NotificationSink, NOTIFICATION_RESULTS
+
+
+class UnixSocketSink(NotificationSink):
+    # Difunde cada evento a todos los procesos conectados a un socket UNIX: una línea por evento en json o text, o un
+    # prefijo de 4 bytes con la longitud en binary. Un único hilo atiende el socket con selectors: acepta clientes y
+    # escribe sin bloquear. A un cliente que no lee y llena su buffer se le desconecta
+    DEFAULT_PATH = '/tmp/doorbell-events.sock'
+    DEFAULT_MAX_CLIENTS = 16
+    DEFAULT_MAX_BUFFER_SIZE = 64 * 1024
+    DEFAULT_MAX_QUEUE_SIZE = 256
+    LENGTH_PREFIX = struct.Struct('>I')
+
+    def __init__(self, name: str, path: str = DEFAULT_PATH, max_clients: int = DEFAULT_MAX_CLIENTS,
+                 max_buffer_size: int = DEFAULT_MAX_BUFFER_SIZE, permissions: int = None,
+                 serializer: RingEventSerializer = None):
+        super().__init__(name, serializer)
+        self.path = path
+        self.max_clients = max_clients
+        self.max_buffer_size = max_buffer_size
+        self.permissions = permissions
+        # El hilo del socket vacía la cola en cada vuelta; el límite solo protege de un hilo bloqueado
+        self.events = deque(maxlen=self.DEFAULT_MAX_QUEUE_SIZE)
+        self.lock = threading.Lock()
+        # socket del cliente -> datos pendientes de escribir
+        self.clients: Dict[socket.socket, bytearray] = {}
+        self.server_socket = None
+        self.selector = None
+        self.wakeup_reader = None
+        self.wakeup_writer = None
+        self.running = False
+        self.thread = None
+        self.stats = {'clients_accepted': 0, 'sent': 0, 'clients_dropped': 0, 'clients_refused': 0}
+
+    def init_context(self):
+        self.__remove_socket_file__()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self.server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.server_socket.bind(self.path)
+            if self.permissions is not None:
+                os.chmod(self.path, self.permissions)
+            self.server_socket.listen()
+        except OSError:
+            self.server_socket.close()
+            self.server_socket = None
+            raise
+        self.server_socket.setblocking(False)
+        # notify() escribe un byte en el socketpair para despertar al hilo bloqueado en select
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_reader.setblocking(False)
+        self.wakeup_writer.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.server_socket, selectors.EVENT_READ)
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ)
+        self.running = True
+        self.thread = threading.Thread(name=f"UnixSocketSink-{self.name}", target=self.__run__, daemon=True)
+        self.thread.start()
+        logging.info(f"Notification socket {self.name} listening on {self.path}")
+
+    def close_context(self):
+        self.running = False
+        self.__wake_up__()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        for client in list(self.clients):
+            self.__drop_client__(client)
+        for sock in (self.server_socket, self.wakeup_reader, self.wakeup_writer):
+            if sock is not None:
+                sock.close()
+        if self.selector is not None:
+            self.selector.close()
+        self.server_socket = self.wakeup_reader = self.wakeup_writer = self.selector = None
+        self.__remove_socket_file__()
+
+    def is_healthy(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def notify(self, event: RingEvent):
+        with self.lock:
+            self.events.append(event)
+        self.__wake_up__()
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, clients=len(self.clients))
+
+    def __wake_up__(self):
+        try:
+            self.wakeup_writer.send(b'\0')
+        except (BlockingIOError, AttributeError, OSError):
+            # Si el socketpair está lleno el hilo ya tiene un aviso pendiente
+            pass
+
+    def __run__(self):
+        while self.running:
+            for key, mask in self.selector.select():
+                if key.fileobj is self.server_socket:
+                    self.__accept__()
+                elif key.fileobj is self.wakeup_reader:
+                    try:
+                        while self.wakeup_reader.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                elif key.fileobj in self.clients:
+                    if mask & selectors.EVENT_READ and not self.__read_client__(key.fileobj):
+                        continue
+                    if mask & selectors.EVENT_WRITE:
+                        self.__flush__(key.fileobj)
+            self.__broadcast__()
+
+    def __accept__(self):
+        try:
+            client, _ = self.server_socket.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        if len(self.clients) >= self.max_clients:
+            logging.warning(f"Notification socket {self.name} has {self.max_clients} clients. Refusing a new one.")
+            client.close()
+            with self.lock:
+                self.stats['clients_refused'] += 1
+            return
+        client.setblocking(False)
+        with self.lock:
+            self.clients[client] = bytearray()
+            self.stats['clients_accepted'] += 1
+        self.selector.register(client, selectors.EVENT_READ)
+        logging.debug("Notification socket %s has a new client. %s clients connected.", self.name, len(self.clients))
+
+    def __read_client__(self, client: socket.socket) -> bool:
+        # Los clientes solo leen; lo que envíen se descarta. Devuelve False si el cliente se ha desconectado
+        try:
+            if client.recv(4096):
+                return True
+        except BlockingIOError:
+            return True
+        except OSError:
+            pass
+        self.__drop_client__(client)
+        return False
+
+    def __broadcast__(self):
+        with self.lock:
+            events = list(self.events)
+            self.events.clear()
+        if len(events) == 0 or len(self.clients) == 0:
+            return
+        data = b''.join(self.__frame__(self.serialize(event)) for event in events)
+        for client in list(self.clients):
+            buffer = self.clients[client]
+            if len(buffer) + len(data) > self.max_buffer_size:
+                logging.warning(f"Notification socket {self.name} client isn't reading. Disconnecting it.")
+                NOTIFICATION_RESULTS.labels(self.name, 'dropped').inc(len(events))
+                self.__drop_client__(client, slow=True)
+                continue
+            buffer += data
+            NOTIFICATION_RESULTS.labels(self.name, 'delivered').inc(len(events))
+            with self.lock:
+                self.stats['sent'] += len(events)
+            self.__flush__(client)
+
+    def __frame__(self, payload: bytes) -> bytes:
+        if isinstance(self.serializer, BinaryRingEventSerializer):
+            return self.LENGTH_PREFIX.pack(len(payload)) + payload
+        return payload + b'\n'
+
+    def __flush__(self, client: socket.socket):
+        buffer = self.clients.get(client)
+        if buffer is None:
+            return
+        try:
+            sent = client.send(buffer)
+            del buffer[:sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            self.__drop_client__(client)
+            return
+        # Solo se vigila la escritura mientras quedan datos pendientes
+        self.selector.modify(client, selectors.EVENT_READ | selectors.EVENT_WRITE if len(buffer) > 0
+                             else selectors.EVENT_READ)
+
+    def __drop_client__(self, client: socket.socket, slow: bool = False):
+        with self.lock:
+            if self.clients.pop(client, None) is None:
+                return
+            self.stats['clients_dropped'] += slow
+        try:
+            self.selector.unregister(client)
+        except (KeyError, ValueError):
+            pass
+        client.close()
+
+    def __remove_socket_file__(self):
+        # Un socket que ha quedado de una ejecución anterior impide hacer bind
+        try:
+            if stat.S_ISSOCK(os.stat(self.path).st_mode):
+                os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,303 @@
+import heapq
+import http.client
+import itertools
+import logging
+import random
+import select
+import ssl
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from events.ringevent import RingEvent
+from events.ringeventserializer import RingEventSerializer
+from network.notify.notificationsink import NotificationSink, NOTIFICATION_RESULTS, NOTIFICATION_SECONDS
+
+
+class HttpConnectionPool:
+    # Conexiones HTTP/1.1 persistentes (keep-alive) con un servidor. Las conexiones libres se reutilizan en orden LIFO
+    # para que las que llevan tiempo sin usarse, que el servidor puede haber cerrado ya, se descarten por idle_timeout.
+    # Antes de reutilizar una conexión se comprueba que el servidor no la haya cerrado mientras estaba libre
+    DEFAULT_IDLE_TIMEOUT = 30.0
+
+    def __init__(self, url: str, timeout: float, max_idle: int, idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 ssl_context: ssl.SSLContext = None):
+        parsed_url = urlsplit(url)
+        if parsed_url.scheme not in ('http', 'https') or not parsed_url.hostname:
+            raise ValueError(f"Invalid webhook url {url}")
+        self.https = parsed_url.scheme == 'https'
+        self.host = parsed_url.hostname
+        self.port = parsed_url.port or (443 if self.https else 80)
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.ssl_context = ssl_context
+        # (conexión, instante en el que quedó libre)
+        self.idle: List[Tuple[http.client.HTTPConnection, float]] = []
+        self.lock = threading.Lock()
+        self.stats = {'created': 0, 'reused': 0, 'discarded': 0}
+
+    def acquire(self) -> Tuple[http.client.HTTPConnection, bool]:
+        # Devuelve la conexión y si es reutilizada
+        now = time.monotonic()
+        expired = []
+        connection = None
+        with self.lock:
+            while len(self.idle) > 0:
+                idle_connection, released_at = self.idle.pop()
+                if now - released_at < self.idle_timeout and not self.__is_dropped__(idle_connection):
+                    connection = idle_connection
+                    self.stats['reused'] += 1
+                    break
+                expired.append(idle_connection)
+            self.stats['discarded'] += len(expired)
+            if connection is None:
+                self.stats['created'] += 1
+        for expired_connection in expired:
+            expired_connection.close()
+        if connection is not None:
+            return connection, True
+        # La conexión TCP (y TLS) se abre en el primer request
+        if self.https:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout,
+                                               context=self.ssl_context), False
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout), False
+
+    def release(self, connection: http.client.HTTPConnection, reusable: bool):
+        if reusable:
+            with self.lock:
+                if len(self.idle) < self.max_idle:
+                    self.idle.append((connection, time.monotonic()))
+                    return
+        with self.lock:
+            self.stats['discarded'] += 1
+        connection.close()
+
+    def close(self):
+        with self.lock:
+            idle = self.idle
+            self.idle = []
+        for connection, _ in idle:
+            connection.close()
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, idle=len(self.idle))
+
+    @staticmethod
+    def __is_dropped__(connection: http.client.HTTPConnection) -> bool:
+        # Con keep-alive el servidor no envía nada entre respuestas: si el socket libre tiene algo que leer es el
+        # cierre (FIN o RST) de la conexión
+        if connection.sock is None:
+            return True
+        try:
+            return len(select.select([connection.sock], [], [], 0)[0]) > 0
+        except (OSError, ValueError):
+            return True
+
+
+@dataclass
+class WebhookDelivery:
+    event: RingEvent
+    enqueued_at: float
+    payload: Optional[bytes] = None
+    attempts: int = 0
+    seq: int = field(default=0)
+
+
+class WebhookSink(NotificationSink):
+    # Envía cada evento en una petición HTTP. Hay un hilo por conexión del pool, así que como mucho hay
+    # `connections` peticiones en curso. Las entregas fallidas pasan a una cola de reintentos con backoff exponencial; los eventos
+    # nuevos tienen prioridad sobre los reintentos
+    DEFAULT_METHOD = 'POST'
+    DEFAULT_TIMEOUT = 5.0
+    DEFAULT_CONNECTIONS = 2
+    DEFAULT_MAX_QUEUE_SIZE = 64
+    DEFAULT_MAX_RETRIES = 5
+    DEFAULT_RETRY_MIN_DELAY = 1.0
+    DEFAULT_RETRY_MAX_DELAY = 60.0
+    # Tiempo máximo que close_context espera a que se envíen los eventos pendientes
+    CLOSE_TIMEOUT = 2.0
+    # Además de los 5xx, respuestas en las que tiene sentido reintentar
+    RETRY_STATUS = (408, 429)
+
+    def __init__(self, name: str, url: str, method: str = DEFAULT_METHOD, headers: Dict[str, str] = None,
+                 timeout: float = DEFAULT_TIMEOUT, connections: int = DEFAULT_CONNECTIONS,
+                 max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE, max_retries: int = DEFAULT_MAX_RETRIES,
+                 retry_min_delay: float = DEFAULT_RETRY_MIN_DELAY, retry_max_delay: float = DEFAULT_RETRY_MAX_DELAY,
+                 tls_cert_path: str = None, serializer: RingEventSerializer = None):
+        super().__init__(name, serializer)
+        self.url = url
+        self.method = method.upper()
+        parsed_url = urlsplit(url)
+        self.path = (parsed_url.path or '/') + (f"?{parsed_url.query}" if parsed_url.query else '')
+        self.headers = {'Content-Type': self.get_content_type()}
+        self.headers.update(headers or {})
+        self.timeout = timeout
+        self.connections = max(1, connections)
+        self.max_queue_size = max_queue_size
+        self.max_retries = max_retries
+        self.retry_min_delay = retry_min_delay
+        self.retry_max_delay = retry_max_delay
+        ssl_context = None
+        if tls_cert_path is not None:
+            ssl_context = ssl.create_default_context(cafile=tls_cert_path)
+        self.pool = HttpConnectionPool(url, timeout=timeout, max_idle=self.connections, ssl_context=ssl_context)
+        self.queue = deque()
+        # (instante del siguiente intento, orden de llegada, entrega)
+        self.retries: List[Tuple[float, int, WebhookDelivery]] = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.running = False
+        self.in_progress = 0
+        self.threads = []
+        self.stats = {'delivered': 0, 'retried': 0, 'failed': 0, 'dropped': 0}
+
+    def init_context(self):
+        with self.condition:
+            self.running = True
+        self.threads = [threading.Thread(name=f"Webhook-{self.name}-{indx}", target=self.__run__, daemon=True)
+                        for indx in range(self.connections)]
+        for thread in self.threads:
+            thread.start()
+
+    def close_context(self):
+        with self.condition:
+            deadline = time.monotonic() + self.CLOSE_TIMEOUT
+            while (len(self.queue) > 0 or self.in_progress > 0) and time.monotonic() < deadline and \
+                    any(thread.is_alive() for thread in self.threads):
+                self.condition.wait(timeout=deadline - time.monotonic())
+            self.running = False
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        with self.condition:
+            pending = len(self.queue) + len(self.retries)
+            self.queue.clear()
+            self.retries = []
+            self.stats['dropped'] += pending
+        if pending > 0:
+            NOTIFICATION_RESULTS.labels(self.name, 'dropped').inc(pending)
+            logging.warning(f"Webhook {self.name} closed with {pending} notifications not delivered.")
+        self.pool.close()
+
+    def is_healthy(self) -> bool:
+        return len(self.threads) > 0 and all(thread.is_alive() for thread in self.threads)
+
+    def notify(self, event: RingEvent):
+        with self.condition:
+            if len(self.queue) >= self.max_queue_size:
+                # Se descarta el más antiguo para que los eventos más recientes lleguen antes
+                self.queue.popleft()
+                self.stats['dropped'] += 1
+                NOTIFICATION_RESULTS.labels(self.name, 'dropped').inc()
+                logging.warning(f"Webhook {self.name} queue is full. Dropping the oldest notification.")
+            self.queue.append(WebhookDelivery(event=event, enqueued_at=time.monotonic(), seq=next(self.sequence)))
+            self.condition.notify()
+
+    def get_stats(self):
+        with self.condition:
+            stats = dict(self.stats, queue_size=len(self.queue), retry_queue_size=len(self.retries))
+        stats['connections'] = self.pool.get_stats()
+        return stats
+
+    def __run__(self):
+        while True:
+            with self.condition:
+                delivery = None
+                while self.running:
+                    delivery = self.__next_delivery__()
+                    if delivery is not None:
+                        break
+                    self.condition.wait(timeout=self.__retry_wait_time__())
+                if delivery is None:
+                    return
+                self.in_progress += 1
+            try:
+                self.__deliver__(delivery)
+            finally:
+                with self.condition:
+                    self.in_progress -= 1
+                    self.condition.notify_all()
+
+    def __next_delivery__(self) -> Optional[WebhookDelivery]:
+        if len(self.queue) > 0:
+            return self.queue.popleft()
+        if len(self.retries) > 0 and self.retries[0][0] <= time.monotonic():
+            return heapq.heappop(self.retries)[2]
+        return None
+
+    def __retry_wait_time__(self) -> Optional[float]:
+        if len(self.retries) == 0:
+            return None
+        return max(self.retries[0][0] - time.monotonic(), 0)
+
+    def __deliver__(self, delivery: WebhookDelivery):
+        if delivery.payload is None:
+            # Se serializa en el hilo del sink, no en el de la pulsación
+            delivery.payload = self.serialize(delivery.event)
+        delivery.attempts += 1
+        status, error = self.__request__(delivery.payload)
+        if status is not None and 200 <= status < 300:
+            latency = time.monotonic() - delivery.enqueued_at
+            NOTIFICATION_SECONDS.labels(self.name).observe(latency)
+            NOTIFICATION_RESULTS.labels(self.name, 'delivered').inc()
+            with self.condition:
+                self.stats['delivered'] += 1
+            logging.debug("Webhook %s delivered event %s in %.3fs.", self.name, delivery.event.seq, latency)
+            return
+        reason = f"status {status}" if status is not None else str(error)
+        retryable = status is None or status >= 500 or status in self.RETRY_STATUS
+        if retryable and delivery.attempts <= self.max_retries:
+            delay = min(self.retry_min_delay * 2 ** (delivery.attempts - 1), self.retry_max_delay)
+            # Jitter para que los reintentos de varios eventos no lleguen a la vez
+            wait_time = delay / 2 + random.uniform(0, delay / 2)
+            with self.condition:
+                if len(self.retries) >= self.max_queue_size:
+                    self.stats['dropped'] += 1
+                    NOTIFICATION_RESULTS.labels(self.name, 'dropped').inc()
+                    logging.warning(f"Webhook {self.name} retry queue is full. Dropping event {delivery.event.seq}.")
+                    return
+                heapq.heappush(self.retries, (time.monotonic() + wait_time, delivery.seq, delivery))
+                self.stats['retried'] += 1
+                self.condition.notify()
+            NOTIFICATION_RESULTS.labels(self.name, 'retried').inc()
+            logging.warning(f"Webhook {self.name} couldn't deliver event {delivery.event.seq} ({reason}). "
+                            f"Retrying in {wait_time:.2f}s.")
+            return
+        with self.condition:
+            self.stats['failed'] += 1
+        NOTIFICATION_RESULTS.labels(self.name, 'failed').inc()
+        logging.error(f"Webhook {self.name} couldn't deliver event {delivery.event.seq} after {delivery.attempts} "
+                      f"attempts: {reason}")
+
+    def __request__(self, payload: bytes) -> Tuple[Optional[int], Optional[Exception]]:
+        while True:
+            connection, reused = self.pool.acquire()
+            try:
+                connection.request(self.method, self.path, body=payload, headers=self.headers)
+            except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError) as e:
+                self.pool.release(connection, reusable=False)
+                if reused:
+                    # El servidor ha cerrado una conexión que estaba libre en el pool y la petición no ha llegado a
+                    # enviarse. Se repite con otra conexión sin contarlo como intento
+                    continue
+                return None, e
+            except (OSError, http.client.HTTPException) as e:
+                self.pool.release(connection, reusable=False)
+                return None, e
+            try:
+                response = connection.getresponse()
+                # La respuesta se lee entera para poder reutilizar la conexión
+                response.read()
+            except (OSError, http.client.HTTPException) as e:
+                # La petición ya se ha enviado y el servidor puede haberla procesado, así que cuenta como intento y se
+                # reintenta con backoff como cualquier otro fallo, aunque la conexión fuera reutilizada
+                self.pool.release(connection, reusable=False)
+                return None, e
+            self.pool.release(connection, reusable=not response.will_close)
+            return response.status, None
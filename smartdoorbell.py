@@ -1,40 +1,92 @@
-from datetime import datetime
 import logging
-import wiringpi
-import sys
+import os
+import socket
+import threading
+import time
+from functools import partial
+from typing import Dict
 
 import yaml
-from wiringpi import GPIO
 
-from network.mqtt.mqttclient import MqttClient, MqttLoopType
+from events.historyconf import HistoryConf
+from events.ringevent import RingEvent
+from events.ringeventqueryservice import RingEventQueryService
+from events.ringeventpublisher import RingEventPublisher
+from events.ringeventserializer import RingEventSerializer
+from events.ringeventstore import RingEventRecord
+from gpio.edgebuffer import EdgeBuffer
+from gpio.gpiobackend import GpioBackend, PinMode, PullMode, EdgeType
+from gpio.gpioconf import GpioConf
+from gpio.inputconf import InputConf
+from gpio.pressdetector import PressDetector, PressEvent
+from metrics.metricshttpserver import MetricsHttpServer
+from metrics.metricspublisher import MetricsPublisher
+from metrics.metricsregistry import DEFAULT_REGISTRY
 from network.mqtt.mqttconf import MqttConf
 from network.mqtt.mqttexceptions import NoMqttConfSection, NoMqttHostSection
+from network.mqtt.mqttclient import PublishOutcome
+from network.mqtt.mqttfanoutclient import MqttFanoutClient
+from network.mqtt.mqtttopic import MqttTopic
+from network.notify.notificationconf import NotificationConf
+from soundplayer.audioconf import AudioConf
+from soundplayer.playbackworker import PlaybackCommand
 from soundplayer.soundplayer import SoundPlayer
+from utils.configwatcher import ConfigWatcher
+from utils.logconf import LogConf
+from utils.logpipeline import LogPipeline
+from utils.readygate import ReadyGate
+from utils.startupreport import StartupReport
+from utils.supervisor import Supervisor
+from utils.systemdnotifier import SystemdNotifier
+
+STARTUP_SECONDS = DEFAULT_REGISTRY.gauge('doorbell_startup_seconds', 'Duration of each startup stage', ['stage'])
 
 
 class SmartDoorbell:
-    DEFAULT_LOG_FORMAT = "%(asctime)s - [%(levelname)s] - %(processName)s : %(threadName)s - %(funcName)s : %(filename)s : %(lineno)d - %(message)s"
-    DEFAULT_LOG_LEVEL = logging.INFO
-    LOG_LEVELS_DICT = {'error': logging.ERROR,
-                       'warning': logging.WARNING,
-                       'info': logging.INFO,
-                       'debug':logging.DEBUG}
+    DEFAULT_RELOAD_ENABLED = True
+    DEFAULT_RELOAD_INTERVAL = ConfigWatcher.DEFAULT_INTERVAL
+
+    DEFAULT_METRICS_HOST = MetricsHttpServer.DEFAULT_HOST
+    DEFAULT_METRICS_PUBLISH_INTERVAL = MetricsPublisher.DEFAULT_INTERVAL
 
-    DEFAULT_AUDIO_PATH = './data/sounds'
-    DEFAULT_AUDIO_VOLUME = 0.5
+    DEFAULT_SUPERVISOR_CHECK_INTERVAL = Supervisor.DEFAULT_CHECK_INTERVAL
+    DEFAULT_SUPERVISOR_WATCHDOG = True
 
-    DEFAULT_SWITCH_PIN = 10
+    # Tiempo máximo que close_context espera a que terminen las etapas de arranque. En modo síncrono la etapa de MQTT
+    # puede estar bloqueada en connect() hasta el timeout TCP del sistema si el broker no es accesible
+    STARTUP_CLOSE_TIMEOUT = 5.0
 
     def __init__(self, cfg_path: str = 'data/cfg/conf.yaml'):
+        self.startup_report = StartupReport()
+        self.cfg_path = cfg_path
         self.cfg = {}
+        self.mqtt_conf = None
         self.mqtt_client = None
-        with open(cfg_path) as cfg_file:
-            self.cfg = yaml.safe_load(cfg_file)
+        self.ring_event_publisher = None
+        with self.startup_report.stage('config'):
+            with open(cfg_path) as cfg_file:
+                self.cfg = yaml.safe_load(cfg_file)
 
-        self.__setup_logger__()
-        self.__setup_mqtt_client__()
-        self.__setup_gpio__()
-        self.__setup_audio__()
+            # Aquí solo se lee la configuración y se crean los objetos; lo lento (pygame, mixer, conexión al broker)
+            # se hace en init_context
+            self.__setup_logger__()
+            self.__setup_mqtt_client__()
+            self.__setup_audio__()
+            self.__setup_history__()
+            self.__setup_notifications__()
+            self.__setup_metrics__()
+            self.__setup_config_watcher__()
+
+        # Las pulsaciones que llegan mientras el audio o MQTT arrancan se retienen hasta que están listos
+        self.audio_gate = ReadyGate("SoundPlayer")
+        self.mqtt_gate = ReadyGate("MqttClient")
+        self.startup_threads = []
+        self.startup_lock = threading.Lock()
+        self.pending_stages = 0
+        # La captura de pulsaciones se arma lo primero: desde aquí los flancos quedan guardados en el EdgeBuffer
+        with self.startup_report.stage('gpio'):
+            self.__setup_gpio__()
+        self.__setup_supervisor__()
 
     def __enter__(self):
         self.init_context()
@@ -44,98 +96,441 @@ class SmartDoorbell:
         self.close_context()
 
     def __setup_logger__(self):
-        root = logging.getLogger()
-        hdlr = logging.StreamHandler()
-        logging_format = self.DEFAULT_LOG_FORMAT
-        level = self.DEFAULT_LOG_LEVEL
-        if 'logging' in self.cfg:
-            logging_cfg  = self.cfg['logging']
-            if 'format' in logging_cfg:
-                logging_format = logging_cfg['format']
-            else:
-                logging.warning("No logging format section into configuration file. Using default format.")
-            if 'level' in logging_cfg:
-                level_name = str(logging_cfg['level']).lower()
-                level = self.LOG_LEVELS_DICT[level_name] if level_name in self.LOG_LEVELS_DICT else self.DEFAULT_LOG_LEVEL
-            else:
-                logging.warning("No logging level section into configuration file. Using debug level.")
-        else:
-            logging.warning("No logging section into configuration file. Using default logging setup.")
-        hdlr.setFormatter(fmt=logging.Formatter(logging_format))
-        root.addHandler(hdlr)
-        root.setLevel(level)
+        # Los handlers de log se configuran a partir de la sección logging; en modo queued el formateo y la
+        # escritura se hacen fuera de los hilos de la pulsación
+        self.log_pipeline = LogPipeline(LogConf.create_from_dict(self.cfg))
+        self.log_pipeline.init_context()
 
     def __setup_mqtt_client__(self):
         try:
             self.mqtt_conf = MqttConf.create_from_dict(self.cfg)
-            self.mqtt_client = MqttClient(broker_url=self.mqtt_conf.url, loop_type=MqttLoopType.NO_LOOP)
-        except NoMqttConfSection | NoMqttHostSection as e:
+            # Un MqttClient por broker; los eventos se publican en todos ellos
+            self.mqtt_client = MqttFanoutClient.create_from_conf(self.mqtt_conf)
+            try:
+                serializer = RingEventSerializer.create_from_name(self.mqtt_conf.payload_format)
+            except ValueError:
+                logging.warning(f"Unknown mqtt payload format {self.mqtt_conf.payload_format}. Using "
+                                f"{MqttConf.DEFAULT_PAYLOAD_FORMAT}.")
+                serializer = RingEventSerializer.create_from_name(MqttConf.DEFAULT_PAYLOAD_FORMAT)
+            self.ring_event_publisher = RingEventPublisher(self.mqtt_client, serializer=serializer,
+                                                           batch_window_ms=self.mqtt_conf.batch_window_ms,
+                                                           max_batch_size=self.mqtt_conf.max_batch_size)
+        except (NoMqttConfSection, NoMqttHostSection) as e:
+            self.mqtt_conf = None
             logging.warning(str(e))
 
     def __setup_gpio__(self):
-        switch_pin = self.DEFAULT_SWITCH_PIN
-        if 'gpio' in self.cfg:
-            gpio_cfg = self.cfg['gpio']
-            if 'switch_pin' in gpio_cfg:
-                switch_pin = gpio_cfg['switch_pin']
-            else:
-                logging.warning("No gpio switch_pin in conf file. It's going to use default switch pin = {}"
-                                .format(self.DEFAULT_SWITCH_PIN))
-        else:
-            logging.warning("No gpio section in conf file. It's going to use default switch pin = {}"
-                            .format(self.DEFAULT_SWITCH_PIN))
+        self.gpio_conf = GpioConf.create_from_dict(self.cfg)
+        self.inputs = self.__create_inputs__(self.cfg, self.gpio_conf, self.audio_conf, self.mqtt_conf)
 
-        wiringpi.wiringPiSetupGpio()
-        wiringpi.pinMode(switch_pin, GPIO.INPUT)
-        wiringpi.pullUpDnControl(switch_pin, wiringpi.GPIO.PUD_UP)
-        wiringpi.wiringPiISR(switch_pin, wiringpi.GPIO.INT_EDGE_RISING, self.__button_callback__)
+        # Todas las entradas comparten el mismo buffer de flancos y el mismo hilo de detección
+        self.edge_buffer = EdgeBuffer()
+        self.press_detector = PressDetector(self.edge_buffer, is_pressed=self.__is_pressed__,
+                                            debounce_ms=self.gpio_conf.debounce_ms,
+                                            long_press_ms=self.gpio_conf.long_press_ms,
+                                            double_press_ms=self.gpio_conf.double_press_ms)
+        self.press_detector.add_handler(self.__on_press__)
+
+        self.gpio_backend = GpioBackend.create_from_name(self.gpio_conf.backend)
+        self.gpio_backend.setup()
+        for source, input_conf in enumerate(self.inputs):
+            logging.info(f"Setting up {input_conf}")
+            self.gpio_backend.pin_mode(input_conf.pin, PinMode.INPUT)
+            self.gpio_backend.pull_up_dn_control(input_conf.pin, PullMode.UP if input_conf.active_low
+                                                 else PullMode.DOWN)
+            # La ISR solo guarda el instante del flanco; el antirrebote y la clasificación se hacen en PressDetector
+            self.gpio_backend.isr(input_conf.pin, EdgeType.BOTH,
+                                  lambda source=source: self.edge_buffer.push(source, time.monotonic_ns()))
+
+    @staticmethod
+    def __create_inputs__(cfg, gpio_conf: GpioConf, audio_conf: AudioConf, mqtt_conf: MqttConf):
+        # Si no hay lista de entradas se usa una única entrada con la configuración de gpio, audio y mqtt
+        default_input = InputConf(name="default", pin=gpio_conf.switch_pin, active_low=gpio_conf.active_low,
+                                  audio_path=audio_conf.path, volume=None,
+                                  topic=mqtt_conf.topic if mqtt_conf is not None else None)
+        return InputConf.create_list_from_dict(cfg, default_input)
+
+    def __is_pressed__(self, source: int):
+        input_conf = self.inputs[source]
+        return (self.gpio_backend.digital_read(input_conf.pin) == 0) == input_conf.active_low
 
     def __setup_audio__(self):
-        self.sound_player = SoundPlayer()
-        self.audio_path = self.DEFAULT_AUDIO_PATH
-        self.audio_volume = self.DEFAULT_AUDIO_VOLUME
-
-        if 'audio' in self.cfg:
-            audio_cfg = self.cfg['audio']
-            if 'path' in audio_cfg:
-                self.audio_path = audio_cfg['path']
-            else:
-                logging.warning("No audio path in conf file. It's going to use default path = {}"
-                                .format(self.DEFAULT_AUDIO_PATH))
-            if 'volume' in audio_cfg:
-                self.audio_volume = audio_cfg['volume']
-            else:
-                logging.warning("No audio volume in conf file. It's going to use default volume = {}"
-                                .format(self.DEFAULT_AUDIO_VOLUME))
-        else:
-            logging.warning("No audio section in conf file. It's going to use default values. Sounds path = {}, "
-                            "Volume = {}".format(self.DEFAULT_AUDIO_PATH, self.DEFAULT_AUDIO_VOLUME))
-        self.sound_player.set_volume(self.audio_volume)
-
-    def __button_callback__(self):
-        logging.debug("Button pressed!")
-        self.sound_player.play_sound(self.audio_path)
+        self.audio_conf = AudioConf.create_from_dict(self.cfg)
+        self.sound_player = SoundPlayer(cache_size=self.audio_conf.get_cache_size(),
+                                        preload_path=self.audio_conf.path if self.audio_conf.preload else None,
+                                        shuffle_bag=self.audio_conf.shuffle, policy=self.audio_conf.policy,
+                                        max_queue_size=self.audio_conf.queue_size,
+                                        transcode_cache=self.audio_conf.create_transcode_cache(),
+                                        channels=self.audio_conf.channels,
+                                        stream_threshold=self.audio_conf.get_stream_threshold())
+        self.sound_player.set_volume(self.audio_conf.volume)
+
+    def __setup_history__(self):
+        self.event_store = None
+        self.query_service = None
+        self.history_conf = HistoryConf.create_from_dict(self.cfg)
+        if self.history_conf is None:
+            return
+        self.event_store = self.history_conf.create_event_store()
+        if self.history_conf.query_topic is None:
+            return
+        if self.mqtt_client is None:
+            logging.warning("History query_topic is configured but there is no MQTT broker. History queries won't be "
+                            "served.")
+            return
+        self.query_service = RingEventQueryService(self.event_store, self.mqtt_client,
+                                                   query_topic=self.history_conf.query_topic,
+                                                   response_topic=self.history_conf.response_topic,
+                                                   max_results=self.history_conf.max_results)
+
+    def __setup_notifications__(self):
+        self.notification_dispatcher = None
+        notification_conf = NotificationConf.create_from_dict(self.cfg)
+        if notification_conf is not None:
+            self.notification_dispatcher = notification_conf.create_dispatcher()
+
+    def __setup_config_watcher__(self):
+        self.config_watcher = None
+        reload_cfg = self.cfg.get('reload') or {}
+        if not bool(reload_cfg.get('enabled', self.DEFAULT_RELOAD_ENABLED)):
+            return
+        self.config_watcher = ConfigWatcher(self.cfg_path, on_change=self.__reload_config__,
+                                            interval=float(reload_cfg.get('interval', self.DEFAULT_RELOAD_INTERVAL)))
+
+    def __setup_supervisor__(self):
+        supervisor_cfg = self.cfg.get('supervisor') or {}
+        notifier = SystemdNotifier() if bool(supervisor_cfg.get('watchdog', self.DEFAULT_SUPERVISOR_WATCHDOG)) \
+            else None
+        self.supervisor = Supervisor(
+            check_interval=float(supervisor_cfg.get('check_interval', self.DEFAULT_SUPERVISOR_CHECK_INTERVAL)),
+            notifier=notifier,
+            min_restart_delay=float(supervisor_cfg.get('min_restart_delay', Supervisor.DEFAULT_MIN_RESTART_DELAY)),
+            max_restart_delay=float(supervisor_cfg.get('max_restart_delay', Supervisor.DEFAULT_MAX_RESTART_DELAY)))
+        # Cada subsistema se reinicia por separado; los hilos avisan al supervisor si mueren
+        self.supervisor.add_subsystem('audio', self.__is_audio_healthy__, self.__restart_audio__)
+        self.sound_player.playback_worker.on_failure = lambda: self.supervisor.report_failure('audio')
+        self.supervisor.add_subsystem('gpio', self.press_detector.is_alive, self.__restart_gpio__)
+        self.press_detector.on_failure = lambda: self.supervisor.report_failure('gpio')
         if self.mqtt_client is not None:
-            self.mqtt_client.publish(topic=self.mqtt_conf.topic, payload=str(datetime.now()))
-        wiringpi.delay(200)
+            self.supervisor.add_subsystem('mqtt', self.__is_mqtt_healthy__, self.__restart_mqtt__)
+            self.mqtt_client.set_on_failure(lambda: self.supervisor.report_failure('mqtt'))
+        if self.event_store is not None:
+            self.supervisor.add_subsystem('history', self.event_store.is_healthy, self.__restart_history__)
+        if self.notification_dispatcher is not None:
+            self.supervisor.add_subsystem('notifications', self.notification_dispatcher.is_healthy,
+                                          self.notification_dispatcher.restart_unhealthy)
+
+    def __is_starting__(self, stage_name: str):
+        # Un subsistema que todavía está arrancando no se considera caído
+        return any(thread.name == f"Startup-{stage_name}" and thread.is_alive() for thread in self.startup_threads)
+
+    def __is_audio_healthy__(self):
+        return self.__is_starting__('audio') or (self.audio_gate.ready and self.sound_player.is_healthy())
+
+    def __restart_audio__(self):
+        self.sound_player.close_context()
+        self.__start_audio__()
+
+    def __is_mqtt_healthy__(self):
+        return self.__is_starting__('mqtt') or (self.mqtt_gate.ready and self.mqtt_client.is_healthy() and
+                                                self.ring_event_publisher.is_healthy())
+
+    def __restart_mqtt__(self):
+        if not self.mqtt_gate.ready:
+            # El arranque falló: se repite entero
+            if self.query_service is not None:
+                self.query_service.close_context()
+            self.ring_event_publisher.close_context()
+            self.mqtt_client.close_context()
+            self.__start_mqtt__()
+            return
+        self.mqtt_client.restart_unhealthy()
+        if not self.ring_event_publisher.is_healthy():
+            self.ring_event_publisher.close_context()
+            self.ring_event_publisher.init_context()
+
+    def __restart_history__(self):
+        self.event_store.close_context()
+        self.event_store.init_context()
+
+    def __restart_gpio__(self):
+        # Las ISR siguen registradas y guardando flancos en el EdgeBuffer; solo hay que volver a lanzar el detector
+        self.press_detector.stop()
+        self.press_detector.start()
+
+    def __setup_metrics__(self):
+        self.metrics_server = None
+        self.metrics_publisher = None
+        threads = DEFAULT_REGISTRY.gauge('doorbell_threads', 'Live threads in the process')
+        threads.set_function(threading.active_count)
+        if self.mqtt_client is not None:
+            mqtt_queue_depth = DEFAULT_REGISTRY.gauge('doorbell_mqtt_queue_depth',
+                                                      'Messages waiting to be published to the broker', ['broker'])
+            for broker_conf, client in self.mqtt_client.clients:
+                mqtt_queue_depth.labels(broker_conf.name).set_function(lambda client=client: len(client.outbound_queue))
+        if 'metrics' not in self.cfg:
+            return
+        metrics_cfg = self.cfg['metrics']
+        if 'http_port' in metrics_cfg:
+            self.metrics_server = MetricsHttpServer(host=metrics_cfg.get('http_host', self.DEFAULT_METRICS_HOST),
+                                                    port=int(metrics_cfg['http_port']))
+        if 'mqtt_topic' in metrics_cfg:
+            if self.mqtt_client is None:
+                logging.warning("Metrics mqtt_topic is configured but there is no MQTT broker. Metrics won't be "
+                                "published.")
+            else:
+                interval = float(metrics_cfg.get('publish_interval', self.DEFAULT_METRICS_PUBLISH_INTERVAL))
+                self.metrics_publisher = MetricsPublisher(self.mqtt_client,
+                                                          MqttTopic.create_from_cfg(metrics_cfg['mqtt_topic']),
+                                                          interval=interval)
+
+    def __on_press__(self, event: PressEvent):
+        input_conf = self.inputs[event.source]
+        publish = self.mqtt_client is not None and input_conf.topic is not None
+        ring_event = None
+        record = None
+        if publish or self.event_store is not None or self.notification_dispatcher is not None:
+            # El evento se crea al detectar la pulsación para que su hora no dependa de cuándo esté listo MQTT
+            device_id = self.mqtt_conf.device_id if self.mqtt_conf is not None else socket.gethostname()
+            ring_event = RingEvent.create_from_press(device_id, input_conf.name, input_conf.pin, event)
+        if self.event_store is not None:
+            # Solo se encola la escritura; el sonido y el resultado de la publicación se completan cuando se conocen
+            record = self.event_store.record(ring_event)
+        self.audio_gate.call(self.sound_player.play_sound, input_conf.audio_path, volume=input_conf.volume,
+                             priority=input_conf.priority, policy=input_conf.policy,
+                             on_done=partial(self.__on_sound_done__, record) if record is not None else None)
+        if publish:
+            self.mqtt_gate.call(self.ring_event_publisher.publish, input_conf.topic, ring_event,
+                                on_result=partial(self.__on_published__, record) if record is not None else None)
+        if self.notification_dispatcher is not None:
+            # Solo se encola en cada sink; los webhooks y el socket se atienden en sus propios hilos
+            self.notification_dispatcher.notify(ring_event)
+
+    def __on_sound_done__(self, record: RingEventRecord, command: PlaybackCommand):
+        self.event_store.set_sound(record, command.played_path, played=command.started_at is not None)
+
+    def __on_published__(self, record: RingEventRecord, results: Dict[str, PublishOutcome]):
+        # Resultado por broker, por ejemplo "local=PUBLISHED remote=JOURNALED"
+        publish_result = ' '.join(f"{name}={outcome.name}" for name, outcome in sorted(results.items()))
+        self.event_store.set_publish_result(record, publish_result or None)
 
     def init_context(self):
-        self.mqtt_client.init_context()
+        if self.event_store is not None:
+            with self.startup_report.stage('history'):
+                self.event_store.init_context()
+        if self.notification_dispatcher is not None:
+            with self.startup_report.stage('notifications'):
+                self.notification_dispatcher.init_context()
+        with self.startup_report.stage('detector'):
+            self.press_detector.start()
+        # El audio y MQTT arrancan en paralelo y sin bloquear: un broker inaccesible no retrasa el timbre
+        stages = [('audio', self.__start_audio__)]
+        if self.mqtt_client is not None:
+            stages.append(('mqtt', self.__start_mqtt__))
+        self.pending_stages = len(stages)
+        for name, target in stages:
+            thread = threading.Thread(name=f"Startup-{name}", target=self.__run_startup_stage__, args=(name, target),
+                                      daemon=True)
+            self.startup_threads.append(thread)
+            thread.start()
+        with self.startup_report.stage('metrics'):
+            if self.metrics_server is not None:
+                self.metrics_server.init_context()
+            if self.metrics_publisher is not None:
+                self.metrics_publisher.init_context()
+        if self.config_watcher is not None:
+            self.config_watcher.init_context()
+
+    def wait_ready(self, timeout: float = None) -> bool:
+        # Devuelve si han terminado todas las etapas de arranque. El timeout es para todas, no para cada una
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for thread in self.startup_threads:
+            thread.join(max(deadline - time.monotonic(), 0) if deadline is not None else None)
+        return not any(thread.is_alive() for thread in self.startup_threads)
+
+    def __start_audio__(self):
         self.sound_player.init_context()
+        self.__build_file_indexes__()
+        self.audio_gate.open()
+        if self.sound_player.transcode_cache is not None:
+            # La transcodificación de la biblioteca puede tardar bastante la primera vez, así que no retrasa el
+            # arranque. Mientras tanto, los sonidos que se reproducen se transcodifican al pedirlos
+            threading.Thread(target=self.__prepare_sounds__, name="SoundTranscoder", daemon=True).start()
+
+    def __prepare_sounds__(self):
+        for audio_path in {input_conf.audio_path for input_conf in self.inputs}:
+            self.sound_player.prepare_sounds(audio_path)
+        self.sound_player.transcode_cache.purge()
+
+    def __build_file_indexes__(self):
+        for input_conf in self.inputs:
+            if os.path.isdir(input_conf.audio_path):
+                # El índice de sonidos se construye antes de que se use para que la pulsación no pague su coste
+                self.sound_player.get_file_index(input_conf.audio_path)
+
+    def __start_mqtt__(self):
+        if self.query_service is not None:
+            # Las suscripciones se registran antes de conectar para que se hagan al recibir el CONNACK
+            self.query_service.init_context()
+        self.mqtt_client.init_context()
+        self.ring_event_publisher.init_context()
+        self.mqtt_gate.open()
+
+    def __run_startup_stage__(self, name: str, target):
+        try:
+            with self.startup_report.stage(name):
+                target()
+        except Exception as e:
+            logging.exception(f"Startup stage {name} failed: {str(e)}")
+        with self.startup_lock:
+            self.pending_stages -= 1
+            finished = self.pending_stages == 0
+        if finished:
+            for stage_name, _, duration in self.startup_report.get_report():
+                if duration is not None:
+                    STARTUP_SECONDS.labels(stage_name).set(duration)
+            self.startup_report.log_report()
 
     def close_context(self):
-        self.mqtt_client.close_context()
-        self.sound_player.close_context()
+        self.supervisor.stop()
+        if self.config_watcher is not None:
+            self.config_watcher.close_context()
+        if not self.wait_ready(timeout=self.STARTUP_CLOSE_TIMEOUT):
+            # Lo que sigue arrancando no se cierra: su hilo es daemon y no retiene la salida del proceso
+            logging.warning(f"Startup stages still running after {self.STARTUP_CLOSE_TIMEOUT}s: " +
+                            ', '.join(thread.name for thread in self.startup_threads if thread.is_alive()))
+        if self.metrics_publisher is not None:
+            self.metrics_publisher.close_context()
+        if self.metrics_server is not None:
+            self.metrics_server.close_context()
+        self.press_detector.stop()
+        if self.mqtt_client is not None and not self.__is_starting__('mqtt'):
+            # Los lotes pendientes se envían antes de cerrar la conexión
+            if self.query_service is not None:
+                self.query_service.close_context()
+            self.ring_event_publisher.close_context()
+            self.mqtt_client.close_context()
+        if self.notification_dispatcher is not None:
+            self.notification_dispatcher.close_context()
+        if not self.__is_starting__('audio'):
+            self.sound_player.close_context()
+        if self.event_store is not None:
+            # Se cierra lo último para guardar el resultado de lo que se ha publicado o reproducido al cerrar
+            self.event_store.close_context()
+        # Se escriben los mensajes que queden en la cola de log
+        self.log_pipeline.close_context()
+
+    def __reload_config__(self, cfg):
+        logging.info(f"Configuration file {self.cfg_path} changed. Applying changes.")
+        # Primero se crea toda la configuración nueva; si algo no es válido no se aplica ningún cambio
+        try:
+            audio_conf = AudioConf.create_from_dict(cfg)
+            gpio_conf = GpioConf.create_from_dict(cfg)
+            try:
+                mqtt_conf = MqttConf.create_from_dict(cfg)
+            except (NoMqttConfSection, NoMqttHostSection):
+                mqtt_conf = None
+            inputs = self.__create_inputs__(cfg, gpio_conf, audio_conf, mqtt_conf)
+            log_conf = LogConf.create_from_dict(cfg)
+        except Exception as e:
+            logging.error(f"Configuration file {self.cfg_path} isn't valid. Changes are ignored: {str(e)}")
+            return
+
+        if not self.log_pipeline.update(log_conf):
+            logging.warning("Changes in logging queue or file need a restart to be applied.")
+        self.__reload_audio__(audio_conf)
+        self.__reload_mqtt__(mqtt_conf)
+        self.__reload_gpio__(gpio_conf, inputs)
+        self.__build_file_indexes__()
+        for section in ('metrics', 'reload', 'supervisor', 'history', 'notifications'):
+            if cfg.get(section) != self.cfg.get(section):
+                logging.warning(f"Changes in section {section} need a restart to be applied.")
+        self.cfg = cfg
+
+    def __reload_audio__(self, audio_conf: AudioConf):
+        old_conf = self.audio_conf
+        if audio_conf.volume != old_conf.volume:
+            self.sound_player.set_volume(audio_conf.volume)
+        if audio_conf.policy != old_conf.policy or audio_conf.queue_size != old_conf.queue_size:
+            self.sound_player.set_policy(audio_conf.policy, audio_conf.queue_size)
+        if audio_conf.cache_size_mb != old_conf.cache_size_mb:
+            self.sound_player.set_cache_size(audio_conf.get_cache_size())
+        if audio_conf.shuffle != old_conf.shuffle:
+            self.sound_player.set_shuffle_bag(audio_conf.shuffle)
+        if audio_conf.stream_threshold_kb != old_conf.stream_threshold_kb:
+            self.sound_player.set_stream_threshold(audio_conf.get_stream_threshold())
+        if (audio_conf.transcode_path, audio_conf.normalize, audio_conf.target_dbfs) != \
+                (old_conf.transcode_path, old_conf.normalize, old_conf.target_dbfs):
+            logging.warning("Changes in audio transcode need a restart to be applied.")
+        if audio_conf.channels != old_conf.channels:
+            logging.warning("Changes in audio channels need a restart to be applied.")
+        self.audio_conf = audio_conf
+
+    def __reload_mqtt__(self, mqtt_conf: MqttConf):
+        if (mqtt_conf is None) != (self.mqtt_client is None):
+            logging.warning("Adding or removing the MQTT broker needs a restart to be applied.")
+            return
+        if mqtt_conf is None:
+            return
+        old_conf = self.mqtt_conf
+        self.mqtt_conf = mqtt_conf
+        for _, client in self.mqtt_client.clients:
+            client.max_queue_size = mqtt_conf.queue_size
+            client.reconnect_min_delay = mqtt_conf.reconnect_min_delay
+            client.reconnect_max_delay = mqtt_conf.reconnect_max_delay
+
+        if (mqtt_conf.payload_format, mqtt_conf.batch_window_ms, mqtt_conf.max_batch_size) != \
+                (old_conf.payload_format, old_conf.batch_window_ms, old_conf.max_batch_size):
+            try:
+                serializer = RingEventSerializer.create_from_name(mqtt_conf.payload_format)
+            except ValueError:
+                logging.warning(f"Unknown mqtt payload format {mqtt_conf.payload_format}. Keeping the current one.")
+                serializer = self.ring_event_publisher.serializer
+            # Se cierra el publicador para enviar los lotes pendientes con el formato anterior
+            self.ring_event_publisher.close_context()
+            self.ring_event_publisher.serializer = serializer
+            self.ring_event_publisher.batch_window = mqtt_conf.batch_window_ms / 1000
+            self.ring_event_publisher.max_batch_size = mqtt_conf.max_batch_size
+            self.ring_event_publisher.init_context()
+
+        if (mqtt_conf.async_publish, mqtt_conf.journal_path, mqtt_conf.callback_workers) != \
+                (old_conf.async_publish, old_conf.journal_path, old_conf.callback_workers):
+            logging.warning("Changes in mqtt async_publish, journal or callbacks need a restart to be applied.")
+        if (mqtt_conf.client_id, mqtt_conf.persistent_session, mqtt_conf.keepalive) != \
+                (old_conf.client_id, old_conf.persistent_session, old_conf.keepalive):
+            logging.warning("Changes in mqtt client_id, persistent_session or keepalive need a restart to be "
+                            "applied.")
+
+        if [broker.name for broker in mqtt_conf.brokers] != self.mqtt_client.get_broker_names():
+            logging.warning("Adding, removing or renaming MQTT brokers needs a restart to be applied. Other broker "
+                            "settings are applied to the brokers that already exist.")
+        # Solo se reconecta un broker si cambian sus datos de conexión; los topics nuevos se usan en la siguiente
+        # pulsación
+        for broker_conf in mqtt_conf.brokers:
+            self.mqtt_client.update_broker(broker_conf)
+
+    def __reload_gpio__(self, gpio_conf: GpioConf, inputs):
+        old_conf = self.gpio_conf
+        if (gpio_conf.debounce_ms, gpio_conf.long_press_ms, gpio_conf.double_press_ms) != \
+                (old_conf.debounce_ms, old_conf.long_press_ms, old_conf.double_press_ms):
+            self.press_detector.set_timings(gpio_conf.debounce_ms, gpio_conf.long_press_ms, gpio_conf.double_press_ms)
+        if gpio_conf.backend != old_conf.backend or [i.pin for i in inputs] != [i.pin for i in self.inputs]:
+            # Las ISR no se pueden quitar una vez registradas, así que los pines nuevos necesitan reiniciar
+            logging.warning("Changes in gpio backend or input pins need a restart to be applied. Other input "
+                            "settings are kept as they were.")
+            self.gpio_conf = gpio_conf
+            return
+        for old_input, new_input in zip(self.inputs, inputs):
+            if new_input.active_low != old_input.active_low:
+                self.gpio_backend.pull_up_dn_control(new_input.pin, PullMode.UP if new_input.active_low
+                                                     else PullMode.DOWN)
+        # Se cambia la lista entera de una vez: __on_press__ siempre ve una configuración completa
+        self.inputs = inputs
+        self.gpio_conf = gpio_conf
 
     def loop(self):
         logging.info("****************** Starting MP3 Doorbell ******************")
-        while True:
-            try:
-                wiringpi.delay(2000)
-            except KeyboardInterrupt:
-                logging.info("\nexit")
-                sys.exit(0)
-            except Exception as e:
-                logging.exception(str(e))
-                sys.exit(-1)
+        # El hilo principal queda bloqueado hasta que llega SIGTERM o SIGINT o falla un subsistema; no hace polling
+        self.supervisor.run()
+        logging.info("exit")
 
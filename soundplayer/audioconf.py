@@ -0,0 +1,94 @@
+import logging
+from dataclasses import dataclass
+
+from soundplayer.playbackworker import CoalescePolicy, PlaybackWorker
+from soundplayer.transcodecache import TranscodeCache
+
+
+@dataclass
+class AudioConf:
+    DEFAULT_PATH = './data/sounds'
+    DEFAULT_VOLUME = 0.5
+    DEFAULT_CACHE_SIZE_MB = 32
+    DEFAULT_PRELOAD = False
+    DEFAULT_SHUFFLE = False
+    DEFAULT_POLICY = CoalescePolicy.LATEST_WINS
+    DEFAULT_QUEUE_SIZE = PlaybackWorker.DEFAULT_MAX_QUEUE_SIZE
+    DEFAULT_CHANNELS = 4
+    DEFAULT_STREAM_THRESHOLD_KB = 1024
+    DEFAULT_NORMALIZE = False
+    DEFAULT_TARGET_DBFS = TranscodeCache.DEFAULT_TARGET_DBFS
+
+    path: str = DEFAULT_PATH
+    volume: float = DEFAULT_VOLUME
+    cache_size_mb: float = DEFAULT_CACHE_SIZE_MB
+    preload: bool = DEFAULT_PRELOAD
+    shuffle: bool = DEFAULT_SHUFFLE
+    policy: CoalescePolicy = DEFAULT_POLICY
+    queue_size: int = DEFAULT_QUEUE_SIZE
+    channels: int = DEFAULT_CHANNELS
+    # Los ficheros más grandes se reproducen en streaming en vez de decodificarse enteros. 0 lo desactiva
+    stream_threshold_kb: float = DEFAULT_STREAM_THRESHOLD_KB
+    transcode_path: str = None
+    normalize: bool = DEFAULT_NORMALIZE
+    target_dbfs: float = DEFAULT_TARGET_DBFS
+
+    def get_cache_size(self) -> int:
+        return int(self.cache_size_mb * 1024 * 1024)
+
+    def get_stream_threshold(self) -> int:
+        return int(self.stream_threshold_kb * 1024)
+
+    def create_transcode_cache(self) -> TranscodeCache:
+        if self.transcode_path is None:
+            return None
+        return TranscodeCache(cache_dir=self.transcode_path, normalize=self.normalize, target_dbfs=self.target_dbfs)
+
+    @staticmethod
+    def create_from_dict(cfg) -> 'AudioConf':
+        audio_conf = AudioConf()
+        if 'audio' not in cfg:
+            logging.warning("No audio section in conf file. It's going to use default values. Sounds path = {}, "
+                            "Volume = {}".format(AudioConf.DEFAULT_PATH, AudioConf.DEFAULT_VOLUME))
+            return audio_conf
+
+        audio_cfg = cfg['audio']
+        if 'path' in audio_cfg:
+            audio_conf.path = audio_cfg['path']
+        else:
+            logging.warning("No audio path in conf file. It's going to use default path = {}"
+                            .format(AudioConf.DEFAULT_PATH))
+        if 'volume' in audio_cfg:
+            audio_conf.volume = audio_cfg['volume']
+        else:
+            logging.warning("No audio volume in conf file. It's going to use default volume = {}"
+                            .format(AudioConf.DEFAULT_VOLUME))
+        if 'cache_size_mb' in audio_cfg:
+            audio_conf.cache_size_mb = audio_cfg['cache_size_mb']
+        if 'preload' in audio_cfg:
+            audio_conf.preload = bool(audio_cfg['preload'])
+        if 'shuffle' in audio_cfg:
+            audio_conf.shuffle = bool(audio_cfg['shuffle'])
+        if 'policy' in audio_cfg:
+            try:
+                audio_conf.policy = CoalescePolicy.create_from_str(audio_cfg['policy'])
+            except KeyError:
+                logging.warning("Unknown audio policy {} in conf file. It's going to use default policy = {}"
+                                .format(audio_cfg['policy'], AudioConf.DEFAULT_POLICY.name.lower()))
+        if 'queue_size' in audio_cfg:
+            audio_conf.queue_size = int(audio_cfg['queue_size'])
+        if 'channels' in audio_cfg:
+            audio_conf.channels = max(1, int(audio_cfg['channels']))
+        if 'stream_threshold_kb' in audio_cfg:
+            audio_conf.stream_threshold_kb = max(0, float(audio_cfg['stream_threshold_kb'] or 0))
+        if 'transcode' in audio_cfg:
+            transcode_cfg = audio_cfg['transcode']
+            if 'path' in transcode_cfg:
+                audio_conf.transcode_path = transcode_cfg['path']
+            else:
+                logging.warning("No audio transcode path in conf file. Transcode cache is disabled.")
+            if 'normalize' in transcode_cfg:
+                audio_conf.normalize = bool(transcode_cfg['normalize'])
+            if 'target_dbfs' in transcode_cfg:
+                audio_conf.target_dbfs = float(transcode_cfg['target_dbfs'])
+        return audio_conf
@@ -0,0 +1,87 @@
+import logging
+import os
+import struct
+import wave
+from typing import Optional
+
+# Tablas de las cabeceras de MPEG audio layer III
+MP3_BITRATES_KBPS = {1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+                     2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160]}
+MP3_SAMPLE_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 2.5: [11025, 12000, 8000]}
+MP3_HEADER_SEARCH_BYTES = 64 * 1024
+
+
+class MusicStream:
+    # Adapta pygame.mixer.music al interfaz de mixer.Channel (get_busy, stop, set_volume) para que SoundPlayer trate
+    # el stream como un canal más. El fichero se decodifica por trozos mientras suena, así que empieza casi al
+    # instante y solo ocupa el buffer del decodificador. Solo hay un stream, de modo que un sonido nuevo sustituye
+    # al anterior
+
+    def play(self, sound_path: str):
+        from pygame import mixer
+        mixer.music.load(sound_path)
+        mixer.music.play()
+
+    def get_busy(self) -> bool:
+        from pygame import mixer
+        return mixer.get_init() is not None and mixer.music.get_busy()
+
+    def stop(self):
+        from pygame import mixer
+        mixer.music.stop()
+        # Cierra el fichero y libera el decodificador
+        mixer.music.unload()
+
+    def set_volume(self, volume: float):
+        from pygame import mixer
+        mixer.music.set_volume(volume)
+
+
+def estimate_duration(sound_path: str) -> Optional[float]:
+    # mixer.music no da la duración del fichero. Se calcula a partir de la cabecera sin decodificar el audio: exacta
+    # en los WAV y en los MP3 con cabecera Xing/Info, y aproximada (tasa de bits constante) en el resto de MP3.
+    # Devuelve None si no se puede calcular
+    try:
+        if sound_path.lower().endswith('.wav'):
+            with wave.open(sound_path, 'rb') as wav_file:
+                return wav_file.getnframes() / wav_file.getframerate()
+        if sound_path.lower().endswith('.mp3'):
+            return estimate_mp3_duration(sound_path)
+    except (OSError, EOFError, IndexError, wave.Error, struct.error) as e:
+        logging.debug("Duration of %s couldn't be estimated: %s", sound_path, e)
+    return None
+
+
+def estimate_mp3_duration(sound_path: str) -> Optional[float]:
+    with open(sound_path, 'rb') as sound_file:
+        data = sound_file.read(MP3_HEADER_SEARCH_BYTES)
+    audio_start = 0
+    if data[:3] == b'ID3':
+        # Tamaño de la etiqueta ID3v2 en enteros de 7 bits, sin contar los 10 bytes de su cabecera
+        audio_start = 10 + ((data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9])
+        with open(sound_path, 'rb') as sound_file:
+            sound_file.seek(audio_start)
+            data = sound_file.read(MP3_HEADER_SEARCH_BYTES)
+    for indx in range(len(data) - 4):
+        if data[indx] != 0xFF or data[indx + 1] & 0xE0 != 0xE0:
+            continue
+        version = {3: 1, 2: 2, 0: 2.5}.get((data[indx + 1] >> 3) & 0x03)
+        layer = (data[indx + 1] >> 1) & 0x03
+        bitrate_indx = data[indx + 2] >> 4
+        sample_rate_indx = (data[indx + 2] >> 2) & 0x03
+        if version is None or layer != 1 or bitrate_indx in (0, 15) or sample_rate_indx == 3:
+            continue
+        bitrate = MP3_BITRATES_KBPS[1 if version == 1 else 2][bitrate_indx] * 1000
+        sample_rate = MP3_SAMPLE_RATES[version][sample_rate_indx]
+        samples_per_frame = 1152 if version == 1 else 576
+        # Los MP3 de tasa variable llevan en el primer frame una cabecera Xing o Info con el número de frames
+        frame = data[indx:indx + 200]
+        for tag in (b'Xing', b'Info'):
+            tag_indx = frame.find(tag)
+            if tag_indx >= 0 and len(frame) >= tag_indx + 12:
+                flags = struct.unpack('>I', frame[tag_indx + 4:tag_indx + 8])[0]
+                if flags & 0x01:
+                    frames = struct.unpack('>I', frame[tag_indx + 8:tag_indx + 12])[0]
+                    return frames * samples_per_frame / sample_rate
+        return (os.path.getsize(sound_path) - audio_start - indx) * 8 / bitrate
+    return None
@@ -0,0 +1,332 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from enum import Enum
+from typing import Callable, List
+
+from metrics.metricsregistry import DEFAULT_REGISTRY
+
+SOUND_START_SECONDS = DEFAULT_REGISTRY.histogram('doorbell_sound_start_seconds',
+                                                 'Time from a play request to the sound starting')
+PLAYBACK_DROPPED = DEFAULT_REGISTRY.counter('doorbell_playback_dropped_total',
+                                            'Play requests dropped by the coalescing policy')
+PLAYBACK_QUEUE_WAIT_SECONDS = DEFAULT_REGISTRY.histogram('doorbell_playback_queue_wait_seconds',
+                                                         'Time a play request waits in the playback queue',
+                                                         ['policy'])
+
+
+class PlaybackCommandType(Enum):
+    PLAY = 0
+    STOP = 1
+    SET_VOLUME = 2
+
+# Nombres alternativos de las políticas que se aceptan en la configuración
+POLICY_ALIASES = {'INTERRUPT': 'LATEST_WINS', 'IGNORE_IF_BUSY': 'DROP_WHILE_BUSY', 'ENQUEUE': 'QUEUE'}
+
+
+class CoalescePolicy(Enum):
+    # Las políticas solo afectan a los sonidos de prioridad igual o menor; un sonido de mayor prioridad nunca se
+    # interrumpe ni se retrasa por uno de menor prioridad
+    LATEST_WINS = 0  # Una pulsación nueva descarta las pendientes e interrumpe el sonido actual
+    DROP_WHILE_BUSY = 1  # Las pulsaciones que llegan mientras suena algo se descartan
+    QUEUE = 2  # Las pulsaciones se reproducen en orden, cada una cuando termina la anterior
+    OVERLAP = 3  # El sonido se mezcla con los que ya están sonando en un canal libre
+
+    @staticmethod
+    def create_from_str(policy_name: str):
+        policy_name = str(policy_name).upper().replace('-', '_')
+        return CoalescePolicy[POLICY_ALIASES.get(policy_name, policy_name)]
+
+
+
+@dataclass
+class PlaybackCommand:
+    command_type: PlaybackCommandType
+    sound_path: str = None
+    volume: float = None
+    priority: int = 0
+    policy: CoalescePolicy = None
+    enqueued_at: float = None
+    dequeued_at: float = None
+    started_at: float = None
+    channel: int = None
+    dropped: bool = False
+    # Fichero que ha sonado de verdad; con una carpeta de sonidos es el que se ha elegido al reproducir
+    played_path: str = None
+    # Se llama con el comando cuando se ha ejecutado o descartado. Se ejecuta en el hilo del worker, así que debe
+    # ser rápido
+    on_done: Callable[['PlaybackCommand'], None] = None
+
+    def get_start_latency(self):
+        if self.enqueued_at is None or self.started_at is None:
+            return None
+        return self.started_at - self.enqueued_at
+
+    def get_queue_wait(self):
+        if self.enqueued_at is None or self.dequeued_at is None:
+            return None
+        return self.dequeued_at - self.enqueued_at
+
+    def __repr__(self):
+        policy = self.policy.name if self.policy is not None else None
+        return f"PlaybackCommand[type = {self.command_type.name}, sound_path = {self.sound_path}, " \
+               f"volume = {self.volume}, priority = {self.priority}, policy = {policy}, channel = {self.channel}, " \
+               f"queue_wait = {self.get_queue_wait()}, start_latency = {self.get_start_latency()}, " \
+               f"dropped = {self.dropped}]"
+
+
+class PlaybackWorker:
+    DEFAULT_MAX_QUEUE_SIZE = 8
+    HISTORY_SIZE = 32
+
+    def __init__(self, sound_player, policy: CoalescePolicy = CoalescePolicy.LATEST_WINS,
+                 max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE):
+        self.sound_player = sound_player
+        self.policy = policy
+        self.max_queue_size = max_queue_size
+        # Los comandos de control se ejecutan en orden y antes que cualquier reproducción
+        self.commands = deque()
+        # Heap de reproducciones pendientes (-prioridad, orden de llegada, comando): primero la de mayor prioridad y,
+        # a igual prioridad, la más antigua
+        self.pending_plays = []
+        self.sequence = itertools.count()
+        self.history = deque(maxlen=self.HISTORY_SIZE)
+        # Estado de reproducción propio del worker para no tener que tomar el lock de SoundPlayer (que el worker
+        # mantiene mientras decodifica) desde submit: la reproducción en curso y, después de cada comando, los
+        # sonidos que están sonando como (prioridad, fin estimado, canal)
+        self.current_command = None
+        self.playing = []
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+        # Se llama si el hilo termina por un error inesperado
+        self.on_failure = None
+        self.dropped_commands = 0
+        self.played_commands = 0
+        self.total_queue_wait = 0.0
+        self.max_queue_wait = 0.0
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+            self.current_command = None
+            self.playing = []
+        self.thread = threading.Thread(name="PlaybackWorker", target=self.__run_guarded__, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def is_alive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def submit(self, command: PlaybackCommand) -> PlaybackCommand:
+        # Se llama desde el hilo de la pulsación: solo usa el estado del worker, nunca el lock de SoundPlayer. Los
+        # on_done de los comandos descartados se llaman después de soltar la condición
+        command.enqueued_at = time.monotonic()
+        dropped = []
+        with self.condition:
+            if command.command_type != PlaybackCommandType.PLAY:
+                # Los comandos de control no esperan detrás de las reproducciones pendientes: la cola de comandos se
+                # vacía antes que pending_plays, así que basta con añadirlos al final para mantener su orden
+                if command.command_type == PlaybackCommandType.STOP:
+                    dropped += self.__drop_pending_plays__()
+                self.commands.append(command)
+                self.condition.notify()
+            else:
+                if command.policy is None:
+                    command.policy = self.policy
+                if command.policy == CoalescePolicy.LATEST_WINS:
+                    dropped += self.__drop_pending_plays__(command.priority)
+                if command.policy == CoalescePolicy.DROP_WHILE_BUSY and \
+                        (self.__has_pending_plays__(command.priority) or self.__is_busy__(command.priority)):
+                    dropped.append(self.__drop__(command))
+                elif len(self.pending_plays) >= self.max_queue_size:
+                    logging.warning(f"Playback queue is full ({self.max_queue_size} commands). Dropping {command}")
+                    dropped.append(self.__drop__(command))
+                else:
+                    heapq.heappush(self.pending_plays, (-command.priority, next(self.sequence), command))
+                    self.condition.notify()
+        for dropped_command in dropped:
+            self.__notify_done__(dropped_command)
+        return command
+
+    def set_policy(self, policy: CoalescePolicy, max_queue_size: int = None):
+        with self.condition:
+            self.policy = policy
+            if max_queue_size is not None:
+                self.max_queue_size = max_queue_size
+            # El worker puede estar esperando a que termine un sonido por la política anterior
+            self.condition.notify()
+
+    def get_history(self) -> List[PlaybackCommand]:
+        with self.condition:
+            return list(self.history)
+
+    def get_stats(self):
+        with self.condition:
+            return {'queue_size': len(self.commands) + len(self.pending_plays),
+                    'max_queue_size': self.max_queue_size,
+                    'dropped': self.dropped_commands,
+                    'played': self.played_commands,
+                    'avg_queue_wait': self.total_queue_wait / self.played_commands if self.played_commands else 0,
+                    'max_queue_wait': self.max_queue_wait}
+
+    def __run_guarded__(self):
+        try:
+            self.__run__()
+        except Exception as e:
+            logging.exception(f"PlaybackWorker stopped unexpectedly: {str(e)}")
+            if self.on_failure is not None:
+                self.on_failure()
+
+    def __run__(self):
+        while True:
+            with self.condition:
+                command = self.__next_command__()
+                if command is None:
+                    return
+            try:
+                self.__execute__(command)
+            except Exception as e:
+                logging.exception(f"Error executing {command}: {str(e)}")
+            # Los sonidos que suenan solo cambian al ejecutar un comando (o al terminar, que se ve por su fin o por
+            # el canal), así que basta con leerlos aquí, en el hilo del worker
+            playing = [(active.priority, active.end, active.channel)
+                       for active in self.sound_player.__get_active_sounds__()]
+            with self.condition:
+                self.playing = playing
+                self.current_command = None
+                self.history.append(command)
+            self.__notify_done__(command)
+
+    def __next_command__(self):
+        while self.running:
+            if len(self.commands) > 0:
+                return self.commands.popleft()
+            if len(self.pending_plays) == 0:
+                self.condition.wait()
+                continue
+            command = self.pending_plays[0][2]
+            remaining = self.__get_wait_time__(command)
+            if remaining > 0:
+                # Se espera a que terminen los sonidos que bloquean la reproducción sin hacer polling; cualquier
+                # comando nuevo despierta al worker antes de tiempo
+                self.condition.wait(timeout=remaining)
+                continue
+            heapq.heappop(self.pending_plays)
+            self.__account_queue_wait__(command)
+            self.current_command = command
+            return command
+        return None
+
+    def __get_wait_time__(self, command: PlaybackCommand) -> float:
+        if command.policy == CoalescePolicy.QUEUE:
+            # Espera a que no suene nada
+            return self.__get_remaining_time__()
+        if command.policy == CoalescePolicy.OVERLAP:
+            return 0
+        # Interrumpe a los sonidos de igual o menor prioridad, pero espera a los de mayor prioridad
+        return self.__get_remaining_time__(min_priority=command.priority + 1)
+
+    def __get_remaining_time__(self, min_priority: int = None) -> float:
+        # Como SoundPlayer.get_remaining_time, pero con el estado del worker. Se llama con la condición tomada
+        now = time.monotonic()
+        remaining = 0
+        for priority, end, channel in self.playing:
+            if min_priority is not None and priority < min_priority:
+                continue
+            if end > now:
+                remaining = max(remaining, end - now)
+            elif self.__is_channel_busy__(channel):
+                remaining = max(remaining, self.sound_player.BUSY_POLL_INTERVAL)
+        return remaining
+
+    def __is_busy__(self, min_priority: int) -> bool:
+        # Una reproducción que todavía se está decodificando cuenta como si ya sonara
+        current = self.current_command
+        if current is not None and current.command_type == PlaybackCommandType.PLAY and \
+                current.priority >= min_priority:
+            return True
+        return self.__get_remaining_time__(min_priority) > 0
+
+    @staticmethod
+    def __is_channel_busy__(channel) -> bool:
+        try:
+            return channel.get_busy()
+        except Exception:
+            # El mixer ya se ha cerrado
+            return False
+
+    def __account_queue_wait__(self, command: PlaybackCommand):
+        command.dequeued_at = time.monotonic()
+        queue_wait = command.get_queue_wait()
+        self.played_commands += 1
+        self.total_queue_wait += queue_wait
+        self.max_queue_wait = max(self.max_queue_wait, queue_wait)
+        PLAYBACK_QUEUE_WAIT_SECONDS.labels(command.policy.name.lower()).observe(queue_wait)
+
+    def __execute__(self, command: PlaybackCommand):
+        if command.command_type == PlaybackCommandType.PLAY:
+            # Solo la reproducción solapada deja sonando los sonidos de igual o menor prioridad
+            interrupt = command.policy != CoalescePolicy.OVERLAP
+            command.channel = self.sound_player.__play_sound__(command.sound_path, command.volume,
+                                                               priority=command.priority, interrupt=interrupt)
+            if command.channel is not None:
+                command.started_at = time.monotonic()
+                active = self.sound_player.active_sounds.get(command.channel)
+                command.played_path = active.path if active is not None else None
+                SOUND_START_SECONDS.observe(command.get_start_latency())
+                logging.debug("Sound %s started on channel %s %.4fs after press.", command.sound_path,
+                              command.channel, command.get_start_latency())
+        elif command.command_type == PlaybackCommandType.STOP:
+            self.sound_player.stop_playing()
+            command.started_at = time.monotonic()
+        elif command.command_type == PlaybackCommandType.SET_VOLUME:
+            self.sound_player.__apply_volume__(command.volume)
+            command.started_at = time.monotonic()
+
+    def __has_pending_plays__(self, min_priority: int = None):
+        return any(min_priority is None or c.priority >= min_priority for _, _, c in self.pending_plays)
+
+    def __drop_pending_plays__(self, max_priority: int = None) -> List[PlaybackCommand]:
+        # Se descartan las reproducciones pendientes de prioridad igual o menor (todas si no se indica)
+        kept = []
+        dropped = []
+        for entry in self.pending_plays:
+            if max_priority is None or entry[2].priority <= max_priority:
+                dropped.append(self.__drop__(entry[2]))
+            else:
+                kept.append(entry)
+        if len(kept) != len(self.pending_plays):
+            heapq.heapify(kept)
+            self.pending_plays = kept
+        return dropped
+
+    def __drop__(self, command: PlaybackCommand) -> PlaybackCommand:
+        # Se llama con la condición tomada; quien llama notifica el comando después de soltarla
+        command.dropped = True
+        self.dropped_commands += 1
+        PLAYBACK_DROPPED.inc()
+        self.history.append(command)
+        return command
+
+    @staticmethod
+    def __notify_done__(command: PlaybackCommand):
+        if command.on_done is None:
+            return
+        try:
+            command.on_done(command)
+        except Exception as e:
+            logging.exception(f"Error notifying {command}: {str(e)}")
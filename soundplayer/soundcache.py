@@ -0,0 +1,109 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List
+
+from metrics.metricsregistry import DEFAULT_REGISTRY
+from utils.pathutils import read_dir_content
+
+SOUND_CACHE_REQUESTS = DEFAULT_REGISTRY.counter('doorbell_sound_cache_requests_total', 'Sound cache lookups',
+                                                ['result'])
+SOUND_DECODE_SECONDS = DEFAULT_REGISTRY.histogram('doorbell_sound_decode_seconds', 'Time spent decoding a sound file')
+
+
+class SoundCache:
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, transcode_cache=None):
+        self.max_bytes = max_bytes
+        self.transcode_cache = transcode_cache
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # path -> (mtime, sound, size). El orden del OrderedDict es el orden LRU (el último es el más reciente)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_sound(self, sound_path: str):
+        sound_path = os.path.abspath(sound_path)
+        mtime = os.stat(sound_path).st_mtime_ns
+        with self.lock:
+            entry = self.entries.get(sound_path)
+            if entry is not None and entry[0] == mtime:
+                self.entries.move_to_end(sound_path)
+                self.hits += 1
+                SOUND_CACHE_REQUESTS.labels('hit').inc()
+                return entry[1]
+            self.misses += 1
+        SOUND_CACHE_REQUESTS.labels('miss').inc()
+
+        # La decodificación se hace fuera del lock para no bloquear otros accesos a la caché
+        from pygame import mixer
+        start = time.monotonic()
+        if self.transcode_cache is not None:
+            sound = self.transcode_cache.load(sound_path)
+        else:
+            sound = mixer.Sound(sound_path)
+        SOUND_DECODE_SECONDS.observe(time.monotonic() - start)
+        self.__put__(sound_path, mtime, sound)
+        return sound
+
+    def preload(self, walk_dir: str, file_ext_filter: List[str] = ['.wav', '.mp3'], max_file_size: int = None):
+        # Los ficheros de más de max_file_size bytes se reproducen en streaming y no se cargan
+        for sound_path in read_dir_content(walk_dir, file_ext_filter):
+            if max_file_size is not None and os.path.getsize(sound_path) > max_file_size:
+                continue
+            try:
+                self.get_sound(sound_path)
+            except Exception as e:
+                logging.error(f"Sound {sound_path} couldn't be preloaded: {str(e)}")
+        logging.info(f"Sound cache preloaded from {walk_dir}: {len(self.entries)} sounds, "
+                     f"{self.current_bytes} bytes.")
+
+    def set_max_bytes(self, max_bytes: int):
+        with self.lock:
+            self.max_bytes = max_bytes
+            while self.entries and self.current_bytes > self.max_bytes:
+                evicted_path, evicted_entry = self.entries.popitem(last=False)
+                self.current_bytes -= evicted_entry[2]
+                self.evictions += 1
+                logging.debug(f"Sound {evicted_path} evicted from sound cache.")
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self.entries),
+                    'bytes': self.current_bytes,
+                    'max_bytes': self.max_bytes}
+
+    def __put__(self, sound_path: str, mtime: int, sound):
+        size = self.__sound_size__(sound)
+        if size > self.max_bytes:
+            logging.debug(f"Sound {sound_path} ({size} bytes) doesn't fit into sound cache.")
+            return
+        with self.lock:
+            old_entry = self.entries.pop(sound_path, None)
+            if old_entry is not None:
+                self.current_bytes -= old_entry[2]
+            while self.entries and self.current_bytes + size > self.max_bytes:
+                evicted_path, evicted_entry = self.entries.popitem(last=False)
+                self.current_bytes -= evicted_entry[2]
+                self.evictions += 1
+                logging.debug(f"Sound {evicted_path} evicted from sound cache.")
+            self.entries[sound_path] = (mtime, sound, size)
+            self.current_bytes += size
+
+    @staticmethod
+    def __sound_size__(sound) -> int:
+        # Se calcula a partir del formato del mixer para evitar copiar las muestras con get_raw()
+        from pygame import mixer
+        frequency, sample_format, channels = mixer.get_init()
+        return int(round(sound.get_length() * frequency)) * channels * (abs(sample_format) // 8)
@@ -1,15 +1,57 @@
 import logging
+import os
 import threading
+import time
 from pathlib import Path
+from dataclasses import dataclass
+from typing import Callable, Dict
+
+from soundplayer.musicstream import MusicStream, estimate_duration
+from soundplayer.playbackworker import PlaybackWorker, CoalescePolicy, PlaybackCommand, PlaybackCommandType
+from soundplayer.soundcache import SoundCache
+from soundplayer.transcodecache import TranscodeCache
+from utils.fileindex import FileIndex
+
+@dataclass
+class ActiveSound:
+    sound: object
+    channel: object
+    priority: int
+    volume: float = None
+    end: float = 0
+    path: str = None
 
-from pygame import mixer
-from utils.pathutils import get_random_file
 
 class SoundPlayer:
-    def __init__(self, volume=1):
+    DEFAULT_CACHE_SIZE = 32 * 1024 * 1024
+    DEFAULT_CHANNELS = 4
+    DEFAULT_STREAM_THRESHOLD = 1024 * 1024
+    # Clave de active_sounds para el stream de mixer.music, que no es un canal del mixer
+    STREAM_CHANNEL = -1
+    # Mientras un sonido sigue sonando el tiempo restante nunca es 0, aunque su duración fuese una estimación
+    BUSY_POLL_INTERVAL = 0.01
+
+    SOUND_EXTENSIONS = ['.wav', '.mp3']
+
+    def __init__(self, volume=1, cache_size: int = DEFAULT_CACHE_SIZE, preload_path: str = None,
+                 shuffle_bag: bool = False, policy: CoalescePolicy = CoalescePolicy.LATEST_WINS,
+                 max_queue_size: int = PlaybackWorker.DEFAULT_MAX_QUEUE_SIZE,
+                 transcode_cache: TranscodeCache = None, channels: int = DEFAULT_CHANNELS,
+                 stream_threshold: int = DEFAULT_STREAM_THRESHOLD):
         self.volume = volume
-        self.channel_a = None
-        self.lock = threading.Lock()
+        self.channels = max(1, channels)
+        # Los ficheros de más de stream_threshold bytes se reproducen en streaming. None o 0 lo desactiva
+        self.stream_threshold = stream_threshold
+        self.music_stream = MusicStream()
+        # Canal del mixer -> sonido que se está reproduciendo en él
+        self.active_sounds: Dict[int, ActiveSound] = {}
+        self.lock = threading.RLock()
+        self.transcode_cache = transcode_cache
+        self.sound_cache = SoundCache(max_bytes=cache_size, transcode_cache=transcode_cache)
+        self.preload_path = preload_path
+        self.shuffle_bag = shuffle_bag
+        self.file_indexes: Dict[str, FileIndex] = {}
+        self.playback_worker = PlaybackWorker(self, policy=policy, max_queue_size=max_queue_size)
 
     def __enter__(self):
         self.init_context()
@@ -19,43 +61,206 @@ class SoundPlayer:
         self.close_context()
 
     def init_context(self):
+        # pygame tarda varios segundos en importarse en la Orange Pi, así que no se importa hasta que hace falta
+        from pygame import mixer
         mixer.init()
-        mixer.set_num_channels(1)
+        mixer.set_num_channels(self.channels)
+        if self.preload_path is not None and Path(self.preload_path).is_dir():
+            self.sound_cache.preload(self.preload_path, self.SOUND_EXTENSIONS,
+                                     max_file_size=self.__get_max_file_size__())
+        self.playback_worker.start()
 
     def close_context(self):
+        self.playback_worker.stop()
+        # Los sonidos decodificados dejan de ser válidos cuando se cierra el mixer
+        self.sound_cache.clear()
+        from pygame import mixer
         mixer.quit()
 
-    def play_sound(self, sound_path):
-        if mixer.get_init() is not None:
-            t = threading.Thread(name="PlayerThread", target=self.__play_sound__, args=(sound_path,))
-            t.start()
+    def is_healthy(self):
+        from pygame import mixer
+        return self.playback_worker.is_alive() and mixer.get_init() is not None
+
+    def play_sound(self, sound_path, volume=None, priority: int = 0, policy: CoalescePolicy = None,
+                   on_done: Callable[[PlaybackCommand], None] = None):
+        # El worker solo está vivo entre init_context y close_context, cuando el mixer está iniciado
+        if self.playback_worker.is_alive():
+            return self.playback_worker.submit(PlaybackCommand(PlaybackCommandType.PLAY, sound_path=sound_path,
+                                                               volume=volume, priority=priority, policy=policy,
+                                                               on_done=on_done))
         else:
             logging.error("SoundPlayer is not initialized. You must call init_context function.")
+            return None
+
+    def stop(self):
+        if self.playback_worker.is_alive():
+            return self.playback_worker.submit(PlaybackCommand(PlaybackCommandType.STOP))
+        self.stop_playing()
+        return None
 
-    def is_playing(self):
-        return self.channel_a is not None and self.channel_a.get_busy()
+    def is_playing(self, min_priority: int = None):
+        return len(self.__get_active_sounds__(min_priority)) > 0
 
-    def stop_playing(self):
-        if self.channel_a is not None and self.channel_a.get_busy():
-            logging.debug("Channel is busy, stopping current sound.")
-            self.channel_a.stop()
-            mixer.stop()
+    def get_remaining_time(self, min_priority: int = None):
+        # Tiempo hasta que terminan todos los sonidos con prioridad mayor o igual que min_priority
+        now = time.monotonic()
+        return max([max(active.end - now, self.BUSY_POLL_INTERVAL)
+                    for active in self.__get_active_sounds__(min_priority)], default=0)
+
+    def stop_playing(self, max_priority: int = None):
+        # Para los sonidos de prioridad igual o menor que max_priority, o todos si no se indica
+        with self.lock:
+            for channel_id, active in list(self.active_sounds.items()):
+                if max_priority is None or active.priority <= max_priority:
+                    if active.channel.get_busy():
+                        logging.debug("Channel %s is busy, stopping its sound.", channel_id)
+                        active.channel.stop()
+                    del self.active_sounds[channel_id]
 
     def set_volume(self, volume):
         if volume < 0 or volume > 1:
             logging.error("Volume value must be between 0 an 1.")
+        elif self.playback_worker.is_alive():
+            self.playback_worker.submit(PlaybackCommand(PlaybackCommandType.SET_VOLUME, volume=volume))
         else:
-            with self.lock:
-                self.volume = volume
+            self.__apply_volume__(volume)
 
-    def __play_sound__(self, sound_path):
+    def set_policy(self, policy: CoalescePolicy, max_queue_size: int = None):
+        self.playback_worker.set_policy(policy, max_queue_size)
+
+    def set_cache_size(self, cache_size: int):
+        self.sound_cache.set_max_bytes(cache_size)
+
+    def set_stream_threshold(self, stream_threshold: int):
+        with self.lock:
+            self.stream_threshold = stream_threshold
+
+    def set_shuffle_bag(self, shuffle_bag: bool):
         with self.lock:
-            self.stop_playing()
-            path = Path(sound_path)
-            if path.is_dir():
-                sound_path = get_random_file(walk_dir=str(path), file_ext_filter=['.wav', '.mp3'])
-            sound = mixer.Sound(sound_path)
-            sound.set_volume(self.volume)
-            self.channel_a = sound.play()
+            if shuffle_bag == self.shuffle_bag:
+                return
+            self.shuffle_bag = shuffle_bag
+            # Los índices se vuelven a construir con el nuevo modo la próxima vez que se pidan
+            self.file_indexes = {}
+
+    def prepare_sounds(self, sound_path: str):
+        # Deja en la caché de disco el PCM de todos los sonidos para que ninguna reproducción tenga que decodificar
+        if self.transcode_cache is not None:
+            self.transcode_cache.prepare(sound_path, self.SOUND_EXTENSIONS,
+                                         max_file_size=self.__get_max_file_size__())
+
+    def get_cache_stats(self):
+        return self.sound_cache.get_stats()
+
+    def get_transcode_stats(self):
+        return self.transcode_cache.get_stats() if self.transcode_cache is not None else None
+
+    def get_playback_stats(self):
+        return self.playback_worker.get_stats()
+
+    def get_playback_history(self):
+        return self.playback_worker.get_history()
+
+    def get_file_index(self, dir_path: str) -> FileIndex:
+        file_index = self.file_indexes.get(dir_path)
+        if file_index is None:
+            file_index = FileIndex(walk_dir=dir_path, file_ext_filter=self.SOUND_EXTENSIONS,
+                                   shuffle_bag=self.shuffle_bag)
+            self.file_indexes[dir_path] = file_index
+        return file_index
+
+    def __play_sound__(self, sound_path, volume=None, priority: int = 0, interrupt: bool = True):
+        # Devuelve el canal en el que empieza a sonar o None si no se ha podido reproducir
+        with self.lock:
+            if interrupt:
+                self.stop_playing(max_priority=priority)
+            if sound_path in self.file_indexes or os.path.isdir(sound_path):
+                sound_path = self.get_file_index(sound_path).get_random_file()
+                if sound_path is None:
+                    return None
+            if self.__must_stream__(sound_path):
+                return self.__play_stream__(sound_path, volume, priority)
+            sound = self.sound_cache.get_sound(sound_path)
+            channel_id = self.__find_channel__(priority)
+            if channel_id is None:
+                logging.warning(f"No free mixer channel for {sound_path} with priority {priority}.")
+                return None
+            from pygame import mixer
+            channel = mixer.Channel(channel_id)
+            channel.play(sound)
+            # El volumen se aplica al canal y no al sonido, porque el mismo sonido de la caché puede estar sonando en
+            # varios canales a la vez
+            channel.set_volume(self.volume if volume is None else volume)
+            self.active_sounds[channel_id] = ActiveSound(sound=sound, channel=channel, priority=priority,
+                                                         volume=volume, end=time.monotonic() + sound.get_length(),
+                                                         path=sound_path)
+            return channel_id
+
+    def __play_stream__(self, sound_path, volume, priority: int):
+        # __get_active_sounds__ descarta el stream si ya ha terminado
+        self.__get_active_sounds__()
+        active = self.active_sounds.get(self.STREAM_CHANNEL)
+        if active is not None:
+            if active.priority > priority:
+                logging.warning(f"Music stream is busy with a higher priority sound. {sound_path} with priority "
+                                f"{priority} is not played.")
+                return None
+            del self.active_sounds[self.STREAM_CHANNEL]
+        self.music_stream.play(sound_path)
+        self.music_stream.set_volume(self.volume if volume is None else volume)
+        # Si no se conoce la duración, get_remaining_time se basa solo en get_busy
+        duration = estimate_duration(sound_path) or 0
+        self.active_sounds[self.STREAM_CHANNEL] = ActiveSound(sound=None, channel=self.music_stream, priority=priority,
+                                                              volume=volume, end=time.monotonic() + duration,
+                                                              path=sound_path)
+        logging.debug("Streaming %s (%.1f s).", sound_path, duration)
+        return self.STREAM_CHANNEL
+
+    def __must_stream__(self, sound_path) -> bool:
+        max_file_size = self.__get_max_file_size__()
+        if max_file_size is None:
+            return False
+        try:
+            return os.path.getsize(sound_path) > max_file_size
+        except OSError:
+            # El error se notifica al intentar cargar el sonido
+            return False
+
+    def __get_max_file_size__(self):
+        # Tamaño máximo de los ficheros que se decodifican enteros en memoria
+        return self.stream_threshold if self.stream_threshold else None
+
+    def __find_channel__(self, priority: int):
+        # El stream no es un canal del mixer, así que no puede cederse a un sonido cargado en memoria
+        active_sounds = [active for active in self.__get_active_sounds__() if active.channel is not self.music_stream]
+        for channel_id in range(self.channels):
+            if channel_id not in self.active_sounds:
+                return channel_id
+        # Si todos los canales están ocupados se reutiliza el del sonido de menor prioridad, siempre que no sea mayor
+        # que la del nuevo sonido
+        victim = min(active_sounds, key=lambda active: (active.priority, active.end))
+        if victim.priority > priority:
+            return None
+        channel_id = next(channel_id for channel_id, active in self.active_sounds.items() if active is victim)
+        victim.channel.stop()
+        del self.active_sounds[channel_id]
+        return channel_id
+
+    def __get_active_sounds__(self, min_priority: int = None):
+        with self.lock:
+            for channel_id, active in list(self.active_sounds.items()):
+                if not active.channel.get_busy():
+                    del self.active_sounds[channel_id]
+            return [active for active in self.active_sounds.values()
+                    if min_priority is None or active.priority >= min_priority]
+
+    def __apply_volume__(self, volume):
+        with self.lock:
+            self.volume = volume
+            # Los sonidos con volumen propio (el de su entrada) lo mantienen
+            for active in self.__get_active_sounds__():
+                if active.volume is None:
+                    active.channel.set_volume(volume)
+
 
 
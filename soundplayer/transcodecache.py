@@ -0,0 +1,270 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+from array import array
+from typing import Dict, List, Set
+
+from metrics.metricsregistry import DEFAULT_REGISTRY
+from utils.pathutils import read_dir_content
+
+TRANSCODE_CACHE_REQUESTS = DEFAULT_REGISTRY.counter('doorbell_transcode_cache_requests_total',
+                                                    'Transcode cache lookups', ['result'])
+TRANSCODE_SECONDS = DEFAULT_REGISTRY.histogram('doorbell_transcode_seconds',
+                                               'Time spent transcoding a sound file into raw PCM')
+
+
+class TranscodeCache:
+    DEFAULT_CACHE_DIR = './data/cache/sounds'
+    DEFAULT_TARGET_DBFS = -16.0
+    INDEX_FILE_NAME = 'index.json'
+    PCM_EXTENSION = '.pcm'
+    HASH_CHUNK_SIZE = 64 * 1024
+
+    # Formatos de muestra de SDL (los que devuelve mixer.get_init()) -> código de array. pygame indica con -32 las
+    # muestras float32. Los formatos que no están aquí se cachean igual, pero sin normalizar
+    ARRAY_TYPECODES = {8: 'B', -8: 'b', 16: 'H', -16: 'h', -32: 'f'}
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, normalize: bool = False,
+                 target_dbfs: float = DEFAULT_TARGET_DBFS):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.normalize = normalize
+        self.target_dbfs = target_dbfs
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        # path -> [mtime, size, hash del contenido]. Evita volver a leer el fichero entero para calcular el hash
+        # en cada arranque mientras no cambie
+        self.index: Dict[str, list] = {}
+        # Sonidos que se están normalizando en segundo plano
+        self.pending: Set[str] = set()
+        self.lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.__load_index__()
+
+    def load(self, sound_path: str, normalize_now: bool = False):
+        # load() se llama al reproducir, así que la normalización (que recorre todas las muestras) solo se hace con
+        # normalize_now, desde prepare() o desde un hilo aparte. Mientras tanto el sonido suena sin normalizar
+        from pygame import mixer
+        sound_path = os.path.abspath(sound_path)
+        pcm_path = self.__get_pcm_path__(sound_path, mixer.get_init())
+        if os.path.isfile(pcm_path):
+            try:
+                sound = self.__load_pcm__(pcm_path)
+                with self.lock:
+                    self.hits += 1
+                TRANSCODE_CACHE_REQUESTS.labels('hit').inc()
+                return sound
+            except (OSError, ValueError) as e:
+                logging.warning(f"Cached PCM {pcm_path} of {sound_path} couldn't be loaded, transcoding it again: "
+                                f"{str(e)}")
+
+        with self.lock:
+            self.misses += 1
+        TRANSCODE_CACHE_REQUESTS.labels('miss').inc()
+        start = time.monotonic()
+        sound = mixer.Sound(sound_path)
+        if self.normalize and not normalize_now:
+            self.__normalize_in_background__(sound_path)
+            return sound
+        try:
+            raw = self.__transcode__(sound, mixer.get_init())
+            if self.__write_pcm__(pcm_path, raw):
+                # Se carga desde la caché para que el sonido no dependa del decodificador a partir de ahora
+                sound = self.__load_pcm__(pcm_path)
+        except (OSError, ValueError) as e:
+            with self.lock:
+                self.errors += 1
+            logging.error(f"Sound {sound_path} couldn't be stored in transcode cache: {str(e)}")
+        TRANSCODE_SECONDS.observe(time.monotonic() - start)
+        return sound
+
+    def prepare(self, walk_dir: str, file_ext_filter: List[str] = ['.wav', '.mp3'], max_file_size: int = None) -> int:
+        # Transcodifica todos los ficheros de la carpeta que no estén ya en la caché. Los sonidos no se guardan en
+        # memoria, solo se deja el PCM en disco para que la primera reproducción no pague la decodificación
+        from pygame import mixer
+        mixer_format = mixer.get_init()
+        transcoded = 0
+        sound_paths = [walk_dir] if os.path.isfile(walk_dir) else read_dir_content(walk_dir, file_ext_filter)
+        for sound_path in sound_paths:
+            try:
+                if max_file_size is not None and os.path.getsize(sound_path) > max_file_size:
+                    # Se reproduce en streaming, sin pasar por la caché
+                    continue
+                if not os.path.isfile(self.__get_pcm_path__(os.path.abspath(sound_path), mixer_format)):
+                    self.load(sound_path, normalize_now=True)
+                    transcoded += 1
+            except Exception as e:
+                logging.error(f"Sound {sound_path} couldn't be transcoded: {str(e)}")
+        logging.info(f"Transcode cache prepared from {walk_dir}: {transcoded} sounds transcoded.")
+        return transcoded
+
+    def purge(self) -> int:
+        # Borra los PCM que ya no corresponden a ningún fichero de la biblioteca
+        with self.lock:
+            for sound_path in [path for path in self.index if not os.path.isfile(path)]:
+                del self.index[sound_path]
+            digests = {entry[2] for entry in self.index.values()}
+            self.__save_index__()
+        removed = 0
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(self.PCM_EXTENSION) and file_name.split('_', 1)[0] not in digests:
+                try:
+                    os.remove(os.path.join(self.cache_dir, file_name))
+                    removed += 1
+                except OSError as e:
+                    logging.warning(f"Cached PCM {file_name} couldn't be removed: {str(e)}")
+        if removed:
+            logging.info(f"{removed} stale files removed from transcode cache {self.cache_dir}.")
+        return removed
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'errors': self.errors,
+                    'files': len(self.index)}
+
+    def __normalize_in_background__(self, sound_path: str):
+        with self.lock:
+            if sound_path in self.pending:
+                return
+            self.pending.add(sound_path)
+        threading.Thread(name="SoundNormalizer", target=self.__run_normalize__, args=(sound_path,),
+                         daemon=True).start()
+
+    def __run_normalize__(self, sound_path: str):
+        try:
+            self.load(sound_path, normalize_now=True)
+        except Exception as e:
+            logging.error(f"Sound {sound_path} couldn't be normalized: {str(e)}")
+        finally:
+            with self.lock:
+                self.pending.discard(sound_path)
+
+    def __get_pcm_path__(self, sound_path: str, mixer_format) -> str:
+        frequency, sample_format, channels = mixer_format
+        file_name = f"{self.__get_digest__(sound_path)}_{frequency}_{sample_format}_{channels}"
+        if self.normalize:
+            file_name += f"_n{self.target_dbfs:g}"
+        return os.path.join(self.cache_dir, file_name + self.PCM_EXTENSION)
+
+    def __get_digest__(self, sound_path: str) -> str:
+        stat = os.stat(sound_path)
+        with self.lock:
+            entry = self.index.get(sound_path)
+            if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+                return entry[2]
+
+        sha1 = hashlib.sha1()
+        with open(sound_path, 'rb') as sound_file:
+            for chunk in iter(lambda: sound_file.read(self.HASH_CHUNK_SIZE), b''):
+                sha1.update(chunk)
+        digest = sha1.hexdigest()
+        with self.lock:
+            self.index[sound_path] = [stat.st_mtime_ns, stat.st_size, digest]
+            self.__save_index__()
+        return digest
+
+    def __transcode__(self, sound, mixer_format) -> bytes:
+        # mixer.Sound ya decodifica y convierte el fichero al formato del mixer, así que solo hay que guardar sus
+        # muestras
+        raw = sound.get_raw()
+        if self.normalize:
+            raw = self.__normalize__(raw, mixer_format[1])
+        return raw
+
+    def __normalize__(self, raw: bytes, sample_format: int) -> bytes:
+        typecode = self.ARRAY_TYPECODES.get(sample_format)
+        if typecode is None:
+            logging.warning(f"Sample format {sample_format} can't be normalized. Sound is cached without "
+                            f"normalization.")
+            return raw
+        samples = array(typecode)
+        samples.frombytes(raw[:len(raw) - len(raw) % samples.itemsize])
+        if not samples:
+            return raw
+        # SDL usa el orden de bytes nativo para los formatos por defecto del mixer
+        is_float = typecode == 'f'
+        bits = abs(sample_format)
+        offset = 0 if sample_format < 0 else 1 << (bits - 1)
+        # Las muestras float van de -1.0 a 1.0
+        full_scale = 1.0 if is_float else float(1 << (bits - 1))
+
+        peak = 0
+        square_sum = 0.0
+        for sample in samples:
+            value = sample - offset
+            square_sum += value * value
+            if abs(value) > peak:
+                peak = abs(value)
+        if peak == 0:
+            return raw
+        rms = math.sqrt(square_sum / len(samples)) / full_scale
+        gain = (10 ** (self.target_dbfs / 20)) / rms
+        # No se aplica más ganancia de la que permite el pico para no saturar
+        if is_float:
+            gain = min(gain, full_scale / peak)
+            normalized = array(typecode, (min(max(sample * gain, -1.0), 1.0) for sample in samples))
+            logging.debug(f"Sound normalized with gain {20 * math.log10(gain):.1f} dB")
+            return normalized.tobytes()
+        gain = min(gain, (full_scale - 1) / peak)
+
+        low = -int(full_scale)
+        high = int(full_scale) - 1
+        normalized = array(typecode, (min(max(int(round((sample - offset) * gain)), low), high) + offset
+                                      for sample in samples))
+        logging.debug(f"Sound normalized with gain {20 * math.log10(gain):.1f} dB")
+        return normalized.tobytes()
+
+    def __write_pcm__(self, pcm_path: str, raw: bytes) -> bool:
+        if not raw:
+            return False
+        # Se escribe en un fichero temporal y se renombra para que una caída no deje un PCM a medias en la caché
+        tmp_path = f"{pcm_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as pcm_file:
+                pcm_file.write(raw)
+                pcm_file.flush()
+                os.fsync(pcm_file.fileno())
+            os.replace(tmp_path, pcm_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        logging.debug(f"Sound transcoded into {pcm_path} ({len(raw)} bytes).")
+        return True
+
+    @staticmethod
+    def __load_pcm__(pcm_path: str):
+        from pygame import mixer
+        # mixer.Sound copia el buffer a su propia memoria, así que basta con leer el fichero. Lo que se ahorra es
+        # la decodificación, no la copia
+        with open(pcm_path, 'rb') as pcm_file:
+            return mixer.Sound(buffer=pcm_file.read())
+
+    def __load_index__(self):
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILE_NAME)
+        if not os.path.isfile(index_path):
+            return
+        try:
+            with open(index_path, 'r') as index_file:
+                index = json.load(index_file)
+            if isinstance(index, dict):
+                self.index = {path: entry for path, entry in index.items()
+                              if isinstance(entry, list) and len(entry) == 3}
+        except (OSError, ValueError) as e:
+            logging.warning(f"Transcode cache index {index_path} couldn't be read, it's going to be rebuilt: "
+                            f"{str(e)}")
+
+    def __save_index__(self):
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILE_NAME)
+        tmp_path = index_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as index_file:
+                json.dump(self.index, index_file)
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            logging.warning(f"Transcode cache index {index_path} couldn't be written: {str(e)}")
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# Los módulos del proyecto se importan desde la raíz del repositorio, igual que al ejecutar main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mqttbroker import LocalMqttBroker  # noqa: E402
+from benchmarks.webhookserver import LocalWebhookServer  # noqa: E402
+
+
+@pytest.fixture
+def mqtt_broker():
+    with LocalMqttBroker() as broker:
+        yield broker
+
+
+@pytest.fixture
+def webhook_server():
+    with LocalWebhookServer() as server:
+        yield server
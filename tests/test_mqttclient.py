@@ -0,0 +1,226 @@
+import socket
+import threading
+import time
+
+from benchmarks.mqttbroker import LocalMqttBroker
+from network.mqtt.mqttclient import MqttClient, MqttLoopType, PublishOutcome
+from network.mqtt.mqttjournal import MqttJournal
+from network.mqtt.mqttresponsecode import MqttResponseCode
+from network.mqtt.mqtttopic import MqttTopic
+from network.url import BasicAuthURL
+
+TIMEOUT = 5.0
+TOPIC = MqttTopic(name='test/ring', qos=1)
+
+
+class BlackHoleProxy:
+    # Proxy TCP delante del broker que puede dejar de reenviar los datos de una conexión sin cerrarla, como un enlace
+    # que se cae sin RST. Solo el keepalive detecta la caída
+    def __init__(self, broker: LocalMqttBroker):
+        self.broker = broker
+        self.host = broker.host
+        self.server_socket = socket.create_server((self.host, 0))
+        self.port = self.server_socket.getsockname()[1]
+        # Las conexiones nuevas dejan de reenviar datos después del CONNECT
+        self.blackhole_after_connect = False
+        self.blackholed = set()
+        self.sockets = []
+        self.lock = threading.Lock()
+        threading.Thread(name="BlackHoleProxy", target=self.__accept__, daemon=True).start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.server_socket.close()
+        with self.lock:
+            sockets = list(self.sockets)
+        for sock in sockets:
+            sock.close()
+
+    def blackhole(self):
+        # Las conexiones abiertas dejan de reenviar datos en los dos sentidos
+        with self.lock:
+            self.blackholed.update(self.sockets)
+
+    def __accept__(self):
+        while True:
+            try:
+                client, _ = self.server_socket.accept()
+            except OSError:
+                return
+            upstream = socket.create_connection((self.broker.host, self.broker.port))
+            with self.lock:
+                self.sockets += [client, upstream]
+                cut_after_connect = self.blackhole_after_connect
+            threading.Thread(target=self.__pump__, args=(client, upstream, cut_after_connect), daemon=True).start()
+            threading.Thread(target=self.__pump__, args=(upstream, client, False), daemon=True).start()
+
+    def __pump__(self, source: socket.socket, destination: socket.socket, cut_after_first: bool):
+        while True:
+            try:
+                data = source.recv(65536)
+                if not data:
+                    break
+                with self.lock:
+                    blackholed = source in self.blackholed
+                    if cut_after_first:
+                        self.blackholed.add(source)
+                if not blackholed:
+                    destination.sendall(data)
+            except OSError:
+                break
+        for sock in (source, destination):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def wait_until(predicate, timeout: float = TIMEOUT) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.005)
+    return predicate()
+
+
+def create_client(broker, **kwargs) -> MqttClient:
+    url = BasicAuthURL(protocol="mqtt", hostname=broker.host, port=broker.port)
+    kwargs.setdefault('reconnect_min_delay', 0.05)
+    kwargs.setdefault('reconnect_max_delay', 0.2)
+    return MqttClient(broker_url=url, loop_type=MqttLoopType.NOT_BLOCKING, async_publish=True, **kwargs)
+
+
+def get_payloads(broker: LocalMqttBroker, client_id: str):
+    return [message.payload for message in list(broker.received) if message.client_id == client_id]
+
+
+def test_journal_is_replayed_in_order_after_reconnecting(mqtt_broker, tmp_path):
+    mqtt_broker.refuse_connections()
+    journal = MqttJournal(str(tmp_path / 'mqtt.journal'))
+    payloads = [f"event {indx}".encode() for indx in range(20)]
+    with create_client(mqtt_broker, journal=journal, replay_rate=1000.0) as client:
+        for payload in payloads:
+            client.publish(TOPIC, payload)
+        assert wait_until(lambda: client.get_publish_stats()['journaled'] == len(payloads))
+        assert mqtt_broker.get_stats()['published'] == 0
+
+        mqtt_broker.refuse_connections(MqttResponseCode.NO_ERROR)
+        assert mqtt_broker.wait_for_messages(len(payloads), TIMEOUT)
+        assert wait_until(lambda: len(journal) == 0)
+        stats = client.get_publish_stats()
+
+    assert get_payloads(mqtt_broker, client.client_id) == payloads
+    assert stats['replayed'] == len(payloads)
+    assert mqtt_broker.get_stats()['refused'] > 0
+
+
+def test_journal_spooled_on_close_is_replayed_on_next_start(mqtt_broker, tmp_path):
+    journal_path = str(tmp_path / 'mqtt.journal')
+    payloads = [f"event {indx}".encode() for indx in range(5)]
+    mqtt_broker.refuse_connections()
+    with create_client(mqtt_broker, journal=MqttJournal(journal_path)) as client:
+        for payload in payloads:
+            client.publish(TOPIC, payload)
+
+    mqtt_broker.refuse_connections(MqttResponseCode.NO_ERROR)
+    with create_client(mqtt_broker, journal=MqttJournal(journal_path), replay_rate=1000.0) as client:
+        assert mqtt_broker.wait_for_messages(len(payloads), TIMEOUT)
+
+    assert get_payloads(mqtt_broker, client.client_id) == payloads
+
+
+def test_persistent_session_keeps_subscriptions_after_reconnecting(mqtt_broker):
+    received = []
+    received_event = threading.Event()
+
+    def on_message(topic, payload):
+        received.append((topic, payload))
+        received_event.set()
+
+    subscribed_topic = MqttTopic(name='test/+', qos=1, callback=on_message)
+    with create_client(mqtt_broker, client_id='subscriber', persistent_session=True,
+                       subscribed_topics=[subscribed_topic]) as subscriber, \
+            create_client(mqtt_broker, name='publisher') as publisher:
+        assert wait_until(lambda: subscriber.is_connected() and publisher.is_connected())
+        assert wait_until(lambda: mqtt_broker.get_stats()['subscriptions'] == 1)
+
+        assert mqtt_broker.drop_connections() == 2
+        assert wait_until(lambda: subscriber.get_publish_stats()['reconnects'] == 1)
+        assert wait_until(lambda: publisher.get_publish_stats()['reconnects'] == 1)
+
+        publisher.publish(TOPIC, b'after reconnect')
+        assert received_event.wait(TIMEOUT)
+        subscriber_stats = subscriber.get_publish_stats()
+
+    assert received == [('test/ring', b'after reconnect')]
+    assert subscriber_stats['sessions_resumed'] == 1
+    broker_stats = mqtt_broker.get_stats()
+    assert broker_stats['sessions_resumed'] == 1
+    # El broker conserva la suscripción: al reanudar la sesión no se vuelve a enviar el SUBSCRIBE
+    assert broker_stats['subscriptions'] == 1
+
+
+def test_publishing_resumes_after_dropped_connection(mqtt_broker):
+    with create_client(mqtt_broker) as client:
+        client.publish(TOPIC, b'before drop')
+        assert mqtt_broker.wait_for_messages(1, TIMEOUT)
+
+        assert mqtt_broker.drop_connections() == 1
+        assert wait_until(lambda: client.get_publish_stats()['reconnects'] == 1)
+        client.publish(TOPIC, b'after drop')
+        assert mqtt_broker.wait_for_messages(2, TIMEOUT)
+        stats = client.get_publish_stats()
+
+    assert get_payloads(mqtt_broker, client.client_id) == [b'before drop', b'after drop']
+    assert stats['connected']
+    assert stats['failed'] == 0
+    assert mqtt_broker.get_stats()['connections'] == 2
+
+
+def test_unacknowledged_messages_are_resent_after_a_silent_link_failure(mqtt_broker, tmp_path):
+    outcomes = []
+    payloads = [f"event {indx}".encode() for indx in range(5)]
+    with BlackHoleProxy(mqtt_broker) as proxy, \
+            create_client(proxy, keepalive=1, journal=MqttJournal(str(tmp_path / 'mqtt.journal'))) as client:
+        assert wait_until(client.is_connected)
+        proxy.blackhole()
+        for payload in payloads:
+            client.publish(TOPIC, payload, on_result=outcomes.append)
+        # paho acepta los mensajes, pero sin PUBACK todavía no se han publicado
+        assert wait_until(lambda: client.get_publish_stats()['published'] == len(payloads))
+        assert outcomes == []
+
+        assert mqtt_broker.wait_for_messages(len(payloads), TIMEOUT)
+        assert wait_until(lambda: len(outcomes) == len(payloads))
+        stats = client.get_publish_stats()
+
+    assert get_payloads(mqtt_broker, client.client_id) == payloads
+    assert outcomes == [PublishOutcome.PUBLISHED] * len(payloads)
+    assert stats['requeued'] == len(payloads)
+    assert stats['reconnects'] == 1
+
+
+def test_journal_keeps_messages_until_the_broker_acknowledges_them(mqtt_broker, tmp_path):
+    journal = MqttJournal(str(tmp_path / 'mqtt.journal'))
+    payloads = [f"event {indx}".encode() for indx in range(5)]
+    mqtt_broker.refuse_connections()
+    with BlackHoleProxy(mqtt_broker) as proxy, \
+            create_client(proxy, keepalive=1, journal=journal, replay_rate=1000.0) as client:
+        for payload in payloads:
+            client.publish(TOPIC, payload)
+        assert wait_until(lambda: client.get_publish_stats()['journaled'] == len(payloads))
+
+        # La conexión se queda muda después del CONNECT: el reenvío del journal no llega al broker
+        proxy.blackhole_after_connect = True
+        mqtt_broker.refuse_connections(MqttResponseCode.NO_ERROR)
+        assert wait_until(lambda: client.get_publish_stats()['replayed'] == len(payloads))
+        assert len(journal) == len(payloads)
+        proxy.blackhole_after_connect = False
+
+        assert mqtt_broker.wait_for_messages(len(payloads), TIMEOUT)
+        assert wait_until(lambda: len(journal) == 0)
+
+    assert get_payloads(mqtt_broker, client.client_id) == payloads
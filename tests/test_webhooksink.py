@@ -0,0 +1,140 @@
+import json
+import time
+
+from benchmarks.webhookserver import LocalWebhookServer
+from events.ringevent import RingEvent
+from gpio.pressdetector import PressType
+from network.notify.webhooksink import WebhookSink
+
+TIMEOUT = 5.0
+
+
+def create_event(seq: int) -> RingEvent:
+    return RingEvent(device_id='test', input_name='main', pin=17, press_type=PressType.SINGLE, timestamp=time.time(),
+                     seq=seq)
+
+
+def create_sink(server: LocalWebhookServer, **kwargs) -> WebhookSink:
+    kwargs.setdefault('connections', 1)
+    kwargs.setdefault('retry_min_delay', 0.05)
+    kwargs.setdefault('retry_max_delay', 0.2)
+    return WebhookSink('test', server.url, **kwargs)
+
+
+def get_seqs(server: LocalWebhookServer):
+    return [json.loads(request.body)['seq'] for request in list(server.requests)]
+
+
+def wait_until_idle(sink: WebhookSink, timeout: float = TIMEOUT) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = sink.get_stats()
+        if stats['queue_size'] == 0 and stats['retry_queue_size'] == 0 and sink.in_progress == 0:
+            return True
+        time.sleep(0.005)
+    return False
+
+
+def deliver(sink: WebhookSink, server: LocalWebhookServer, seq: int):
+    delivered = sink.get_stats()['delivered']
+    sink.notify(create_event(seq))
+    assert server.wait_for_requests(delivered + 1, TIMEOUT)
+    assert wait_until_idle(sink)
+
+
+def test_failed_requests_are_retried_with_backoff(webhook_server):
+    webhook_server.fail_next(2, 503)
+    with create_sink(webhook_server) as sink:
+        start = time.monotonic()
+        sink.notify(create_event(1))
+        assert webhook_server.wait_for_requests(1, TIMEOUT)
+        elapsed = time.monotonic() - start
+        assert wait_until_idle(sink)
+        stats = sink.get_stats()
+
+    assert get_seqs(webhook_server) == [1]
+    assert stats['delivered'] == 1
+    assert stats['retried'] == 2
+    assert stats['failed'] == 0
+    # Las esperas son al menos la mitad de 0.05s y 0.1s por el jitter
+    assert elapsed >= 0.075
+    assert webhook_server.get_stats()['requests'] == 3
+
+
+def test_retries_stop_after_max_retries_and_on_client_errors(webhook_server):
+    webhook_server.fail_next(3, 503)
+    with create_sink(webhook_server, max_retries=1) as sink:
+        sink.notify(create_event(1))
+        assert wait_until_idle(sink)
+        webhook_server.fail_next(1, 400)
+        sink.notify(create_event(2))
+        assert wait_until_idle(sink)
+        stats = sink.get_stats()
+
+    assert stats['delivered'] == 0
+    assert stats['retried'] == 1
+    assert stats['failed'] == 2
+    assert webhook_server.get_stats()['requests'] == 3
+
+
+def test_full_queue_drops_the_oldest_notification(webhook_server):
+    sink = create_sink(webhook_server, max_queue_size=3)
+    # Sin hilos no se envía nada, así que la cola se llena
+    for seq in range(5):
+        sink.notify(create_event(seq))
+    assert sink.get_stats()['dropped'] == 2
+
+    with sink:
+        assert webhook_server.wait_for_requests(3, TIMEOUT)
+        assert wait_until_idle(sink)
+        stats = sink.get_stats()
+
+    assert get_seqs(webhook_server) == [2, 3, 4]
+    assert stats['delivered'] == 3
+    assert stats['dropped'] == 2
+
+
+def test_idle_connection_is_reused(webhook_server):
+    with create_sink(webhook_server) as sink:
+        for seq in range(5):
+            deliver(sink, webhook_server, seq)
+        pool_stats = sink.get_stats()['connections']
+
+    assert get_seqs(webhook_server) == list(range(5))
+    assert pool_stats['created'] == 1
+    assert pool_stats['reused'] == 4
+    assert webhook_server.get_stats()['connections'] == 1
+    assert len({request.client_port for request in webhook_server.requests}) == 1
+
+
+def test_connection_closed_by_the_server_while_idle_is_not_reused(webhook_server):
+    webhook_server.idle_timeout = 0.1
+    with create_sink(webhook_server) as sink:
+        deliver(sink, webhook_server, 1)
+        # El servidor cierra la conexión libre sin avisar
+        time.sleep(0.3)
+        deliver(sink, webhook_server, 2)
+        stats = sink.get_stats()
+
+    assert get_seqs(webhook_server) == [1, 2]
+    assert stats['delivered'] == 2
+    assert stats['retried'] == 0
+    assert stats['connections']['created'] == 2
+    assert stats['connections']['discarded'] >= 1
+    assert webhook_server.get_stats() == {'connections': 2, 'requests': 2, 'failed': 0}
+
+
+def test_request_lost_after_sending_on_reused_connection_counts_as_an_attempt(webhook_server):
+    with create_sink(webhook_server) as sink:
+        deliver(sink, webhook_server, 1)
+        # La petición llega por la conexión reutilizada, pero el servidor corta sin responder: puede haberla
+        # procesado, así que no se repite al momento sino como un intento fallido más
+        webhook_server.drop_next(1)
+        deliver(sink, webhook_server, 2)
+        stats = sink.get_stats()
+
+    assert get_seqs(webhook_server) == [1, 2]
+    assert stats['delivered'] == 2
+    assert stats['retried'] == 1
+    assert stats['connections']['reused'] == 1
+    assert webhook_server.get_stats() == {'connections': 2, 'requests': 3, 'failed': 1}
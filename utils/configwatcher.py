@@ -0,0 +1,91 @@
+import hashlib
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict
+
+import yaml
+
+
+class ConfigWatcher:
+    DEFAULT_INTERVAL = 2.0
+
+    def __init__(self, cfg_path: str, on_change: Callable[[Dict[str, Any]], None],
+                 interval: float = DEFAULT_INTERVAL):
+        self.cfg_path = cfg_path
+        self.on_change = on_change
+        self.interval = interval
+        self.last_stat = None
+        self.last_digest = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        self.init_context()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close_context()
+
+    def init_context(self):
+        # Se toma como referencia el fichero actual para no recargar la configuración con la que se ha arrancado
+        self.last_stat = self.__stat__()
+        self.last_digest = self.__digest__(self.__read__())
+        self.stop_event.clear()
+        self.thread = threading.Thread(name="ConfigWatcher", target=self.__run__, daemon=True)
+        self.thread.start()
+
+    def close_context(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def check(self) -> bool:
+        # stat() es muy barato; solo se lee el fichero cuando cambia la fecha de modificación o el tamaño
+        stat = self.__stat__()
+        if stat == self.last_stat:
+            return False
+        self.last_stat = stat
+        content = self.__read__()
+        digest = self.__digest__(content)
+        if content is None or digest == self.last_digest:
+            return False
+        try:
+            cfg = yaml.safe_load(content)
+        except yaml.YAMLError as e:
+            # Puede que el editor aún no haya terminado de escribir; se vuelve a intentar en el siguiente cambio
+            logging.error(f"Configuration file {self.cfg_path} isn't valid YAML. Changes are ignored: {str(e)}")
+            return False
+        if not isinstance(cfg, dict):
+            logging.error(f"Configuration file {self.cfg_path} must contain a mapping. Changes are ignored.")
+            return False
+        self.last_digest = digest
+        self.on_change(cfg)
+        return True
+
+    def __run__(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logging.exception(f"Error applying changes of configuration file {self.cfg_path}: {str(e)}")
+
+    def __stat__(self):
+        try:
+            stat = os.stat(self.cfg_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def __read__(self):
+        try:
+            with open(self.cfg_path, 'rb') as cfg_file:
+                return cfg_file.read()
+        except OSError as e:
+            logging.error(f"Configuration file {self.cfg_path} couldn't be read: {str(e)}")
+            return None
+
+    @staticmethod
+    def __digest__(content: bytes):
+        return None if content is None else hashlib.sha1(content).digest()
@@ -0,0 +1,143 @@
+import logging
+import os
+import threading
+import time
+from random import randrange
+from typing import Dict, List, Optional, Set
+
+
+class FileIndex:
+    def __init__(self, walk_dir: str = './data/sounds', file_ext_filter: List[str] = ['.wav', '.mp3'],
+                 shuffle_bag: bool = False, refresh_interval: float = 1.0):
+        self.walk_dir = os.path.abspath(walk_dir)
+        self.file_ext_filter = file_ext_filter
+        self.shuffle_bag = shuffle_bag
+        self.refresh_interval = refresh_interval
+        self.files: List[str] = []
+        self.file_positions: Dict[str, int] = {}
+        self.files_by_dir: Dict[str, Set[str]] = {}
+        self.dir_mtimes: Dict[str, int] = {}
+        self.bag: List[str] = []
+        # Mismos ficheros que bag, para saber en O(1) si un fichero ya está en la bolsa
+        self.bag_files: Set[str] = set()
+        self.last_selected = None
+        self.last_refresh = 0
+        self.lock = threading.Lock()
+        self.build()
+
+    def __len__(self):
+        return len(self.files)
+
+    def build(self):
+        with self.lock:
+            self.files.clear()
+            self.file_positions.clear()
+            self.files_by_dir.clear()
+            self.dir_mtimes.clear()
+            self.bag.clear()
+            self.bag_files.clear()
+            self.__scan_dir__(self.walk_dir, recursive=True)
+            self.last_refresh = time.monotonic()
+        logging.debug(f"File index of {self.walk_dir} built. Total files with extensions "
+                      f"{','.join(self.file_ext_filter)} = {len(self.files)}")
+
+    def refresh(self):
+        # Solo se vuelven a leer los directorios cuyo mtime ha cambiado, así el coste depende del número de
+        # directorios y no del número de ficheros
+        with self.lock:
+            for dir_path, mtime in list(self.dir_mtimes.items()):
+                if dir_path not in self.dir_mtimes:
+                    continue
+                try:
+                    current_mtime = os.stat(dir_path).st_mtime_ns
+                except FileNotFoundError:
+                    self.__remove_dir__(dir_path)
+                    continue
+                if current_mtime != mtime:
+                    self.__scan_dir__(dir_path, recursive=False)
+            self.last_refresh = time.monotonic()
+
+    def get_random_file(self) -> Optional[str]:
+        if time.monotonic() - self.last_refresh >= self.refresh_interval:
+            self.refresh()
+        with self.lock:
+            if len(self.files) == 0:
+                logging.error(f"There are no files with extensions {','.join(self.file_ext_filter)} "
+                              f"in {self.walk_dir}")
+                return None
+            if self.shuffle_bag:
+                selected = self.__take_from_bag__()
+            else:
+                selected = self.files[randrange(len(self.files))]
+            self.last_selected = selected
+        return selected
+
+    def __take_from_bag__(self) -> str:
+        while True:
+            if len(self.bag) == 0:
+                self.bag = list(self.files)
+                self.bag_files = set(self.files)
+                if len(self.bag) > 1 and self.last_selected in self.file_positions:
+                    # Evita que el último sonido de una ronda sea el primero de la siguiente
+                    self.__bag_pop__(self.bag.index(self.last_selected))
+                    selected = self.__bag_pop__(randrange(len(self.bag)))
+                    self.bag.append(self.last_selected)
+                    self.bag_files.add(self.last_selected)
+                    return selected
+            selected = self.__bag_pop__(randrange(len(self.bag)))
+            # Los ficheros borrados del índice se descartan al sacarlos de la bolsa
+            if selected in self.file_positions:
+                return selected
+
+    def __bag_pop__(self, indx: int) -> str:
+        self.bag[indx], self.bag[-1] = self.bag[-1], self.bag[indx]
+        selected = self.bag.pop()
+        self.bag_files.discard(selected)
+        return selected
+
+    def __scan_dir__(self, dir_path: str, recursive: bool):
+        try:
+            self.dir_mtimes[dir_path] = os.stat(dir_path).st_mtime_ns
+            entries = list(os.scandir(dir_path))
+        except FileNotFoundError:
+            self.__remove_dir__(dir_path)
+            return
+
+        current_files = set()
+        for entry in entries:
+            # Como os.walk, no se siguen los enlaces a directorios: un enlace que apunta a un directorio padre
+            # haría que el recorrido no terminara
+            if entry.is_dir(follow_symlinks=False):
+                if recursive or entry.path not in self.dir_mtimes:
+                    self.__scan_dir__(entry.path, recursive=True)
+            elif entry.is_file() and (len(self.file_ext_filter) == 0 or
+                                      os.path.splitext(entry.name)[1] in self.file_ext_filter):
+                current_files.add(entry.path)
+
+        known_files = self.files_by_dir.get(dir_path, set())
+        for file_path in known_files - current_files:
+            self.__remove_file__(file_path)
+        for file_path in current_files - known_files:
+            self.__add_file__(file_path)
+        self.files_by_dir[dir_path] = current_files
+
+    def __remove_dir__(self, dir_path: str):
+        self.dir_mtimes.pop(dir_path, None)
+        for file_path in self.files_by_dir.pop(dir_path, set()):
+            self.__remove_file__(file_path)
+
+    def __add_file__(self, file_path: str):
+        self.file_positions[file_path] = len(self.files)
+        self.files.append(file_path)
+        # Un fichero borrado sigue en la bolsa hasta que se saca; si vuelve a aparecer no se añade otra vez
+        if self.shuffle_bag and len(self.bag) > 0 and file_path not in self.bag_files:
+            self.bag.append(file_path)
+            self.bag_files.add(file_path)
+
+    def __remove_file__(self, file_path: str):
+        # Se intercambia con el último elemento para que el borrado sea O(1)
+        indx = self.file_positions.pop(file_path)
+        last_file = self.files.pop()
+        if last_file != file_path:
+            self.files[indx] = last_file
+            self.file_positions[last_file] = indx
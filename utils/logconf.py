@@ -0,0 +1,65 @@
+import logging
+from dataclasses import dataclass
+
+
+@dataclass
+class LogConf:
+    DEFAULT_FORMAT = "%(asctime)s - [%(levelname)s] - %(processName)s : %(threadName)s - %(funcName)s : %(filename)s : %(lineno)d - %(message)s"
+    DEFAULT_LEVEL = logging.INFO
+    LEVELS_DICT = {'error': logging.ERROR,
+                   'warning': logging.WARNING,
+                   'info': logging.INFO,
+                   'debug': logging.DEBUG}
+    DEFAULT_QUEUE_SIZE = 1024
+    DEFAULT_RATE_LIMIT_BURST = 20
+    DEFAULT_FILE_MAX_SIZE_KB = 1024
+    DEFAULT_FILE_BACKUP_COUNT = 3
+
+    format: str = DEFAULT_FORMAT
+    level: int = DEFAULT_LEVEL
+    # Con queued los hilos solo encolan los registros; el formateo y la escritura se hacen en un hilo aparte
+    queued: bool = False
+    queue_size: int = DEFAULT_QUEUE_SIZE
+    # Mensajes por segundo permitidos desde cada punto del código. 0 desactiva el límite
+    rate_limit: float = 0
+    rate_limit_burst: int = DEFAULT_RATE_LIMIT_BURST
+    file_path: str = None
+    file_max_size: int = DEFAULT_FILE_MAX_SIZE_KB * 1024
+    file_backup_count: int = DEFAULT_FILE_BACKUP_COUNT
+
+    @staticmethod
+    def create_from_dict(cfg) -> 'LogConf':
+        log_conf = LogConf()
+        if 'logging' not in cfg:
+            logging.warning("No logging section into configuration file. Using default logging setup.")
+            return log_conf
+
+        logging_cfg = cfg['logging']
+        if 'format' in logging_cfg:
+            log_conf.format = logging_cfg['format']
+        else:
+            logging.warning("No logging format section into configuration file. Using default format.")
+        if 'level' in logging_cfg:
+            level_name = str(logging_cfg['level']).lower()
+            log_conf.level = LogConf.LEVELS_DICT.get(level_name, LogConf.DEFAULT_LEVEL)
+        else:
+            logging.warning("No logging level section into configuration file. Using info level.")
+        if 'queued' in logging_cfg:
+            log_conf.queued = bool(logging_cfg['queued'])
+        if 'queue_size' in logging_cfg:
+            log_conf.queue_size = int(logging_cfg['queue_size'])
+        if 'rate_limit' in logging_cfg:
+            rate_limit_cfg = logging_cfg['rate_limit'] or {}
+            log_conf.rate_limit = float(rate_limit_cfg.get('per_second', 0))
+            log_conf.rate_limit_burst = int(rate_limit_cfg.get('burst', LogConf.DEFAULT_RATE_LIMIT_BURST))
+        if 'file' in logging_cfg:
+            file_cfg = logging_cfg['file'] or {}
+            if 'path' in file_cfg:
+                log_conf.file_path = file_cfg['path']
+            else:
+                logging.warning("No logging file path section into configuration file. File logging is disabled.")
+            if 'max_size_kb' in file_cfg:
+                log_conf.file_max_size = int(file_cfg['max_size_kb'] * 1024)
+            if 'backup_count' in file_cfg:
+                log_conf.file_backup_count = int(file_cfg['backup_count'])
+        return log_conf
@@ -0,0 +1,176 @@
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from metrics.metricsregistry import DEFAULT_REGISTRY
+from utils.logconf import LogConf
+
+LOG_RECORDS_DISCARDED = DEFAULT_REGISTRY.counter('doorbell_log_records_discarded_total',
+                                                 'Log records that were not written', ['reason'])
+
+
+class RateLimitFilter(logging.Filter):
+    # Limita los mensajes de cada punto del código (fichero y línea) con un token bucket. Con f-strings cada
+    # mensaje tiene un texto distinto, así que la clase del mensaje es el sitio desde el que se emite. Los
+    # errores y mensajes críticos nunca se limitan
+
+    def __init__(self, rate: float, burst: int):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        # (fichero, línea) -> [tokens, instante de la última actualización, mensajes descartados]
+        self.buckets: Dict[Tuple[str, int], list] = {}
+        self.lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate <= 0 or record.levelno >= logging.ERROR:
+            return True
+        # En modo síncrono el filtro está en todos los handlers; el registro solo se cuenta la primera vez
+        accepted = getattr(record, 'rate_limit_accepted', None)
+        if accepted is not None:
+            return accepted
+        record.rate_limit_accepted = self.__accept__(record)
+        return record.rate_limit_accepted
+
+    def __accept__(self, record: logging.LogRecord) -> bool:
+        now = time.monotonic()
+        key = (record.pathname, record.lineno)
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [float(self.burst), now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                self.suppressed += 1
+                LOG_RECORDS_DISCARDED.labels('rate_limited').inc()
+                return False
+            bucket[0] -= 1
+            suppressed = bucket[2]
+            bucket[2] = 0
+        if suppressed:
+            # El aviso se añade como atributo y lo incorpora el formateador, que puede ejecutarse en otro hilo
+            record.suppressed = suppressed
+        return True
+
+
+class SuppressedFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            message += f" ({suppressed} similar messages suppressed)"
+        return message
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    # QueueHandler formatea el mensaje antes de encolarlo para poder enviarlo a otro proceso. Aquí la cola es del
+    # mismo proceso, así que el registro se encola tal cual y el formateo se hace en el hilo del listener. Si la
+    # cola está llena el registro se descarta: un hilo de tiempo real nunca espera por el log
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_RECORDS_DISCARDED.labels('queue_full').inc()
+
+
+class LogPipeline:
+    # Configura los handlers del logger raíz a partir de LogConf. En modo síncrono los handlers se añaden
+    # directamente; en modo encolado se añade un DeferredQueueHandler y un QueueListener escribe en ellos
+
+    def __init__(self, log_conf: LogConf = None):
+        self.log_conf = log_conf if log_conf is not None else LogConf()
+        self.rate_limit_filter = RateLimitFilter(self.log_conf.rate_limit, self.log_conf.rate_limit_burst)
+        self.sinks: List[logging.Handler] = []
+        self.queue_handler = None
+        self.listener = None
+
+    def __enter__(self):
+        self.init_context()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close_context()
+
+    def init_context(self):
+        root = logging.getLogger()
+        self.sinks = self.__create_sinks__()
+        if self.log_conf.queued:
+            self.queue_handler = DeferredQueueHandler(queue.Queue(maxsize=self.log_conf.queue_size))
+            # El filtro se aplica antes de encolar, para que los mensajes descartados no lleguen a la cola
+            self.queue_handler.addFilter(self.rate_limit_filter)
+            self.listener = logging.handlers.QueueListener(self.queue_handler.queue, *self.sinks,
+                                                           respect_handler_level=True)
+            self.listener.start()
+            root.addHandler(self.queue_handler)
+        else:
+            for sink in self.sinks:
+                sink.addFilter(self.rate_limit_filter)
+                root.addHandler(sink)
+        root.setLevel(self.log_conf.level)
+
+    def close_context(self):
+        root = logging.getLogger()
+        if self.queue_handler is not None:
+            root.removeHandler(self.queue_handler)
+            # stop() escribe lo que queda en la cola antes de terminar
+            self.listener.stop()
+            self.listener = None
+            self.queue_handler = None
+        for sink in self.sinks:
+            root.removeHandler(sink)
+            sink.close()
+        self.sinks = []
+
+    def update(self, log_conf: LogConf) -> bool:
+        # Aplica nivel, formato y límite de mensajes. Devuelve False si además hay cambios que necesitan reiniciar
+        # los handlers (cola o fichero), que no se aplican
+        restart_needed = (log_conf.queued, log_conf.queue_size, log_conf.file_path, log_conf.file_max_size,
+                          log_conf.file_backup_count) != \
+                         (self.log_conf.queued, self.log_conf.queue_size, self.log_conf.file_path,
+                          self.log_conf.file_max_size, self.log_conf.file_backup_count)
+        self.log_conf.format = log_conf.format
+        self.log_conf.level = log_conf.level
+        self.log_conf.rate_limit = log_conf.rate_limit
+        self.log_conf.rate_limit_burst = log_conf.rate_limit_burst
+        self.rate_limit_filter.rate = log_conf.rate_limit
+        self.rate_limit_filter.burst = log_conf.rate_limit_burst
+        formatter = SuppressedFormatter(log_conf.format)
+        for sink in self.sinks:
+            sink.setFormatter(formatter)
+        logging.getLogger().setLevel(log_conf.level)
+        return not restart_needed
+
+    def get_stats(self):
+        return {'queued': self.log_conf.queued,
+                'queue_size': self.queue_handler.queue.qsize() if self.queue_handler is not None else 0,
+                'dropped': self.queue_handler.dropped if self.queue_handler is not None else 0,
+                'suppressed': self.rate_limit_filter.suppressed}
+
+    def __create_sinks__(self) -> List[logging.Handler]:
+        formatter = SuppressedFormatter(self.log_conf.format)
+        sinks = [logging.StreamHandler()]
+        if self.log_conf.file_path is not None:
+            directory = os.path.dirname(os.path.abspath(self.log_conf.file_path))
+            os.makedirs(directory, exist_ok=True)
+            sinks.append(logging.handlers.RotatingFileHandler(self.log_conf.file_path,
+                                                              maxBytes=self.log_conf.file_max_size,
+                                                              backupCount=self.log_conf.file_backup_count))
+        for sink in sinks:
+            sink.setFormatter(formatter)
+        return sinks
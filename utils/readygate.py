@@ -0,0 +1,39 @@
+import logging
+import threading
+from collections import deque
+from typing import Callable
+
+
+class ReadyGate:
+    DEFAULT_MAX_PENDING = 8
+
+    def __init__(self, name: str, max_pending: int = DEFAULT_MAX_PENDING):
+        self.name = name
+        self.ready = False
+        self.pending = deque(maxlen=max_pending)
+        self.lock = threading.Lock()
+
+    def call(self, function: Callable, *args, **kwargs):
+        # Una vez abierta la puerta ya no se vuelve a cerrar, así que el camino habitual no necesita el lock
+        if self.ready:
+            function(*args, **kwargs)
+            return
+        with self.lock:
+            if not self.ready:
+                if len(self.pending) == self.pending.maxlen:
+                    logging.warning(f"{self.name} isn't ready and too many calls are pending. Dropping the oldest.")
+                self.pending.append((function, args, kwargs))
+                return
+        function(*args, **kwargs)
+
+    def open(self):
+        # Las llamadas pendientes se ejecutan con el lock cogido para que ninguna llamada nueva se adelante a ellas
+        with self.lock:
+            while len(self.pending) > 0:
+                function, args, kwargs = self.pending.popleft()
+                try:
+                    function(*args, **kwargs)
+                except Exception as e:
+                    logging.exception(f"Error running a pending call for {self.name}: {str(e)}")
+            self.ready = True
+        logging.debug(f"{self.name} is ready.")
@@ -0,0 +1,49 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+
+class StartupReport:
+    def __init__(self, started_at: float = None):
+        self.started_at = time.monotonic() if started_at is None else started_at
+        # nombre de la etapa -> (inicio, fin) en segundos desde started_at. fin es None mientras la etapa está en curso
+        self.stages: Dict[str, List[float]] = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        with self.lock:
+            self.stages[name] = [time.monotonic() - self.started_at, None]
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.stages[name][1] = time.monotonic() - self.started_at
+            logging.debug(f"Startup stage {name} took {self.get_stage_duration(name):.3f}s.")
+
+    def get_stage_duration(self, name: str) -> float:
+        with self.lock:
+            start, end = self.stages[name]
+        return None if end is None else end - start
+
+    def get_report(self) -> List[Tuple[str, float, float]]:
+        """(etapa, instante de inicio, duración) en el orden en el que empezaron las etapas."""
+        with self.lock:
+            stages = sorted(self.stages.items(), key=lambda item: item[1][0])
+        return [(name, start, None if end is None else end - start) for name, (start, end) in stages]
+
+    def get_total_time(self) -> float:
+        with self.lock:
+            ends = [end for _, end in self.stages.values() if end is not None]
+        return max(ends, default=0.0)
+
+    def log_report(self):
+        lines = [f"Startup finished in {self.get_total_time():.3f}s:"]
+        report = self.get_report()
+        width = max([10] + [len(name) for name, _, _ in report])
+        for name, start, duration in report:
+            duration_str = 'running' if duration is None else f"{duration:.3f}s"
+            lines.append(f"  {name:<{width}} started at {start:.3f}s, took {duration_str}")
+        logging.info("\n".join(lines))
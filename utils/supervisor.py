@@ -0,0 +1,168 @@
+import logging
+import signal
+import threading
+import time
+from typing import Callable, Dict, List
+
+from metrics.metricsregistry import DEFAULT_REGISTRY
+from utils.systemdnotifier import SystemdNotifier
+
+SUBSYSTEM_UP = DEFAULT_REGISTRY.gauge('doorbell_subsystem_up', 'Whether a subsystem passed its last health check',
+                                      ['subsystem'])
+SUBSYSTEM_RESTARTS = DEFAULT_REGISTRY.counter('doorbell_subsystem_restarts_total', 'Subsystem restarts',
+                                              ['subsystem'])
+
+
+class Subsystem:
+    def __init__(self, name: str, is_healthy: Callable[[], bool], restart: Callable[[], None]):
+        self.name = name
+        self.is_healthy = is_healthy
+        self.restart = restart
+        self.healthy = True
+        self.restarts = 0
+        self.consecutive_failures = 0
+        self.next_restart = 0
+        self.last_error = None
+
+    def __repr__(self):
+        return f"Subsystem[name = {self.name}, healthy = {self.healthy}, restarts = {self.restarts}, " \
+               f"consecutive_failures = {self.consecutive_failures}, last_error = {self.last_error}]"
+
+
+class Supervisor:
+    DEFAULT_CHECK_INTERVAL = 5.0
+    DEFAULT_MIN_RESTART_DELAY = 1.0
+    DEFAULT_MAX_RESTART_DELAY = 60.0
+    # Si un subsistema sigue fallando después de tantos reinicios se deja de avisar al watchdog, para que systemd
+    # reinicie el proceso entero
+    DEFAULT_MAX_CONSECUTIVE_FAILURES = 5
+
+    def __init__(self, check_interval: float = DEFAULT_CHECK_INTERVAL, notifier: SystemdNotifier = None,
+                 min_restart_delay: float = DEFAULT_MIN_RESTART_DELAY,
+                 max_restart_delay: float = DEFAULT_MAX_RESTART_DELAY,
+                 max_consecutive_failures: int = DEFAULT_MAX_CONSECUTIVE_FAILURES):
+        self.check_interval = check_interval
+        self.notifier = notifier
+        self.min_restart_delay = min_restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.max_consecutive_failures = max_consecutive_failures
+        self.subsystems: Dict[str, Subsystem] = {}
+        self.reported_failures = set()
+        self.lock = threading.Lock()
+        self.wake_event = threading.Event()
+        self.running = False
+        self.next_watchdog = 0
+
+    def add_subsystem(self, name: str, is_healthy: Callable[[], bool], restart: Callable[[], None]):
+        with self.lock:
+            self.subsystems[name] = Subsystem(name, is_healthy, restart)
+        SUBSYSTEM_UP.labels(name).set(1)
+
+    def report_failure(self, name: str):
+        # Los hilos de los subsistemas avisan al morir; así no hay que esperar a la siguiente comprobación
+        with self.lock:
+            self.reported_failures.add(name)
+        self.wake_event.set()
+
+    def stop(self):
+        self.running = False
+        self.wake_event.set()
+
+    def run(self):
+        self.running = True
+        if threading.current_thread() is threading.main_thread():
+            # Los manejadores solo despiertan al supervisor; la parada se hace fuera del manejador de la señal
+            signal.signal(signal.SIGTERM, self.__on_signal__)
+            signal.signal(signal.SIGINT, self.__on_signal__)
+        watchdog_interval = self.notifier.get_watchdog_interval() if self.notifier is not None else None
+        if self.notifier is not None:
+            self.notifier.ready()
+            if watchdog_interval is not None:
+                logging.info(f"Systemd watchdog notifications every {watchdog_interval:.1f}s.")
+
+        next_check = 0
+        while self.running:
+            now = time.monotonic()
+            if now >= next_check:
+                self.check()
+                next_check = now + self.check_interval
+            timeout = next_check - now
+            if watchdog_interval is not None:
+                self.__notify_watchdog__(now, watchdog_interval)
+                timeout = min(timeout, self.next_watchdog - now)
+            if self.wake_event.wait(timeout=max(timeout, 0)):
+                self.wake_event.clear()
+                # Un fallo notificado se atiende en cuanto llega
+                next_check = 0
+
+        logging.info("Supervisor is stopping.")
+        if self.notifier is not None:
+            self.notifier.stopping()
+
+    def check(self):
+        with self.lock:
+            subsystems = list(self.subsystems.values())
+            reported_failures = self.reported_failures
+            self.reported_failures = set()
+        for subsystem in subsystems:
+            if not self.running:
+                return
+            healthy = subsystem.name not in reported_failures and self.__is_healthy__(subsystem)
+            SUBSYSTEM_UP.labels(subsystem.name).set(1 if healthy else 0)
+            if healthy:
+                if not subsystem.healthy:
+                    logging.info(f"Subsystem {subsystem.name} is healthy again.")
+                subsystem.healthy = True
+                subsystem.consecutive_failures = 0
+                continue
+
+            if subsystem.healthy:
+                logging.error(f"Subsystem {subsystem.name} is not healthy.")
+            subsystem.healthy = False
+            now = time.monotonic()
+            if now < subsystem.next_restart:
+                continue
+            self.__restart__(subsystem)
+
+    def get_status(self) -> List[Subsystem]:
+        with self.lock:
+            return list(self.subsystems.values())
+
+    def __is_healthy__(self, subsystem: Subsystem) -> bool:
+        try:
+            return bool(subsystem.is_healthy())
+        except Exception as e:
+            subsystem.last_error = str(e)
+            logging.exception(f"Health check of subsystem {subsystem.name} failed: {str(e)}")
+            return False
+
+    def __restart__(self, subsystem: Subsystem):
+        # Backoff exponencial entre reinicios para que un subsistema que no puede arrancar no acapare la CPU
+        delay = min(self.min_restart_delay * (2 ** subsystem.consecutive_failures), self.max_restart_delay)
+        subsystem.consecutive_failures += 1
+        subsystem.next_restart = time.monotonic() + delay
+        subsystem.restarts += 1
+        SUBSYSTEM_RESTARTS.labels(subsystem.name).inc()
+        logging.warning(f"Restarting subsystem {subsystem.name} (attempt {subsystem.consecutive_failures}).")
+        try:
+            subsystem.restart()
+            subsystem.last_error = None
+        except Exception as e:
+            subsystem.last_error = str(e)
+            logging.exception(f"Subsystem {subsystem.name} couldn't be restarted: {str(e)}")
+
+    def __notify_watchdog__(self, now: float, watchdog_interval: float):
+        if now < self.next_watchdog:
+            return
+        with self.lock:
+            failing = [s.name for s in self.subsystems.values()
+                       if s.consecutive_failures >= self.max_consecutive_failures]
+        if failing:
+            logging.error(f"Subsystems {', '.join(failing)} keep failing. Watchdog notifications are stopped.")
+        else:
+            self.notifier.watchdog()
+        self.next_watchdog = now + watchdog_interval
+
+    def __on_signal__(self, signum, frame):
+        logging.info(f"Signal {signal.Signals(signum).name} received.")
+        self.stop()
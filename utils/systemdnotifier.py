@@ -0,0 +1,61 @@
+import logging
+import os
+import socket
+from typing import Optional
+
+
+class SystemdNotifier:
+    # Implementación mínima del protocolo sd_notify para no depender de libsystemd. Si el proceso no lo arranca
+    # systemd (no existe NOTIFY_SOCKET) todas las notificaciones se ignoran
+
+    def __init__(self, socket_path: str = None):
+        self.socket_path = socket_path if socket_path is not None else os.environ.get('NOTIFY_SOCKET')
+        self.socket = None
+
+    def is_enabled(self) -> bool:
+        return bool(self.socket_path)
+
+    def get_watchdog_interval(self) -> Optional[float]:
+        # systemd recomienda avisar a la mitad del tiempo configurado en WatchdogSec
+        watchdog_usec = os.environ.get('WATCHDOG_USEC')
+        watchdog_pid = os.environ.get('WATCHDOG_PID')
+        if not self.is_enabled() or not watchdog_usec:
+            return None
+        if watchdog_pid and watchdog_pid != str(os.getpid()):
+            return None
+        try:
+            return int(watchdog_usec) / 1e6 / 2
+        except ValueError:
+            logging.warning(f"Invalid WATCHDOG_USEC value {watchdog_usec}. Watchdog notifications are disabled.")
+            return None
+
+    def ready(self) -> bool:
+        return self.notify("READY=1")
+
+    def watchdog(self) -> bool:
+        return self.notify("WATCHDOG=1")
+
+    def stopping(self) -> bool:
+        return self.notify("STOPPING=1")
+
+    def status(self, status: str) -> bool:
+        return self.notify(f"STATUS={status}")
+
+    def notify(self, state: str) -> bool:
+        if not self.is_enabled():
+            return False
+        # Los sockets que empiezan por @ están en el espacio de nombres abstracto de Linux
+        address = '\0' + self.socket_path[1:] if self.socket_path.startswith('@') else self.socket_path
+        try:
+            if self.socket is None:
+                self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC)
+            self.socket.sendto(state.encode(), address)
+            return True
+        except OSError as e:
+            logging.error(f"Notification {state} couldn't be sent to {self.socket_path}: {str(e)}")
+            return False
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None